@@ -1,7 +1,7 @@
 
 import StimToolLib, os, random, operator
 from psychopy import visual, core, event, data, gui, sound
-import itertools
+from PlanningTask import scoring, stim_state, hud, timeline, schedule_compiler
 
 # Planning Task
 # Markov-Decision Making
@@ -34,73 +34,20 @@ class GlobalVars:
         self.points = 0
         self.hand = 'right'
         self.errorMax = 1 # Can only make this much error
+        self.boardCache = {} # Snapshots of the board (BufferImageStim), baked in setup--see bakeBoards
+        self.stimState = stim_state.StimState() # Only touches stimulus attributes that changed, counts applied/skipped updates per frame
+        self.hud = None # Text stimuli created once per run and reused by every screen--see hud.Hud
+        self.frame_timer = None # Set by StimToolLib.general_setup, records every flip--see set_phase
+        self.timeline = None # Planned onsets of the scanned trials (timeline.Timeline), compiled from the schedule--see record_onset
+        self.timeline_origin = None # Task onset, the time the timeline's onsets count from
+        self.statePositions = {1: (.2,.3), 2: (-.2,.3), 3: (-.4,0), 4: (-.2,-.4), 5: (.2,-.4), 6: (.4,0)} # Where each box is drawn
         #self.line_location_range = 0.7 #amount the lines (vertical and horizontal) can move left/right and up/down
 
         # Key - Value pair, 
         # Key is the current state, 
         # Value is dictionary corresonding to next state by choosing 'left' or right
-        self.states = {
-            1 : {
-                'left': {
-                    'state': 2,
-                    'value': 140
-                },
-                'right': {
-                    'state': 4,
-                    'value': 20,
-                }
-            },
-            2 : {
-                'left': {
-                    'state': 3,
-                    'value': -20
-                },
-                'right': {
-                    'state': 5,
-                    'value': -70
-                }
-            },
-            3 : {
-                'left': {
-                    'state': 6,
-                    'value': -70
-                },
-                'right': {
-                    'state': 4,
-                    'value': -20
-                }
-            },
-            4 : {
-                'left': {
-                    'state': 2,
-                    'value': 20
-                },
-                'right': {
-                    'state': 5,
-                    'value': -20
-                }
-            },
-            5 : {
-                'left': {
-                    'state': 1,
-                    'value': -70
-                },
-                'right': {
-                    'state': 6,
-                    'value': -20
-                }
-            },
-            6 : {
-                'left': {
-                    'state': 3,
-                    'value': 20
-                },
-                'right': {
-                    'state': 1,
-                    'value': -20
-                }
-            }
-        }
+        # The graph itself lives in scoring.STATES so the outcome table and the task share it
+        self.states = scoring.copy_states()
 
         self.pathColor = {
             'left': 'blue',
@@ -127,14 +74,43 @@ event_types = {
     }
 
 
+def flip():
+    """
+    Flip the window--every frame of the task goes through here
+    """
+    g.stimState.end_frame()
+    g.win.flip()
+
+def set_phase(phase):
+    """
+    Tag the following flips with the current trial and phase in the frame timing summary
+    """
+    if g.frame_timer: g.frame_timer.set_phase(g.trial, phase)
+
+
+def set_run_phase(run_phase):
+    """
+    Tag the following flips with the part of the run--example and task trials share trial numbers
+    """
+    if g.frame_timer: g.frame_timer.set_run_phase(run_phase)
+
+
+def record_onset(phase, now):
+    """
+    Actual onset of a phase of the current trial, next to its planned onset in the timeline
+    """
+    if g.timeline: g.timeline.record(g.trial, phase, now - g.timeline_origin)
+
+
 def show_fixation(trial_start, duration):
     """
     Show Fixation 
     """
+    set_phase('FIXATION')
 
     StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['FIXATION_ONSET'], trial_start, 'NA', 'NA', duration, g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
     g.fixation.draw()
-    g.win.flip()
+    flip()
     StimToolLib.just_wait(g.clock, trial_start + duration - g.offset) # wait
 
 
@@ -142,11 +118,7 @@ def getPossilbeTransitions(depth):
     """
     Get the possible transistions
     """
-    transitions = []
-    stuff = [1, 2]
-    for subset in list(itertools.combinations_with_replacement(['left', 'right'], depth) ):
-        transitions.append(list(subset))
-    return transitions
+    return scoring.get_possible_transitions(depth)
 
 def getSum(points):
     """
@@ -161,36 +133,14 @@ def getPoints(start_state, transitions):
     """
     Returns the points in each transition
     """
-    points = []
-    current_state = start_state
-    for transition in transitions:
-        value_point = g.states[current_state][transition]['value']
-        points.append(value_point)
-        current_state = g.states[current_state][transition]['state']
-    return points
+    return scoring.get_path_points(start_state, transitions, g.states)
 
 def isOLLTrial(initial_state, depth):
     """
     Returns True if the maximum possible points requires a large loss
     """
-    maxPoints = -1000
-    isOLL = False
-    #largest_loss_possible = getLargestLossPosssible(initial_state, depth)
-    for transitions in getPossilbeTransitions(depth):
-        points_path = getPoints(initial_state, transitions)
-        totalPoints = getSum(points_path)
-        # Sum only where exists an LL
-        if (totalPoints >= maxPoints): maxPoints = totalPoints
-
-    # maxPoints should now be set 
-    # iteate again to see if that max points includes a large loss
-    for transitions in getPossilbeTransitions(depth):
-        points_path = getPoints(initial_state, transitions)
-        totalPoints = getSum(points_path)
-        # Sum only where exists an LL
-        if (totalPoints == maxPoints) and (-70 in points_path):
-            isOLL = True
-    return maxPoints, isOLL
+    info = scoring.get_outcome_info(initial_state, depth)
+    return info['max_points'], info['is_oll']
 
 
 def getAversivePruningPoints(initial_state, depth):
@@ -198,16 +148,7 @@ def getAversivePruningPoints(initial_state, depth):
     Get 2nd best max points
     Used for OLL trials
     """
-    points = []
-    for transitions in getPossilbeTransitions(depth):
-        points_path = getPoints(initial_state, transitions)
-        points.append(getSum(points_path))
-    
-    # sort unique
-    unique_points = list(set(points))
-    unique_points.sort(reverse = True)
-    #print(unique_points)
-    return unique_points[1]
+    return scoring.get_outcome_info(initial_state, depth)['ap_points']
 
 
 def getOutcome(start_state, depth, transitions):
@@ -219,32 +160,9 @@ def getOutcome(start_state, depth, transitions):
     4) ONLL Error           | subOptimal sequence but includes large loss
     5) OLL Error            | suboptimal sequence that avoicd large loss
     6) Miss: Did not enter enough moves
+    Looked up in the precomputed scoring.OUTCOME_TABLE
     """
-    if len(transitions) < depth: return 'Miss'
-
-    # 
-    #largest_loss_possible = getLargestLossPosssible(start_state, depth)
-    #largest_points_possible = getMaxPointsPossible(start_state, depth)
-
-    points_path = getPoints(start_state, transitions)
-    points_earned = getSum(points_path)
-
-    
-    # Avoid larger loss and got the most opints without LL
-
-    maxPoints, isOLL = isOLLTrial(start_state, depth)
-    avPoints = getAversivePruningPoints(start_state, depth)
-    
-    if isOLL:
-        if points_earned == maxPoints: return 'OLL Correct'
-        else:
-            if points_earned == avPoints:
-                return 'Aversive Pruning'
-            else:
-                return 'OLL Error'
-    else:
-        if points_earned == maxPoints: return 'ONLL Correct'
-        if points_earned != maxPoints: return 'ONLL Error'
+    return scoring.classify_outcome(start_state, depth, transitions)
 
 
 
@@ -252,8 +170,7 @@ def run(session_params, run_params):
     global g
     g = GlobalVars()
     g.session_params = session_params
-    g.run_params = StimToolLib.get_var_dict_from_file(os.path.dirname(__file__) + '/PlanningTask.Default.params', {})
-    g.run_params.update(run_params)
+    g.run_params = StimToolLib.load_config([os.path.dirname(__file__) + '/PlanningTask.Default.params', ('task list', run_params)])
     
     #print os.path.exists(os.path.dirname(__file__) + '/PlanningTask.Default.params')
     try:
@@ -261,10 +178,20 @@ def run(session_params, run_params):
         g.status = 0
     except StimToolLib.QuitException as q:
         g.status = -1
+    if getattr(g, 'prefix', None): write_stim_log(g.prefix + '_stims.txt')
+    if g.timeline and getattr(g, 'prefix', None): g.timeline.write(g.prefix + '_timeline.csv')
     StimToolLib.task_end(g)
     return g.status
         
 
+def write_stim_log(filename):
+    """
+    Stimulus update and text allocation counts of the run, next to the behavioral file
+    """
+    with open(filename, 'w') as fout:
+        fout.write(g.stimState.summary() + '\n')
+        if g.hud: fout.write(g.hud.summary() + '\n')
+
 def getNextButton(start_state, goal_state):
     """
     Give the start and goal_state
@@ -279,60 +206,18 @@ def getNextButton(start_state, goal_state):
 def resetStates():
     """
     Sets all the states to default
+    Goes through g.stimState, so only attributes that differ from the last frame are touched
     """
-    g.states[1]['stim'].size = [g.rectangleSize,g.rectangleSize]
-    g.states[1]['stim'].fillColor=g.defaultColor
-    g.states[1]['stim'].lineColor = g.defaultColor
-    g.states[1]['stim'].pos = (.2,.3)
-    #g.states[1]['stim'].setAutoDraw(True)
-
-
-
-    g.states[2]['stim'].size = [g.rectangleSize,g.rectangleSize]
-    g.states[2]['stim'].fillColor=g.defaultColor
-    g.states[2]['stim'].lineColor = g.defaultColor
-    g.states[2]['stim'].pos = (-.2,.3)
-    #g.states[2]['stim'].setAutoDraw(True)
-
-
-    g.states[3]['stim'].size = [g.rectangleSize,g.rectangleSize]
-    g.states[3]['stim'].fillColor=g.defaultColor
-    g.states[3]['stim'].lineColor = g.defaultColor
-    g.states[3]['stim'].pos = (-.4,0)
-    #g.states[3]['stim'].setAutoDraw(True)
-
-
-    g.states[4]['stim'].size = [g.rectangleSize,g.rectangleSize]
-    g.states[4]['stim'].fillColor=g.defaultColor
-    g.states[4]['stim'].lineColor = g.defaultColor
-    g.states[4]['stim'].pos = (-.2,-.4)
-    #g.states[4]['stim'].setAutoDraw(True)
-
-
-    g.states[5]['stim'].size = [g.rectangleSize,g.rectangleSize]
-    g.states[5]['stim'].fillColor=g.defaultColor
-    g.states[5]['stim'].lineColor = g.defaultColor
-    g.states[5]['stim'].pos = (.2,-.4)
-    #g.states[5]['stim'].setAutoDraw(True)
-
-
-    g.states[6]['stim'].size = [g.rectangleSize,g.rectangleSize]
-    g.states[6]['stim'].fillColor=g.defaultColor
-    g.states[6]['stim'].lineColor = g.defaultColor
-    g.states[6]['stim'].pos = (.4,0)
-    #g.states[6]['stim'].setAutoDraw(True)
+    for n in g.states:
+        g.stimState.set(g.states[n]['stim'], size = (g.rectangleSize,g.rectangleSize), fillColor = g.defaultColor, lineColor = g.defaultColor, pos = g.statePositions[n])
  
 
 def setStates():
     """
     Sets all the states to default
     """
-    g.states[1]['stim'] = visual.Rect(g.win, size = [g.rectangleSize,g.rectangleSize], units = 'norm', fillColor=g.defaultColor, lineColor = g.defaultColor, pos = (.2,.3) )
-    g.states[2]['stim'] = visual.Rect(g.win, size = [g.rectangleSize,g.rectangleSize], units = 'norm', fillColor=g.defaultColor, lineColor = g.defaultColor, pos = (-.2,.3))
-    g.states[3]['stim'] = visual.Rect(g.win, size = [g.rectangleSize,g.rectangleSize], units = 'norm', fillColor=g.defaultColor, lineColor = g.defaultColor, pos = (-.4,0) )
-    g.states[4]['stim'] = visual.Rect(g.win, size = [g.rectangleSize,g.rectangleSize], units = 'norm', fillColor=g.defaultColor, lineColor = g.defaultColor, pos = (-.2,-.4))
-    g.states[5]['stim'] = visual.Rect(g.win, size = [g.rectangleSize,g.rectangleSize], units = 'norm', fillColor=g.defaultColor, lineColor = g.defaultColor, pos = (.2,-.4))
-    g.states[6]['stim'] = visual.Rect(g.win, size = [g.rectangleSize,g.rectangleSize], units = 'norm', fillColor=g.defaultColor, lineColor = g.defaultColor, pos = (.4,0) )
+    for n in g.states:
+        g.states[n]['stim'] = visual.Rect(g.win, size = [g.rectangleSize,g.rectangleSize], units = 'norm', fillColor=g.defaultColor, lineColor = g.defaultColor, pos = g.statePositions[n])
 
 
 def setTransitions():
@@ -340,49 +225,50 @@ def setTransitions():
     Set Stim Transitions
     """
     g.states[1]['left']['arrow'] = visual.ShapeStim(g.win, vertices = [(.18,.42), (-.10, .42), (-.10, .44), (-.18, .4), (-.10, .36), (-.10, .38), (.18, .38)], size=.5, lineColor='white', units = 'norm', pos = (0,.1))
-    g.states[1]['left']['valueText'] = visual.TextStim(g.win, text = '+' + str(g.states[1]['left']['value']) , units = 'norm', pos = (0,.4), height = .08)
+    g.states[1]['left']['valueText'] = g.hud.new_text(text = '+' + str(g.states[1]['left']['value']) , pos = (0,.4), height = .08)
 
     g.states[1]['right']['arrow'] = visual.ShapeStim(g.win, vertices = [(-.22, -.54), (-.22, .28), (-.24, .28), (-.2, .38), (-.16, .28), (-.18 , .28), (-.18, -.54)], size=.5, lineColor='white', units = 'norm', pos = (-.1,0), ori = 210)
-    g.states[1]['right']['valueText'] = visual.TextStim(g.win, text = '+' + str(g.states[1]['right']['value']) , units = 'norm', pos = (.1,0), height = .08)
+    g.states[1]['right']['valueText'] = g.hud.new_text(text = '+' + str(g.states[1]['right']['value']) , pos = (.1,0), height = .08)
     
 
     g.states[2]['left']['arrow'] = visual.ShapeStim(g.win, vertices = [(.18,.42), (-.10, .42), (-.10, .44), (-.18, .4), (-.10, .36), (-.10, .38), (.18, .38)], size=.5, lineColor='white', units = 'norm', pos = (-.18,.08), ori = 300)
-    g.states[2]['left']['valueText'] = visual.TextStim(g.win, text = str(g.states[2]['left']['value']) , units = 'norm', pos = (-.4,.30), height = .08)
+    g.states[2]['left']['valueText'] = g.hud.new_text(text = str(g.states[2]['left']['value']) , pos = (-.4,.30), height = .08)
 
     g.states[2]['right']['arrow'] = visual.ShapeStim(g.win, vertices = [(-.22, -.54), (-.22, .28), (-.24, .28), (-.2, .38), (-.16, .28), (-.18 , .28), (-.18, -.54)], size=.5, lineColor='white', units = 'norm', pos = (-.1,-.13), ori = 145)
-    g.states[2]['right']['valueText'] = visual.TextStim(g.win, text = str(g.states[2]['right']['value']) , units = 'norm', pos = (0,0), height = .08)
+    g.states[2]['right']['valueText'] = g.hud.new_text(text = str(g.states[2]['right']['value']) , pos = (0,0), height = .08)
 
     g.states[3]['left']['arrow'] = visual.ShapeStim(g.win, vertices = [(-.22, -.54), (-.22, .28), (-.24, .28), (-.2, .38), (-.16, .28), (-.18 , .28), (-.18, -.54)], size=.5, lineColor='white', units = 'norm', pos = (0.04,- 0.1), ori= 90)
-    g.states[3]['left']['valueText'] = visual.TextStim(g.win, text = str(g.states[3]['left']['value']) , units = 'norm', pos = (0,.1), height = .08)
+    g.states[3]['left']['valueText'] = g.hud.new_text(text = str(g.states[3]['left']['value']) , pos = (0,.1), height = .08)
 
 
     g.states[3]['right']['arrow'] = visual.ShapeStim(g.win, vertices = [(.18,.42), (-.10, .42), (-.10, .44), (-.18, .4), (-.10, .36), (-.10, .38), (.18, .38)], size=.5, lineColor='white', units = 'norm', pos = (-.18,-.1), ori = 235)
-    g.states[3]['right']['valueText'] = visual.TextStim(g.win, text = str(g.states[3]['right']['value']) , units = 'norm', pos = (-.4,-.30), height = .08)
+    g.states[3]['right']['valueText'] = g.hud.new_text(text = str(g.states[3]['right']['value']) , pos = (-.4,-.30), height = .08)
 
     g.states[4]['left']['arrow'] = visual.ShapeStim(g.win, vertices = [(-.22, -.54), (-.22, .28), (-.24, .28), (-.2, .38), (-.16, .28), (-.18 , .28), (-.18, -.54)], size=.5, lineColor='white', units = 'norm', pos = (-.1,0))
-    g.states[4]['left']['valueText'] = visual.TextStim(g.win, text = '+' + str(g.states[4]['left']['value']) , units = 'norm', pos = (-.14,0), height = .08)
+    g.states[4]['left']['valueText'] = g.hud.new_text(text = '+' + str(g.states[4]['left']['value']) , pos = (-.14,0), height = .08)
     
     g.states[4]['right']['arrow'] = visual.ShapeStim(g.win, vertices = [(.18,.42), (-.10, .42), (-.10, .44), (-.18, .4), (-.10, .36), (-.10, .38), (.18, .38)], size=.5, lineColor='white', units = 'norm', pos = (0,-.2), ori = 180)
-    g.states[4]['right']['valueText'] = visual.TextStim(g.win, text = str(g.states[4]['right']['value']) , units = 'norm', pos = (0,-.3), height = .08)
+    g.states[4]['right']['valueText'] = g.hud.new_text(text = str(g.states[4]['right']['value']) , pos = (0,-.3), height = .08)
 
     g.states[5]['left']['arrow'] = visual.ShapeStim(g.win, vertices = [(-.22, -.54), (-.22, .28), (-.24, .28), (-.2, .38), (-.16, .28), (-.18 , .28), (-.18, -.54)], size=.5, lineColor='white', units = 'norm', pos = (.3,0))
-    g.states[5]['left']['valueText'] = visual.TextStim(g.win, text = str(g.states[5]['left']['value']) , units = 'norm', pos = (.14,0), height = .08)
+    g.states[5]['left']['valueText'] = g.hud.new_text(text = str(g.states[5]['left']['value']) , pos = (.14,0), height = .08)
 
     g.states[5]['right']['arrow'] = visual.ShapeStim(g.win, vertices = [(.18,.42), (-.10, .42), (-.10, .44), (-.18, .4), (-.10, .36), (-.10, .38), (.18, .38)], size=.5, lineColor='white', units = 'norm', pos = (.18,-.12), ori = 115)
-    g.states[5]['right']['valueText'] = visual.TextStim(g.win, text = str(g.states[5]['right']['value']) , units = 'norm', pos = (.4,-.30), height = .08)
+    g.states[5]['right']['valueText'] = g.hud.new_text(text = str(g.states[5]['right']['value']) , pos = (.4,-.30), height = .08)
 
     g.states[6]['left']['arrow'] = visual.ShapeStim(g.win, vertices = [(-.22, -.54), (-.22, .28), (-.24, .28), (-.2, .38), (-.16, .28), (-.18 , .28), (-.18, -.54)], size=.5, lineColor='white', units = 'norm', pos = (-.04,0.1), ori= 270)
-    g.states[6]['left']['valueText'] = visual.TextStim(g.win, text = '+' + str(g.states[6]['left']['value']) , units = 'norm', pos = (0,.1), height = .08)
+    g.states[6]['left']['valueText'] = g.hud.new_text(text = '+' + str(g.states[6]['left']['value']) , pos = (0,.1), height = .08)
 
     g.states[6]['right']['arrow'] = visual.ShapeStim(g.win, vertices = [(.18,.42), (-.10, .42), (-.10, .44), (-.18, .4), (-.10, .36), (-.10, .38), (.18, .38)], size=.5, lineColor='white', units = 'norm', pos = (.18,.1), ori = 60)
-    g.states[6]['right']['valueText'] = visual.TextStim(g.win, text = str(g.states[6]['right']['value']) , units = 'norm', pos = (.4,.30), height = .08)
+    g.states[6]['right']['valueText'] = g.hud.new_text(text = str(g.states[6]['right']['value']) , pos = (.4,.30), height = .08)
 
 def doFreeTraining(duration):
     """
     Free Duration: Subject has limited time traversing across the map
     """
+    set_phase('FREE_TRAINING')
     #print 'on freeTraining'
-    g.win.flip() # clear window
+    flip() # clear window
 
     start_state = random.randrange(1,7) # Random state from 1,6
     current_state = start_state
@@ -390,7 +276,8 @@ def doFreeTraining(duration):
     transition_path = []
 
     timer = duration
-    timerstim = visual.TextStim(g.win, text = str(timer), units = 'norm', pos = (0,0.7), height = .15)
+    timerstim = g.hud.timer
+    g.hud.reset(timerstim, str(timer))
 
     now = g.clock.getTime()
     
@@ -401,33 +288,18 @@ def doFreeTraining(duration):
 
         k = event.getKeys([ g.session_params[g.run_params['select_1']], g.session_params[g.run_params['select_2']], 's']) 
         
+        # Draw boxes (current state enlarged and white) and the last transition
+        drawBoard(current_state, transition_path = transition_path if g.show_transitions else None, show_value = g.show_transitions_value, enlarge_current = True)
+
         # Draw Timer
         timer =  "%i" % int((now + duration) - g.clock.getTime())
-        timerstim.setText(timer)
+        g.stimState.set(timerstim, text = timer)
         timerstim.draw()
 
-        resetStates()
-
-        g.states[current_state]['stim'].size = [g.rectangleSize + 0.02, g.rectangleSize + 0.02]
-        g.states[current_state]['stim'].fillColor = g.targetColor  # Set the curent white Color
-        g.states[current_state]['stim'].lineColor = g.targetOutline 
-        
-        # Draw boxes
-        drawBoxes()
-
-        if g.show_transitions and len(transition_path) > 1:
-            g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-            g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
-            g.states[transition_path[0]][transition_path[1]]['arrow'].draw()
-            if g.show_transitions_value:
-                g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
-            #g.states[current_state]['left']['arrow'].draw()
-
-        g.win.flip()
+        flip()
         # Press left
         if not len(k) == 0:
-            g.states[current_state]['stim'].fillColor = g.defaultColor
-            g.states[current_state]['stim'].lineColor = g.defaultColor
+            g.stimState.set(g.states[current_state]['stim'], fillColor = g.defaultColor, lineColor = g.defaultColor)
             last_state = current_state
             if k[0] == g.session_params[g.run_params['select_1']]:
                 resp = -1
@@ -454,6 +326,68 @@ def drawBoxes():
     g.states[5]['stim'].draw()
     g.states[6]['stim'].draw()
 
+def bakeBoard(current_state, transition_path, show_value, enlarge_current):
+    """
+    Draw one board variant with the Rects/arrows and capture it as a single image.
+    BufferImageStim clears the back buffer after capturing, so this must happen before
+    anything else is drawn in the frame
+    """
+    resetStates()
+    for n in g.states:
+        g.stimState.set(g.states[n]['stim'], lineWidth = 1.5)
+
+    # Current State
+    if current_state is not None:
+        if enlarge_current:
+            g.stimState.set(g.states[current_state]['stim'], size = [g.rectangleSize + 0.02, g.rectangleSize + 0.02])
+        g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
+    stims = [g.states[n]['stim'] for n in sorted(g.states)]
+    if transition_path:
+        arrow = g.states[transition_path[0]][transition_path[1]]['arrow']
+        g.stimState.set(arrow, fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
+        stims.append(arrow)
+        if show_value:
+            stims.append(g.states[transition_path[0]][transition_path[1]]['valueText'])
+
+    board = visual.BufferImageStim(g.win, stim = stims)
+    resetStates()
+    return board
+
+def boardKey(current_state, transition_path, show_value, enlarge_current):
+    if transition_path is not None and len(transition_path) < 2: transition_path = None
+    return (current_state, tuple(transition_path) if transition_path else None, bool(transition_path and show_value), enlarge_current)
+
+def bakeBoards(show_value = False):
+    """
+    Bake every board variant drawBoard can be asked for, so no capture happens in a timed loop:
+    each state as the current one (plain in the task trials, enlarged in training) and each transition
+    with the state it leads to. Call during setup; variants already baked are kept
+    """
+    variants = [(n, None, False, enlarge) for n in g.states for enlarge in (False, True)]
+    variants += [(g.states[n][move]['state'], [n, move], show_value, True) for n in g.states for move in ('left', 'right')]
+    for current_state, transition_path, value, enlarge_current in variants:
+        key = boardKey(current_state, transition_path, value, enlarge_current)
+        if key not in g.boardCache:
+            g.boardCache[key] = bakeBoard(current_state, transition_path, value, enlarge_current)
+
+def drawBoard(current_state = None, goal_state = None, transition_path = None, show_value = False, enlarge_current = False):
+    """
+    Draw the board with the given highlights as one cached image (see bakeBoards), with the goal box on top.
+    Call it first in a frame: the snapshot covers the whole window
+    """
+    key = boardKey(current_state, transition_path, show_value, enlarge_current)
+    if key not in g.boardCache: # Not baked in setup, should not happen
+        g.boardCache[key] = bakeBoard(*key)
+    g.boardCache[key].draw()
+
+    # Goal State (training only)
+    if goal_state is not None:
+        on_goal = current_state == goal_state
+        size = g.rectangleSize + (0.02 if on_goal and enlarge_current else 0)
+        g.stimState.set(g.states[goal_state]['stim'], size = (size, size), fillColor = g.goalColor,
+            lineColor = g.targetOutline if on_goal else g.goalColor, lineWidth = 4 if on_goal else 1.5)
+        g.states[goal_state]['stim'].draw()
+
 def set_autodraw(setA):
     g.states[1]['stim'].setAutoDraw(setA)
     g.states[2]['stim'].setAutoDraw(setA)
@@ -469,23 +403,23 @@ def doGoalTraining(trials):
     """
     TOTAL_TRIALS = len(trials)
     #print 'on GoalTraining'
-    g.win.flip()
+    set_phase('GOAL_TRAINING')
+    flip()
     
     topText = 'Get to the Red Goal with your LAST move.'
-    topTextstim = visual.TextStim(g.win, text = topText, units = 'norm', pos = (0,0.7), height = .07)
+    topTextstim = g.hud.top
+    g.hud.reset(topTextstim, topText)
     
 
     midText = "You have %i moves" % 0
-    midTextstim = visual.TextStim(g.win, text = midText, units = 'norm', pos = (0,0), height = .07)
-
-    goalTextstim = visual.TextStim(g.win, text = 'Goal', units = 'norm', pos = (0,0), height = .07, color = g.goalTextColor)
+    midTextstim = g.hud.mid
+    g.hud.reset(midTextstim, midText, pos = (0,.6))
 
     final_state = 0
     goal_state = 0
 
     transition_path = []
 
-    midTextstim.pos = (0,.6)
     
     for idx,trial in enumerate(trials):
         # Repeat only until we reach the total depths
@@ -496,7 +430,7 @@ def doGoalTraining(trials):
             goal_state = int(trial[2])
 
             resetStates()
-            g.win.flip()
+            flip()
 
             current_state = start_state
             last_state = 1
@@ -504,54 +438,22 @@ def doGoalTraining(trials):
             while depth > 0:
                 
                 StimToolLib.check_for_esc()
-                topTextstim.setText('Get to the Red Goal with your LAST move' )
-                if depth > 1:
-                    midTextstim.setText("You have %i moves left. " % depth)
-                else:
-                    midTextstim.setText("You have %i move left. " % depth)
-
-                topTextstim.draw()
-                midTextstim.draw()
-
-                resetStates()
-
-                # Current States
-                g.states[current_state]['stim'].size = [g.rectangleSize + 0.02, g.rectangleSize + 0.02]
-                g.states[current_state]['stim'].fillColor = g.targetColor
-                g.states[current_state]['stim'].lineColor = g.targetOutline
-
-                # Goal State
-                g.states[goal_state]['stim'].fillColor = g.goalColor
-                g.states[goal_state]['stim'].lineColor = g.goalColor
-            
-
-                if current_state == goal_state:
-                    g.states[current_state]['stim'].setLineWidth(4)
-                    g.states[current_state]['stim'].lineColor = g.targetOutline
 
-                drawBoxes()
+                # Current state, goal state and the last transition
+                drawBoard(current_state, goal_state, transition_path if g.show_transitions else None, g.show_transitions_values, enlarge_current = True)
 
-                goalTextstim.setPos(g.states[goal_state]['stim'].pos)
-                goalTextstim.draw()
+                g.hud.draw_text(topTextstim, 'Get to the Red Goal with your LAST move' )
+                if depth > 1:
+                    g.hud.draw_text(midTextstim, "You have %i moves left. " % depth)
+                else:
+                    g.hud.draw_text(midTextstim, "You have %i move left. " % depth)
 
-                # Show the Trial Tracker
-                trialTracekrStim = visual.TextStim(g.win, text = '%s/%s' % (idx, TOTAL_TRIALS), units = 'norm', height = .05, pos = (0,-0.85))
-                trialTracekrStim.draw()
+                g.hud.draw_goal(g.states[goal_state]['stim'].pos)
 
-                # Show Error:
-                erroCount = visual.TextStim(g.win, text = 'Errors: %s' % g.goalErrors, units = 'norm', height = .05, pos = (0,-0.90), color = 'red')
-                erroCount.draw()
+                # Show the Trial Tracker and Errors
+                g.hud.draw_progress(idx, TOTAL_TRIALS, g.goalErrors)
 
-                # Show Transitions if path exists
-                if g.show_transitions and len(transition_path) > 1:
-                    g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-                    g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
-                    g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
-                    if g.show_transitions_values:
-                        g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
-                
-                #g.states[current_state]['left']['arrow'].draw()
-                g.win.flip()
+                flip()
 
                 event.clearEvents() # Clear Events in the event buffer
 
@@ -576,67 +478,33 @@ def doGoalTraining(trials):
                 #print trial, start_state, goal_state, current_state, k
                 depth = depth - 1
                 
-            resetStates()
-            g.states[current_state]['stim'].size = [g.rectangleSize + 0.02, g.rectangleSize + 0.02]
-            g.states[current_state]['stim'].fillColor = g.targetColor
-            g.states[current_state]['stim'].lineColor = g.targetOutline
+            drawBoard(current_state, goal_state, transition_path if g.show_transitions else None, g.show_transitions_values, enlarge_current = True)
 
-            
-            g.states[goal_state]['stim'].fillColor = g.goalColor
-            g.states[goal_state]['stim'].lineColor = g.goalColor
-
-            if current_state == goal_state:
-                g.states[current_state]['stim'].setLineWidth(4)
-                g.states[current_state]['stim'].lineColor = g.targetOutline
-            
-            drawBoxes()
-
-            goalTextstim.setPos(g.states[goal_state]['stim'].pos)
-            goalTextstim.draw()
-
-            # Show the Trial Tracker
-            trialTracekrStim = visual.TextStim(g.win, text = '%s/%s' % (idx, TOTAL_TRIALS), units = 'norm', height = .05, pos = (0,-0.85))
-            trialTracekrStim.draw()
-
-            # Show Error:
-            erroCount = visual.TextStim(g.win, text = 'Errors: %s' % g.goalErrors, units = 'norm', height = .05, pos = (0,-0.90), color = 'red')
-            erroCount.draw()
-
-            # Show Transitions if path exists
-            if g.show_transitions and len(transition_path) > 1:
-                g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-                g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
-                g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
-                if g.show_transitions_values:
-                    g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
+            g.hud.draw_goal(g.states[goal_state]['stim'].pos)
 
+            # Show the Trial Tracker and Errors
+            g.hud.draw_progress(idx, TOTAL_TRIALS, g.goalErrors)
             
             now = g.clock.getTime()
 
-            midTextstim.pos = (0,.6)
             if current_state == goal_state: 
-                midTextstim.color = '#00FF00'
-                
                 if g.goalErrors > 0:
-                    midTextstim.setText("Nice! That was it!")
+                    g.hud.draw_text(midTextstim, "Nice! That was it!", color = '#00FF00')
                 else: 
-                    midTextstim.setText("Good Job!")
-                midTextstim.draw()
+                    g.hud.draw_text(midTextstim, "Good Job!", color = '#00FF00')
                 repeat = False
                 # Exit if error Max reached
                 if g.goalErrors > g.errorMax: 
-                    g.win.flip()
+                    flip()
                     StimToolLib.just_wait(g.clock, now + 1) # wait 1 seconds
                     return
             else:
-                midTextstim.color = '#FF0000'
-                midTextstim.setText("That was incorrect. Please try again. ")
-                midTextstim.draw()
+                g.hud.draw_text(midTextstim, "That was incorrect. Please try again. ", color = '#FF0000')
                 depth = int(trial[0])
                 g.goalErrors = g.goalErrors + 1
                 repeat = True
 
-            g.win.flip()
+            flip()
             StimToolLib.just_wait(g.clock, now + 1) # wait 1 seconds
 
 def doPathTest(trials):
@@ -645,14 +513,16 @@ def doPathTest(trials):
     """
     TOTAL_TRIALS = len(trials)
     #print 'on GoalTraining'
-    g.win.flip()
+    set_phase('PATH_TEST')
+    flip()
     
     final_state = 0
     goal_state = 0
 
     transition_path = []
 
-    goalTextstim = visual.TextStim(g.win, text = 'Goal', units = 'norm', pos = (0,0), height = .07, color = g.goalTextColor)
+    topTextstim = g.hud.top
+    midTextstim = g.hud.mid
     
     for idx,trial in enumerate(trials):
         # Repeat only until we reach the total depths
@@ -666,26 +536,21 @@ def doPathTest(trials):
         transition_path = [start_state, correct_key]
 
         resetStates()
-        g.win.flip()
+        flip()
 
         current_state = start_state
         
         # # Current States
-        g.states[current_state]['stim'].fillColor = g.targetColor
-        g.states[current_state]['stim'].lineColor = g.targetOutline
-
+        g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
         # Goal State
-        g.states[goal_state]['stim'].fillColor = g.goalColor
-        g.states[goal_state]['stim'].lineColor = g.goalColor
-    
+        g.stimState.set(g.states[goal_state]['stim'], fillColor = g.goalColor, lineColor = g.goalColor)
 
-        
         topText = 'How many points is this path?'
-        topTextstim = visual.TextStim(g.win, text = topText, units = 'norm', pos = (0,0.7), height = .07)
+        g.hud.reset(topTextstim, topText)
         
 
         midText = "A) -20   B) +20   C) +140   D) -70"
-        midTextstim = visual.TextStim(g.win, text = midText, units = 'norm', pos = (0,0.6), height = .07)
+        g.hud.reset(midTextstim, midText, pos = (0,0.6))
 
         topTextstim.draw()
         midTextstim.draw()
@@ -693,24 +558,17 @@ def doPathTest(trials):
         drawBoxes()
 
         # Draw Path
-        g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-        g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
+        g.stimState.set(g.states[transition_path[0]][transition_path[1]]['arrow'], fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
         g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
 
         # Draw the "Goal TExt"
-        goalTextstim.setPos(g.states[goal_state]['stim'].pos)
-        goalTextstim.draw()
+        g.hud.draw_goal(g.states[goal_state]['stim'].pos)
 
-        # Show the Trial Tracker
-        trialTracekrStim = visual.TextStim(g.win, text = '%s/%s' % (idx, TOTAL_TRIALS), units = 'norm', height = .05, pos = (0,-0.85))
-        trialTracekrStim.draw()
-
-        # Show Error:
-        erroCount = visual.TextStim(g.win, text = 'Errors: %s' % g.goalErrors, units = 'norm', height = .05, pos = (0,-0.90), color = 'red')
-        erroCount.draw()
+        # Show the Trial Tracker and Errors
+        g.hud.draw_progress(idx, TOTAL_TRIALS, g.goalErrors)
             
         #g.states[current_state]['left']['arrow'].draw()
-        g.win.flip()
+        flip()
 
         event.clearEvents() # Clear Events in the event buffer
 
@@ -729,48 +587,35 @@ def doPathTest(trials):
             return
         
 
-        g.win.flip()
+        flip()
 
         resetStates()
-        g.states[current_state]['stim'].fillColor = g.targetColor
-        g.states[current_state]['stim'].lineColor = g.targetOutline
-
+        g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
         # Goal State
-        g.states[goal_state]['stim'].fillColor = g.goalColor
-        g.states[goal_state]['stim'].lineColor = g.goalColor
-    
+        g.stimState.set(g.states[goal_state]['stim'], fillColor = g.goalColor, lineColor = g.goalColor)
         drawBoxes()
 
-        goalTextstim.setPos(g.states[goal_state]['stim'].pos)
-        goalTextstim.draw()
+        g.hud.draw_goal(g.states[goal_state]['stim'].pos)
 
         # Draw Path
-        g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-        g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
+        g.stimState.set(g.states[transition_path[0]][transition_path[1]]['arrow'], fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
         g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
         # Draw the Value
         g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
 
-        # Show the Trial Tracker
-        trialTracekrStim = visual.TextStim(g.win, text = '%s/%s' % (idx, TOTAL_TRIALS), units = 'norm', height = .05, pos = (0,-0.85))
-        trialTracekrStim.draw()
-
-        # Show Error:
-        erroCount = visual.TextStim(g.win, text = 'Errors: %s' % g.goalErrors, units = 'norm', height = .05, pos = (0,-0.90), color = 'red')
-        erroCount.draw()
+        # Show the Trial Tracker and Errors
+        g.hud.draw_progress(idx, TOTAL_TRIALS, g.goalErrors)
 
         correct_points = g.states[transition_path[0]][transition_path[1]]['value']
        
         outcome = ''
         if resp == correct_points:
             outcome = 'correct'
-            topTextstim.color = '#00FF00'
-            topTextstim.setText("Good Job!")
+            g.hud.set(topTextstim, text = "Good Job!", color = '#00FF00')
             
         else:
             outcome = 'incorrect'
-            topTextstim.color = '#FF0000'
-            topTextstim.setText("Incorrect. The path will get you %s points " % correct_points )
+            g.hud.set(topTextstim, text = "Incorrect. The path will get you %s points " % correct_points, color = '#FF0000')
             depth = int(trial[0])
             g.goalErrors = g.goalErrors + 1
 
@@ -783,7 +628,7 @@ def doPathTest(trials):
         midTextstim.draw()
                 
 
-        g.win.flip()
+        flip()
         now = g.clock.getTime()
         StimToolLib.just_wait(g.clock, now + 2)
 
@@ -802,23 +647,24 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
     :param showFeedback shows the points right after the each trial if it's True
     """
     DEPTH_ABS = depth
+    set_phase('PLANNING')
     event.clearEvents()
     #wait for 100ms at the beginning of a trial
-    if duration is not None: StimToolLib.just_wait(g.clock, g.ideal_trial_start + 0.1)
+    if duration is not None: StimToolLib.just_wait(g.clock, g.ideal_trial_start + timeline.PLANNING_DELAY)
 
     transition_path = []
     points = 0
     
     resetStates()
-    g.win.flip()
-    planingDuration = 9
+    flip()
+    planingDuration = timeline.PLANNING_DURATION
 
     current_state = start_state
 
     now = g.clock.getTime()
     planing_onset = now
     trial_start = now
-    time_to_end = g.ideal_trial_start + 15 # Trial must last only 15 seconds
+    time_to_end = g.ideal_trial_start + timeline.slot_duration(depth) # Planned start of the next trial
 
     StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['TRIAL_ONSET'], now, 'NA', 'NA', 'NA', g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
     response_start = ''
@@ -828,53 +674,44 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
     if duration is not None:
 
         StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['PLANNING_ONSET'], now, 'NA', 'NA', str(planingDuration), g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
+        record_onset('PLANNING', now)
         
-        g.topTextstim.setText('You have %i moves' % depth)
+        # Current States
+        drawBoard(current_state)
+
+        g.stimState.set(g.topTextstim, text = 'You have %i moves' % depth)
         g.topTextstim.draw()
        
 
-        g.bottomTextstim.setHeight(.05)
-        g.bottomTextstim.setText('Please enter the full sequence of moves first to see the result.')
+        g.stimState.set(g.bottomTextstim, height = .05, text = 'Please enter the full sequence of moves first to see the result.')
         g.bottomTextstim.draw()
 
 
-        g.timerstim.color = '#FFFFFF'
+        g.stimState.set(g.timerstim, color = '#FFFFFF')
         # timer =  "%s" % int((now + planingDuration + 1) - g.clock.getTime())
         # g.timerstim.setText('Planning Time (9s)')
 
         timer = "%s" % int((now + planingDuration + 1) - g.clock.getTime())
-        g.timerstim.setText(timer)
+        g.stimState.set(g.timerstim, text = timer)
         g.timerstim.draw()
-
-        resetStates()
-    
-        # Current States
-        g.states[current_state]['stim'].fillColor = g.targetColor
-        g.states[current_state]['stim'].lineColor = g.targetOutline
-
-        drawBoxes()
         
-        g.win.flip()
+        flip()
 
         # Wait up to 9 seconds
         while g.clock.getTime() < now + planingDuration:
 
+            # Current States
+            drawBoard(start_state)
+
             timer = "%s" % int((now + planingDuration + 1) - g.clock.getTime())
         
-            g.timerstim.setText(timer)
+            g.stimState.set(g.timerstim, text = timer)
             g.timerstim.draw()
             g.topTextstim.draw()
             g.bottomTextstim.draw()
-            resetStates()
-    
-            # Current States
-            g.states[start_state]['stim'].fillColor = g.targetColor
-            g.states[start_state]['stim'].lineColor = g.targetOutline
-
-            drawBoxes()
  
             k = event.getKeys([ g.session_params[g.run_params['select_1']],  g.session_params[g.run_params['select_2']], "escape", 's' ])
-            g.win.flip()
+            flip()
             if len(k) == 0: continue
             response_start = g.clock.getTime()
 
@@ -883,7 +720,7 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
             if k[0] == "escape": raise StimToolLib.QuitException
             if k[0] == g.session_params[g.run_params['select_1']]: 
                 resp = -1
-                #transitions.append('left')
+                transitions.append('left')
                 points = points + g.states[current_state]['left']['value']
                 current_state = g.states[current_state]['left']['state']
             if k[0] == g.session_params[g.run_params['select_2']]: 
@@ -896,6 +733,7 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
                 return
             
             StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['RESPONSE_ONSET'], response_start, 'NA', 'NA', str(duration), g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
+            record_onset('RESPONSE', response_start)
             StimToolLib.mark_event(g.output, g.trial, str(start_state) +'_' + str(g.trial_type) + '_' + str(key_pressed_num), event_types['RESPONSE'], response_start, str(response_start - planing_onset), str(resp), 'NA', g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
             depth = depth - 1
             key_pressed_num = key_pressed_num + 1
@@ -903,21 +741,23 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
 
 
     # Enter Moves
+    set_phase('RESPONSE')
     if not response_start:
         response_start = g.clock.getTime()
         StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['RESPONSE_ONSET'], response_start, 'NA', 'NA', str(duration), g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
+        record_onset('RESPONSE', response_start)
     
     
 
     #g.timerstim.color = '#FF0000'
-    g.timerstim.bold = True
+    g.stimState.set(g.timerstim, bold = True)
 
-    g.topMidTextstim.pos = (0,.45)
+    g.stimState.set(g.topMidTextstim, pos = (0,.45))
 
 
     # Get Transition sequenc
     if duration is not None:
-        g.timerstim.setText('Enter Moves now (2.5s)')
+        g.stimState.set(g.timerstim, text = 'Enter Moves now (%gs)' % timeline.RESPONSE_DURATION)
         g.timerstim.draw()
 
 
@@ -926,10 +766,13 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
 
         # Exit Loop with the time is up. If there is a duration
         if duration is not None: 
-            if g.clock.getTime() >= response_start + 2.5: break
+            if g.clock.getTime() >= response_start + timeline.RESPONSE_DURATION: break
+
+            # The board stays as it was during planning
+            drawBoard(start_state)
         
         event.clearEvents()
-        g.topTextstim.setText('You have %i moves' % depth)
+        g.stimState.set(g.topTextstim, text = 'You have %i moves' % depth)
         g.topTextstim.draw()
 
         if duration is not None:
@@ -939,18 +782,15 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
         if duration is None:
             resetStates()
             # Current States
-            g.states[current_state]['stim'].fillColor = g.targetColor
-            g.states[current_state]['stim'].lineColor = g.targetOutline
-            
+            g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
             if len(transition_path) > 1 :
-                g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-                g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
+                g.stimState.set(g.states[transition_path[0]][transition_path[1]]['arrow'], fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
                 g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
                 g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
 
-        drawBoxes()
+            drawBoxes()
 
-        g.win.flip()
+        flip()
 
         # Once Enter all Moves than exists regardless if there is a duration
         if depth <= 0: break
@@ -994,13 +834,15 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
 
     if len(move_sequence) < DEPTH_ABS: 
         points = -200
-        g.bottomTextstim.setText('You did not enter all your moves')
+        g.stimState.set(g.bottomTextstim, text = 'You did not enter all your moves')
     else:
         # Show Transition Animation if there is a duration
 
         if duration is not None:
+            set_phase('ANIMATION')
             now = g.clock.getTime()
             StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['ANIMATION_ONSET'], now, 'NA', 'NA', 'NA', g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
+            record_onset('ANIMATION', now)
             transition_path = []
             
             current_state = start_state
@@ -1022,19 +864,16 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
 
                 resetStates()
                 # Current States
-                g.states[current_state]['stim'].fillColor = g.targetColor
-                g.states[current_state]['stim'].lineColor = g.targetOutline
-                
+                g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
                 drawBoxes()
                 # draw Transision
-                g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-                g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
+                g.stimState.set(g.states[transition_path[0]][transition_path[1]]['arrow'], fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
                 g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
                 g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
 
                 now = g.clock.getTime()
-                g.win.flip()
-                StimToolLib.just_wait(g.clock, now + .75) # time the frame rate changes
+                flip()
+                StimToolLib.just_wait(g.clock, now + timeline.MOVE_DURATION) # time the frame rate changes
             
         
         # StimToolLib.just_wait(g.clock, now + 1) 
@@ -1043,65 +882,46 @@ def doTaskTrial(start_state, depth, duration,  showFeedback):
     set_autodraw(False)
 
     outcome = getOutcome(start_state, DEPTH_ABS, transitions)
-    g.feedbackstim.setHeight(.1)
+    g.stimState.set(g.feedbackstim, height = .1)
     if showFeedback:
+        set_phase('FEEDBACK')
         if len(move_sequence) < DEPTH_ABS: 
             points = -200
-            g.bottomTextstim.setHeight(.1)
-            g.bottomTextstim.setText('You did not enter all your moves')
+            g.stimState.set(g.bottomTextstim, height = .1, text = 'You did not enter all your moves')
             g.bottomTextstim.draw()
         if points < 0:
-            g.feedbackstim.setText('You have lost a total of %i points.' % points)
+            g.stimState.set(g.feedbackstim, text = 'You have lost a total of %i points.' % points)
         else:
-            g.feedbackstim.setText('You have won a total of %i points.' % points)
+            g.stimState.set(g.feedbackstim, text = 'You have won a total of %i points.' % points)
         g.feedbackstim.draw()
     
-        g.win.flip()
+        flip()
         now = g.clock.getTime()
         StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['FEEDBACK'], now, 'NA', 'NA', str(points), g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
         StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['OUTCOME'], now, 'NA', 'NA', outcome, g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
-        StimToolLib.just_wait(g.clock, now + 1) # show feedback for 1 seond seconds
+        record_onset('FEEDBACK', now)
+        StimToolLib.just_wait(g.clock, now + timeline.FEEDBACK_DURATION) # show feedback for 1 seond seconds
 
     # if there is a duration, than display the Fixation ITI for the rest till end time
     if duration is not None:
-        g.win.flip()
+        set_phase('FIXATION')
+        flip()
         g.fixation.draw()
-        g.win.flip()
+        flip()
 
         now = g.clock.getTime()
-        # print(now - trial_start)
-        # if current trial duration is above 15 seconds, 
-        # Add 1 second to show fixation for max 16 seconds
-        if (now - trial_start) >= 15 and (now - trial_start) < 16:
-            time_to_end = time_to_end + 1
-            g.ideal_trial_start = g.ideal_trial_start + 1
-        
-            print('### %f ###' % g.trial)
-            print('extending +1 time_to_end %f\t\tcurrent duration: %f' % (time_to_end, now - trial_start))
-            print('total Duration: %f' % ( time_to_end - trial_start ))
-            StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['EXTENDING_TIME'], now, str(now - trial_start), 'NA', 'adding 1 second', g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
-            
-
-        # If curren trial is 16 seconds, extend to max 17 seconds
-        if (now - trial_start) >= 16:
-            time_to_end = time_to_end + 2
-            g.ideal_trial_start = g.ideal_trial_start + 2
-        
-            print('### %f ###' % g.trial)
-            print('extending +2 time_to_end %f\t\tcurrent duration: %f' % (time_to_end, now - trial_start))
-            print('total Duration: %f' % ( time_to_end - trial_start ))
-            StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['EXTENDING_TIME'], now, str(now - trial_start), 'NA', 'adding 2 seconds', g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
-            
-            
-            # StimToolLib.just_wait(g.clock, now + .5) # wait  seconds
-        # Tackle on .5 second for duration longer than 14 second
-        
+        # A trial that ran past its slot keeps a short fixation and the next one starts late--the trials after it
+        # catch up in their fixations (their slots stay where the timeline planned them)
+        if now + timeline.MIN_FIXATION > time_to_end:
+            StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['EXTENDING_TIME'], now, str(now - trial_start), 'NA', 'late by %.3f seconds' % (now + timeline.MIN_FIXATION - time_to_end), g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
+            time_to_end = now + timeline.MIN_FIXATION
 
         StimToolLib.mark_event(g.output, g.trial, g.trial_type, event_types['FIXATION_ONSET'], now, 'NA', 'NA', int(time_to_end - now), g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
+        record_onset('FIXATION', now)
         
         StimToolLib.just_wait(g.clock, time_to_end) # wait  seconds
     
-        g.ideal_trial_start = g.ideal_trial_start + 15
+        g.ideal_trial_start = g.ideal_trial_start + timeline.slot_duration(depth)
     
     g.points = g.points + points
 
@@ -1116,18 +936,16 @@ def doTaskTrialB(start_state, depth, duration, showFeedback):
 
     current_state = start_state
     DEPTH_TRIAL = depth
-    g.topTextstim.setText('You have %i moves' % depth)
+    g.stimState.set(g.topTextstim, text = 'You have %i moves' % depth)
     g.topTextstim.draw()
 
     resetStates()
 
     # Current States
-    g.states[current_state]['stim'].fillColor = g.targetColor
-    g.states[current_state]['stim'].lineColor = g.targetOutline
-
+    g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
     drawBoxes()
 
-    g.win.flip()
+    flip()
 
     # Get Transition sequenc
     move_sequence = []
@@ -1137,14 +955,12 @@ def doTaskTrialB(start_state, depth, duration, showFeedback):
 
         StimToolLib.check_for_esc()
         
-        g.topTextstim.setText('You have %i moves' % depth)
+        g.stimState.set(g.topTextstim, text = 'You have %i moves' % depth)
         g.topTextstim.draw()
         resetStates()
-        g.states[current_state]['stim'].fillColor = g.targetColor
-        g.states[current_state]['stim'].lineColor = g.targetOutline
-
+        g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
         drawBoxes()
-        g.win.flip()
+        flip()
 
 
         event.clearEvents() # Clear Events in the event buffer
@@ -1179,24 +995,22 @@ def doTaskTrialB(start_state, depth, duration, showFeedback):
 
             resetStates()
             # Current States
-            g.states[current_state]['stim'].fillColor = g.targetColor
-            g.states[current_state]['stim'].lineColor = g.targetOutline
+            g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
             drawBoxes()
 
             # draw Transision
-            g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-            g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
+            g.stimState.set(g.states[transition_path[0]][transition_path[1]]['arrow'], fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
             g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
             g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
 
-            g.win.flip()
+            flip()
             now = g.clock.getTime()
             StimToolLib.just_wait(g.clock, now + 1)
 
         
     #StimToolLib.just_wait(g.clock, now + 1) 
 
-    g.win.flip()
+    flip()
 
     if len(move_sequence) < DEPTH_TRIAL:
         points = -200
@@ -1204,12 +1018,10 @@ def doTaskTrialB(start_state, depth, duration, showFeedback):
 
     if showFeedback:
         if points > 0:
-            midTextstim = visual.TextStim(g.win, text = 'You have won a total of %i points.' % points, units = 'norm', pos = (0,0), height = .1)
-            midTextstim.draw()
+            g.hud.draw_text(g.hud.feedback, 'You have won a total of %i points.' % points)
         else:
-            midTextstim = visual.TextStim(g.win, text = 'You have lost a total of %i points.' % points, units = 'norm', pos = (0,0), height = .1)
-            midTextstim.draw()
-        g.win.flip()
+            g.hud.draw_text(g.hud.feedback, 'You have lost a total of %i points.' % points)
+        flip()
         now = g.clock.getTime()
         StimToolLib.just_wait(g.clock, now + 2) # wait  seconds
 
@@ -1231,12 +1043,12 @@ def doTaskTraining(trials):
     print("Part A")
     
     # Part A
-    depth2 = [x for x in trials if x[0] == '2']
-    depth3 = [x for x in trials if x[0] == '3']
+    depth2 = list(trials[trials['depth'] == 2])
+    depth3 = list(trials[trials['depth'] == 3])
 
 
     for trial in random.sample(depth2 + depth3, 6):
-        g.win.flip() # clear window
+        flip() # clear window
         depth = int(trial[0])
         start_state = int(trial[1])
         goal_state = int(trial[2])
@@ -1253,7 +1065,7 @@ def doTaskTraining(trials):
             )
     
     for trial in random.sample(depth2 + depth3, 12):
-        g.win.flip() # clear window
+        flip() # clear window
         
         #start_state = random.randrange(1,7) # Random state from 1,6
         #depth = random.randrange(2,4) # Random Depth, 2,3
@@ -1277,7 +1089,7 @@ def doTaskTraining(trials):
     g.ideal_trial_start = now
     # Part C
     for trial in random.sample(depth2 + depth3, 6):
-        g.win.flip() # clear window
+        flip() # clear window
         
         depth = int(trial[0])
         start_state = int(trial[1])
@@ -1298,16 +1110,16 @@ def doTestTraining(trials):
     Run Test Trails.
     """
     #print 'on TestTraining'
-    g.win.flip()
+    flip()
     
     topText = 'Get to the Goal with your last move.'
-    topTextstim = visual.TextStim(g.win, text = topText, units = 'norm', pos = (0,0.7), height = .07)
+    topTextstim = g.hud.top
+    g.hud.reset(topTextstim, topText)
     
 
     midText = ""
-    midTextstim = visual.TextStim(g.win, text = midText, units = 'norm', pos = (0,0), height = .07)
-
-    goalTextstim = visual.TextStim(g.win, text = 'Goal', units = 'norm', pos = (0,0), height = .07, color = g.goalTextColor)
+    midTextstim = g.hud.mid
+    g.hud.reset(midTextstim, midText, pos = (0,0))
 
     final_state = 0
     goal_state = 0
@@ -1321,40 +1133,31 @@ def doTestTraining(trials):
         goal_state = int(trial[2])
 
         resetStates()
-        g.win.flip()
+        flip()
 
         current_state = start_state
         transition_path = []
         while depth > 0:
             
             StimToolLib.check_for_esc()
-            topTextstim.setText('Get to the Red Goal with one move.' )
-
-            topTextstim.draw()
+            g.hud.draw_text(topTextstim, 'Get to the Red Goal with one move.' )
         
             resetStates()
 
             # Current States
-            g.states[current_state]['stim'].fillColor = g.targetColor
-            g.states[current_state]['stim'].lineColor = g.targetOutline
-
+            g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
             # Goal State
-            g.states[goal_state]['stim'].fillColor = g.goalColor
-            g.states[goal_state]['stim'].lineColor = g.goalColor
-        
-
+            g.stimState.set(g.states[goal_state]['stim'], fillColor = g.goalColor, lineColor = g.goalColor)
             if g.show_transitions and len(transition_path) > 1:
-                g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-                g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
+                g.stimState.set(g.states[transition_path[0]][transition_path[1]]['arrow'], fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
                 g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
                 if g.show_transitions_values:
                     g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
 
             drawBoxes()
 
-            goalTextstim.setPos(g.states[goal_state]['stim'].pos)
-            goalTextstim.draw()
-            g.win.flip()
+            g.hud.draw_goal(g.states[goal_state]['stim'].pos)
+            flip()
 
             event.clearEvents() # Clear Events in the event buffer
             k = event.waitKeys(keyList = [ g.session_params[g.run_params['select_1']],  g.session_params[g.run_params['select_2']], 'escape' ])
@@ -1374,41 +1177,30 @@ def doTestTraining(trials):
             
     
         resetStates()
-        g.states[current_state]['stim'].fillColor = g.targetColor
-        g.states[current_state]['stim'].lineColor = g.targetOutline
-
-        g.states[goal_state]['stim'].fillColor = g.goalColor
-        g.states[goal_state]['stim'].lineColor = g.goalColor
-    
+        g.stimState.set(g.states[current_state]['stim'], fillColor = g.targetColor, lineColor = g.targetOutline)
+        g.stimState.set(g.states[goal_state]['stim'], fillColor = g.goalColor, lineColor = g.goalColor)
         drawBoxes()
 
-        goalTextstim.setPos(g.states[goal_state]['stim'].pos)
-        goalTextstim.draw()
+        g.hud.draw_goal(g.states[goal_state]['stim'].pos)
 
         if g.show_transitions and len(transition_path) > 1:
-                g.states[transition_path[0]][transition_path[1]]['arrow'].fillColor = g.pathColor[transition_path[1]]
-                g.states[transition_path[0]][transition_path[1]]['arrow'].lineColor = 'white'
+                g.stimState.set(g.states[transition_path[0]][transition_path[1]]['arrow'], fillColor = g.pathColor[transition_path[1]], lineColor = 'white')
                 g.states[transition_path[0]][transition_path[1]]['arrow'].draw() 
                 if g.show_transitions_values:
                     g.states[transition_path[0]][transition_path[1]]['valueText'].draw()
         
         now = g.clock.getTime()
-        midTextstim.pos = (0,.6)
         if current_state == goal_state: 
-            midTextstim.color = '#00FF00'
-            midTextstim.setText("Very Good!")
-            midTextstim.draw()
+            g.hud.draw_text(midTextstim, "Very Good!", pos = (0,.6), color = '#00FF00')
             g.correctTrials = g.correctTrials + 1
             repeat = False
         else:
-            midTextstim.color = '#FF0000'
-            midTextstim.setText("That is not Correct ")
-            midTextstim.draw()
+            g.hud.draw_text(midTextstim, "That is not Correct ", pos = (0,.6), color = '#FF0000')
             depth = int(trial[0])
             g.goalErrors = g.goalErrors + 1
             repeat = True
 
-        g.win.flip()
+        flip()
         StimToolLib.just_wait(g.clock, now + 1) # wait 1 seconds
 
 
@@ -1417,13 +1209,13 @@ def show_one_slide(slide_path, audio_path = None):
     """
     duration = None
     if audio_path:
-        s = sound.Sound(value = audio_path)
+        s = g.stim_cache.get_sound(audio_path) #loaded once per run, retry loops show the same slides again
         duration = s.getDuration()
         s.play()
-    g.win.flip()
-    slideStim = visual.ImageStim(g.win, image = slide_path)
+    flip()
+    slideStim = g.stim_cache.get_image(slide_path)
     slideStim.draw()
-    g.win.flip()
+    flip()
     now = g.clock.getTime()
     StimToolLib.just_wait(g.clock, now + 1) # wait 1 second
     k = event.waitKeys(keyList=[ 
@@ -1447,8 +1239,9 @@ def run_try():
         else:
             #print 'QUIT!'
             return -1#the user hit cancel so exit 
-        g.run_params['run'] = thisInfo[0]
+        g.run_params = g.run_params.override('dialog', run = thisInfo[0])
     StimToolLib.general_setup(g)
+    g.hud = hud.Hud(g.win, g.stimState, g.goalTextColor)
 
     schedule_file = os.path.join(os.path.dirname(__file__), g.run_params['run'])
     #param_file = os.path.join(os.path.dirname(__file__),'T1000_DP_Schedule' + str(g.run_params['run']) + '.csv')
@@ -1469,13 +1262,13 @@ def run_try():
     g.clock = core.Clock()
     start_time = data.getDateStr()
     param_file = g.run_params['run'][0:-9] + '.params' #every .schedule file can (probably should) have a .params file associated with it to specify running parameters (including part of the output filename)
-    StimToolLib.get_var_dict_from_file(os.path.join(os.path.dirname(__file__), param_file), g.run_params)
+    g.run_params = g.run_params.with_file(os.path.join(os.path.dirname(__file__), param_file))
     g.prefix = StimToolLib.generate_prefix(g)
     g.subj_param_file = os.path.join(os.path.dirname(g.prefix), g.session_params['SID'] + '_' + g.run_params['param_file'])
     fileName = os.path.join(g.prefix + '.csv')
     #g.prefix = 'DP-' + g.session_params['SID'] + '-Admin_' + g.session_params['raID'] + '-run_' + str(g.run_params['run']) + '-' + start_time
     #fileName = os.path.join(os.path.dirname(__file__), 'data/' + g.prefix +  '.csv')
-    g.output = open(fileName, 'w')
+    g.output = StimToolLib.EventSink(open(fileName, 'w')) # events are written by a background thread, see StimToolLib.EventSink
     
     sorted_events = sorted(event_types.items(), key=lambda item: item[1])
     g.output.write('Administrator:,' + g.session_params['admin_id'] + ',Original File Name:,' + fileName + ',Time:,' + start_time + ',Parameter File:,' +  schedule_file + ',Event Codes:,' + str(sorted_events) + ',Trial Types are coded as follows: 8 bits representing [valence neut/neg/pos] [target_orientation H/V] [target_side left/right] [duration .5/1] [valenced_image left/right] [cue_orientation H/V] [cue_side left/right]\n')
@@ -1490,9 +1283,7 @@ def run_try():
     # Ask about load
     try:
         if g.run_params['ask_load_question'] == True:
-            textStim = visual.TextStim(g.win, text = "Is this Run with the breathing Load?\nYES = PRESS 'y' key\nNO = PRESS 'n' key", units = 'norm', pos = (0,0), height = .07)
-            textStim.draw()
-            g.win.flip()
+            g.hud.show_message("Is this Run with the breathing Load?\nYES = PRESS 'y' key\nNO = PRESS 'n' key", flip)
             k = event.waitKeys(keyList=[ 'y','Y', 'n','N','escape'])
             if k[0] == 'escape': raise StimToolLib.QuitException
             if k[0] in ['y','Y']:
@@ -1512,26 +1303,21 @@ def run_try():
     
 
     # Create Stim Objects
-    g.topTextstim = visual.TextStim(g.win, text = 'You have 0 moves', units = 'norm', pos = (0,0.6), height = .12)
-    g.bottomTextstim = visual.TextStim(g.win, text = 'Press the Right Button to enter your moves', units = 'norm', pos = (0,0.45), height = .08)
-    g.topMidTextstim = visual.TextStim(g.win, text = 'Enter your moves now.', units = 'norm', pos = (0,0.45), height = .08)
-    g.feedbackstim = visual.TextStim(g.win, text = 'You have won a total of 0 points.', units = 'norm', pos = (0,0), height = .07)
+    g.topTextstim = g.hud.new_text(text = 'You have 0 moves', pos = (0,0.6), height = .12)
+    g.bottomTextstim = g.hud.new_text(text = 'Press the Right Button to enter your moves', pos = (0,0.45), height = .08)
+    g.topMidTextstim = g.hud.new_text(text = 'Enter your moves now.', pos = (0,0.45), height = .08)
+    g.feedbackstim = g.hud.new_text(text = 'You have won a total of 0 points.', pos = (0,0), height = .07)
 
-    g.timerstim = visual.TextStim(g.win, text = '', units = 'norm', pos = (0,0.8), height = .15)
-    g.fixation = visual.TextStim(g.win, text = '+', units = 'norm', pos = (0,0), height = .3)
+    g.timerstim = g.hud.new_text(text = '', pos = (0,0.8), height = .15)
+    g.fixation = g.hud.new_text(text = '+', pos = (0,0), height = .3)
 
     setStates()
     setTransitions()
+    bakeBoards()
+    g.hud.end_setup() # Every TextStim of the run exists now, the trials only reuse them
 
     ## READ the SCHEDULE FILE
-    schedule = open(schedule_file, 'r')
-    trials = []
-
-    for idx,line in enumerate(schedule):
-        if idx == 0:
-            continue
-        row = line.replace('\n','').split(',')
-        trials.append(row)
+    trials = schedule_compiler.load_schedule(schedule_file) # Validated trials with their metadata, see schedule_compiler.TRIAL_DTYPE
 
     instruct_end_time = g.clock.getTime()
     
@@ -1545,7 +1331,7 @@ def run_try():
         doFreeTraining(g.run_params['free_duration'])
         
         # Ask if they want to do again
-        g.win.flip()
+        flip()
 
         if g.hand == 'right':
             k = show_one_slide(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'instructions', 'PlaningInstructions','RP1_10_R.JPG' ),
@@ -1576,14 +1362,12 @@ def run_try():
         while g.goalErrors > g.errorMax:
             g.goalErrors = 0
             # Shuffle Trials Types
-            depth1 = [x for x in trials if x[0] == '1']
+            depth1 = list(trials[trials['depth'] == 1])
             random.shuffle(depth1)
 
             ## Show Goal Tries
-            g.win.flip()
-            textStim = visual.TextStim(g.win, text = 'Goal Training - Depth 1 \n\nAttempt #: %i' % g.GoalTrainingTries, units = 'norm', pos = (0,0), height = .07)
-            textStim.draw()
-            g.win.flip()
+            flip()
+            g.hud.show_message('Goal Training - Depth 1 \n\nAttempt #: %i' % g.GoalTrainingTries, flip)
             now = g.clock.getTime()
             StimToolLib.just_wait(g.clock, now + 3) 
             
@@ -1597,11 +1381,9 @@ def run_try():
                 
         StimToolLib.write_var_to_file(g.subj_param_file, 'goal_training_depth1_tries', g.GoalTrainingTries)
         # Double Step
-        g.win.flip()
+        flip()
         now = g.clock.getTime()
-        textStim = visual.TextStim(g.win, text = 'Great Job!\nNow we will try with 2 moves!', units = 'norm', pos = (0,0), height = .07)
-        textStim.draw()
-        g.win.flip()
+        g.hud.show_message('Great Job!\nNow we will try with 2 moves!', flip)
         StimToolLib.just_wait(g.clock, now + 5) 
         g.GoalTrainingTries = 1
         
@@ -1609,14 +1391,12 @@ def run_try():
         g.show_transitions = True
         while g.goalErrors > g.errorMax:
             g.goalErrors = 0
-            depth2 = [x for x in trials if x[0] == '2']
+            depth2 = list(trials[trials['depth'] == 2])
             random.shuffle(depth2)
 
             ## Show Goal Tries
-            g.win.flip()
-            textStim = visual.TextStim(g.win, text = 'Goal Training - Depth 2 \n\nAttempt #: %i' % g.GoalTrainingTries, units = 'norm', pos = (0,0), height = .07)
-            textStim.draw()
-            g.win.flip()
+            flip()
+            g.hud.show_message('Goal Training - Depth 2 \n\nAttempt #: %i' % g.GoalTrainingTries, flip)
             now = g.clock.getTime()
             StimToolLib.just_wait(g.clock, now + 3) 
 
@@ -1631,11 +1411,9 @@ def run_try():
         StimToolLib.write_var_to_file(g.subj_param_file, 'goal_training_depth2_tries', g.GoalTrainingTries)
 
         # Triple Step
-        g.win.flip()
+        flip()
         now = g.clock.getTime()
-        textStim = visual.TextStim(g.win, text = 'Great Job!\nNow we will try with 3 moves!', units = 'norm', pos = (0,0), height = .07)
-        textStim.draw()
-        g.win.flip()
+        g.hud.show_message('Great Job!\nNow we will try with 3 moves!', flip)
         StimToolLib.just_wait(g.clock, now + 5) 
         
 
@@ -1644,14 +1422,12 @@ def run_try():
         # Need to all the trials Right!
         while g.goalErrors > g.errorMax:
             g.goalErrors = 0
-            depth3 = [x for x in trials if  x[0] == '3']
+            depth3 = list(trials[trials['depth'] == 3])
             random.shuffle(depth3)
 
             ## Show Goal Tries
-            g.win.flip()
-            textStim = visual.TextStim(g.win, text = 'Goal Training - Depth 3 \n\nAttempt #: %i' % g.GoalTrainingTries, units = 'norm', pos = (0,0), height = .07)
-            textStim.draw()
-            g.win.flip()
+            flip()
+            g.hud.show_message('Goal Training - Depth 3 \n\nAttempt #: %i' % g.GoalTrainingTries, flip)
             now = g.clock.getTime()
             StimToolLib.just_wait(g.clock, now + 3) 
 
@@ -1677,10 +1453,10 @@ def run_try():
                 os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'instructions', 'instruction_audio','slide19.m4a.aiff' )
                 )
 
-        g.win.flip()
-        slideStim = visual.ImageStim(g.win, image = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'instructions', 'PlaningInstructions','PROGRESS_RIGHT.JPG' ) )
+        flip()
+        slideStim = g.stim_cache.get_image(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'instructions', 'PlaningInstructions','PROGRESS_RIGHT.JPG' ) )
         slideStim.draw()
-        g.win.flip()
+        flip()
         now = g.clock.getTime()
         StimToolLib.just_wait(g.clock, now + 1) # wait 1 second
         event.clearEvents() # Clear Events in the event buffer
@@ -1691,10 +1467,11 @@ def run_try():
     if 'RP3' in g.run_params['run_id']:
         g.show_transitions = True
         g.show_transitions_value = True
+        bakeBoards(show_value = True) # The transitions with their values
 
         doFreeTraining(g.run_params['free_duration'])
         
-        g.win.flip()
+        flip()
         if g.hand == 'right':
             k = show_one_slide(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'instructions', 'PlaningInstructions','RP1_10_R.JPG' ),
             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'instructions', 'instruction_audio','slide13.m4a.aiff' )
@@ -1717,13 +1494,11 @@ def run_try():
         while g.goalErrors > 1:
             g.goalErrors = 0
             # Shuffle Trials Types
-            depth1 = [x for x in trials if x[0] == '1']
+            depth1 = list(trials[trials['depth'] == 1])
             random.shuffle(depth1)
 
-            g.win.flip()
-            textStim = visual.TextStim(g.win, text = 'Path Test \n\nAttempt #: %i' % g.PathTestTries, units = 'norm', pos = (0,0), height = .07)
-            textStim.draw()
-            g.win.flip()
+            flip()
+            g.hud.show_message('Path Test \n\nAttempt #: %i' % g.PathTestTries, flip)
             now = g.clock.getTime()
             StimToolLib.just_wait(g.clock, now + 3) 
             
@@ -1749,6 +1524,7 @@ def run_try():
             )
 
         
+        set_run_phase('EXAMPLES')
         example_trials = [
             [4,2],
             [4,1],
@@ -1763,7 +1539,7 @@ def run_try():
         g.trial = 0
         g.points = 0
         for trial in example_trials:
-            g.win.flip() # clear window
+            flip() # clear window
             start_state = int(trial[1])
             depth = int(trial[0])
             g.trial_type = depth
@@ -1777,13 +1553,13 @@ def run_try():
             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media', 'instructions', 'instruction_audio','slide33.m4a.aiff' )
             )
         else:
-            textStim = visual.TextStim(g.win, text = "Let's Begin! \n Press the Right Button when you are ready.", units = 'norm', pos = (0,0), height = .07)
-            textStim.draw()
-            g.win.flip()
+            g.hud.show_message("Let's Begin! \n Press the Right Button when you are ready.", flip)
             k = event.waitKeys(keyList=[ g.session_params[g.run_params['select_1']],  g.session_params[g.run_params['select_2']], 'escape'])
             if k[0] == 'escape': raise StimToolLib.QuitException
             if k[0] == g.session_params[g.run_params['select_1']]: pass
 
+    g.timeline = timeline.Timeline(list(zip(trials['depth'].tolist(), trials['start_state'].tolist()))) # Every onset of the run, known before it starts
+
     if g.session_params['scan'] and ('RP6' not in g.run_params['run_id']):
         StimToolLib.wait_scan_start(g.win)
     else:
@@ -1792,35 +1568,34 @@ def run_try():
     
     
     # Wait 8 seconds before start
-    g.win.flip()
+    flip()
     g.fixation.draw()
-    g.win.flip()
+    flip()
 
     now = g.clock.getTime()
     
-    g.ideal_trial_start = g.clock.getTime()
-    g.ideal_trial_start = g.ideal_trial_start + 8
-    StimToolLib.just_wait(g.clock, g.ideal_trial_start)
+    g.timeline_origin = now
+    StimToolLib.just_wait(g.clock, g.timeline_origin + g.timeline.trials[0].start if g.timeline.trials else now)
 
     StimToolLib.mark_event(g.output, 'NA', 'NA', event_types['TASK_ONSET'], now, 'NA', 'NA', 'NA', g.session_params['signal_parallel'], g.session_params['parallel_port_address'])
 
+    set_run_phase('TASK')
     g.trial = 0
     g.points = 0
     for trial in trials:
-        g.win.flip() # clear window
-        start_state = int(trial[1])
-        depth = int(trial[0])
+        flip() # clear window
+        start_state = int(trial['start_state'])
+        depth = int(trial['depth'])
         g.trial_type = depth
         duration = 2.5
+        g.ideal_trial_start = g.timeline_origin + float(trial['onset'])
         #print trial
         doTaskTrial(start_state, depth,duration, True) # Do Single Trial
         g.trial = g.trial + 1
 
     ## Show Points
-    g.win.flip()
-    textStim = visual.TextStim(g.win, text = 'You have won %i cents.' % g.points, units = 'norm', pos = (0,0), height = .07)
-    textStim.draw()
-    g.win.flip()
+    flip()
+    g.hud.show_message('You have won %i cents.' % g.points, flip)
     now = g.clock.getTime()
     StimToolLib.just_wait(g.clock, now + 3) 
 
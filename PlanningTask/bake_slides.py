@@ -0,0 +1,44 @@
+# Planning Task slide baking
+# Converts the slides listed in the instruction CSVs (shown full screen by StimToolLib's
+# instruction functions) to raw RGBA at the screen resolution, in StimToolLib's memory-mapped
+# slide cache (see StimToolLib.bake_slide_cache). The images PlanningTask.py passes to
+# show_one_slide are drawn at their native size, so they are not baked. Slides found
+# there are shown without JPEG decoding or resizing; anything missing or changed since the
+# bake is decoded from the JPG as before, so re-run this after changing slides or resolution.
+#
+# usage: python -m PlanningTask.bake_slides [-x SCREEN_X] [-y SCREEN_Y]
+# (run from the StimTool directory; the resolution defaults to the one in Default.params)
+
+import argparse, csv, os, time
+import StimToolLib
+
+TASK_DIR = os.path.dirname(os.path.abspath(__file__))
+INSTRUCTION_DIR = os.path.join(TASK_DIR, 'media', 'instructions')
+
+def instruction_slides():
+    """
+    Every image listed in the first column of an instruction CSV (paths as written, relative to the CSV)
+    """
+    slides = []
+    for name in sorted(os.listdir(INSTRUCTION_DIR)):
+        if not name.endswith('.csv'): continue
+        with open(os.path.join(INSTRUCTION_DIR, name), 'r') as fin:
+            for row in csv.reader(fin):
+                if row and row[0]:
+                    slides.append(os.path.join(INSTRUCTION_DIR, row[0]))
+    return slides
+
+def main(argv = None):
+    params = StimToolLib.get_var_dict_from_file('Default.params', {})
+    parser = argparse.ArgumentParser(description = 'Bake the Planning Task instruction slides at screen resolution.')
+    parser.add_argument('-x', '--screen_x', type = int, default = params.get('screen_x', 1920), help = 'screen width in pixels')
+    parser.add_argument('-y', '--screen_y', type = int, default = params.get('screen_y', 1080), help = 'screen height in pixels')
+    args = parser.parse_args(argv)
+    start = time.time()
+    slides = instruction_slides()
+    n = StimToolLib.bake_slide_cache(slides, args.screen_x, args.screen_y)
+    print('baked %i images (%i slide paths) at %ix%i in %.2f s -> %s' % (n, len(slides), args.screen_x, args.screen_y,
+        time.time() - start, StimToolLib.slide_cache_name(args.screen_x, args.screen_y) + '.rgba'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Planning Task batch model fitting
+# Fits the pruning model (pruning_model.py) to every subject found in the output directories,
+# one subject per worker process, and writes one row of fitted parameters per subject.
+#
+# usage: python -m PlanningTask.fit_subjects [DIR ...] [-o fitted_params.csv] [-c fit_cache.json] [-p '*PT-R*.csv'] [-j N]
+# (run from the StimTool directory; the directories default to output_dir and network_output_dir in Default.params)
+#
+# A subject's files are the behavioral CSVs whose names start with its ID (SID-session_id-run_id,
+# see StimToolLib.generate_prefix); copies of the same file in both directories count once.
+# Fits are cached by (subject, hash of its files, pruning_model.MODEL_VERSION), so re-running
+# after new data arrives only fits the subjects whose files changed.
+
+import argparse, ast, csv, hashlib, json, os, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PlanningTask import pruning_model, rescore
+
+COLUMNS = ['subject', 'files', 'trials'] + pruning_model.PARAMS + ['log_likelihood', 'fit_seconds']
+
+def default_dirs(params_file = 'Default.params'):
+    """
+    output_dir and network_output_dir from the session defaults
+    """
+    dirs = []
+    if not os.path.isfile(params_file): return dirs
+    with open(params_file, 'r', encoding = 'utf-8') as fin:
+        for line in fin:
+            these_vals = line.split()
+            if len(these_vals) > 1 and these_vals[0] in ('output_dir', 'network_output_dir'):
+                try:
+                    dirs.append(ast.literal_eval(these_vals[1]))
+                except (ValueError, SyntaxError):
+                    dirs.append(these_vals[1])
+    return dirs
+
+def file_hash(filename):
+    with open(filename, 'rb') as fin:
+        return hashlib.sha1(fin.read()).hexdigest()
+
+def find_subjects(dirs, pattern):
+    """
+    {subject: (hash of its files, [one path per distinct file])}
+    """
+    subjects = {}
+    for d in dirs:
+        if not os.path.isdir(d): continue
+        for filename in rescore.find_files(d, pattern):
+            subject = os.path.basename(filename).split('-')[0]
+            subjects.setdefault(subject, {}).setdefault(file_hash(filename), filename)
+    found = {}
+    for subject, files in subjects.items():
+        digest = hashlib.sha1(','.join(sorted(files)).encode()).hexdigest()
+        found[subject] = (digest, [files[h] for h in sorted(files)])
+    return found
+
+def cache_key(subject, digest):
+    return '%s|%s|%i' % (subject, digest, pruning_model.MODEL_VERSION)
+
+def load_cache(cache_file):
+    if not os.path.isfile(cache_file): return {}
+    with open(cache_file, 'r') as fin:
+        return json.load(fin)
+
+def save_cache(cache, cache_file):
+    with open(cache_file + '.tmp', 'w') as fout:
+        json.dump(cache, fout, indent = 1, sort_keys = True)
+    os.replace(cache_file + '.tmp', cache_file)
+
+def fit_subject(files):
+    """
+    Fit one subject--runs in a worker process
+    """
+    start = time.time()
+    trials = pruning_model.subject_trials(files)
+    params, ll = pruning_model.fit_grid(pruning_model.group_trials(trials))
+    return {'files': len(files), 'trials': len(trials), 'params': params, 'log_likelihood': ll, 'fit_seconds': time.time() - start}
+
+def fit_subjects(dirs, out_file, cache_file, pattern = '*PT-R*.csv', workers = None):
+    """
+    Fit every subject not in the cache, then write all of them to out_file
+    Returns (number of subjects, number fitted now)
+    """
+    subjects = find_subjects(dirs, pattern)
+    cache = load_cache(cache_file)
+    todo = [s for s in sorted(subjects) if cache_key(s, subjects[s][0]) not in cache]
+    print('%i subjects, %i cached, %i to fit' % (len(subjects), len(subjects) - len(todo), len(todo)))
+    start = time.time()
+    if todo:
+        pool = ProcessPoolExecutor(max_workers = workers)
+        futures = dict((pool.submit(fit_subject, subjects[s][1]), s) for s in todo)
+        for done, future in enumerate(as_completed(futures)):
+            subject = futures[future]
+            result = future.result()
+            cache[cache_key(subject, subjects[subject][0])] = result
+            save_cache(cache, cache_file) # Keep what is done if the batch is interrupted
+            print('[%i/%i] %s: %i trials in %.2f s' % (done + 1, len(todo), subject, result['trials'], result['fit_seconds']))
+        pool.shutdown()
+    with open(out_file, 'w', newline = '') as fout:
+        writer = csv.writer(fout)
+        writer.writerow(COLUMNS)
+        for subject in sorted(subjects):
+            result = cache[cache_key(subject, subjects[subject][0])]
+            writer.writerow([subject, result['files'], result['trials']] + [result['params'][p] for p in pruning_model.PARAMS] +
+                [result['log_likelihood'], round(result['fit_seconds'], 3)])
+    print('fitted %i subjects in %.2f s -> %s' % (len(todo), time.time() - start, out_file))
+    return len(subjects), len(todo)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Fit the Planning Task pruning model to every subject in the output directories.')
+    parser.add_argument('dirs', nargs = '*', help = 'directories searched (recursively) for output CSVs (default: output_dir and network_output_dir in Default.params)')
+    parser.add_argument('-o', '--out', default = 'fitted_params.csv', help = 'table of fitted parameters to write')
+    parser.add_argument('-c', '--cache', default = 'fit_cache.json', help = 'fits already done, by subject, file hash and model version')
+    parser.add_argument('-p', '--pattern', default = '*PT-R*.csv', help = 'file name pattern of the runs to fit')
+    parser.add_argument('-j', '--workers', type = int, default = None, help = 'worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+    fit_subjects(args.dirs or default_dirs(), args.out, args.cache, args.pattern, args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Planning Task HUD
+# The text drawn around the board: prompts, the 'Goal' label, trial tracker, error count,
+# feedback and one-off messages. Creating a TextStim builds a new font texture, so the HUD
+# creates its stimuli once per run and the training/test loops only change their text,
+# color and position (through StimState, so unchanged text is not laid out again).
+# Every TextStim of the run is created through new_text, which counts them: once setup is
+# over (end_setup) the count should not move.
+
+from psychopy import visual
+
+TEXT_COLOR = 'white' #default TextStim color
+
+class Hud:
+    def __init__(self, win, stim_state, goal_text_color):
+        self.win = win
+        self.stim_state = stim_state
+        self.allocations = 0 #TextStims created through new_text
+        self.setup_allocations = None #value of allocations when end_setup was called
+        self.top = self.new_text(text = '', pos = (0,0.7), height = .07)
+        self.mid = self.new_text(text = '', pos = (0,0), height = .07)
+        self.goal = self.new_text(text = 'Goal', pos = (0,0), height = .07, color = goal_text_color)
+        self.tracker = self.new_text(text = '', pos = (0,-0.85), height = .05)
+        self.errors = self.new_text(text = '', pos = (0,-0.90), height = .05, color = 'red')
+        self.feedback = self.new_text(text = '', pos = (0,0), height = .1)
+        self.message = self.new_text(text = '', pos = (0,0), height = .07)
+        self.timer = self.new_text(text = '', pos = (0,0.7), height = .15)
+
+    def new_text(self, **kwargs):
+        """
+        Create a TextStim (in norm units) and count it
+        """
+        self.allocations += 1
+        return visual.TextStim(self.win, units = 'norm', **kwargs)
+
+    def set(self, stim, **attrs):
+        self.stim_state.set(stim, **attrs)
+
+    def reset(self, stim, text = '', pos = None, color = TEXT_COLOR):
+        """
+        Put stim back to a fresh state before a new screen uses it
+        """
+        if pos is None:
+            self.set(stim, text = text, color = color)
+        else:
+            self.set(stim, text = text, pos = pos, color = color)
+
+    def draw_text(self, stim, text, **attrs):
+        self.set(stim, text = text, **attrs)
+        stim.draw()
+
+    def draw_goal(self, pos):
+        """
+        'Goal' label over the goal box
+        """
+        self.set(self.goal, pos = pos)
+        self.goal.draw()
+
+    def draw_progress(self, idx, total, errors):
+        """
+        Trial tracker and error count at the bottom of the screen
+        """
+        self.draw_text(self.tracker, '%s/%s' % (idx, total))
+        self.draw_text(self.errors, 'Errors: %s' % errors)
+
+    def show_message(self, text, flip):
+        """
+        Draw text alone in the middle of the screen and flip
+        """
+        self.draw_text(self.message, text)
+        flip()
+
+    def end_setup(self):
+        self.setup_allocations = self.allocations
+
+    def trial_allocations(self):
+        """
+        TextStims created after setup--should stay 0
+        """
+        if self.setup_allocations is None: return 0
+        return self.allocations - self.setup_allocations
+
+    def summary(self):
+        return 'text stimuli allocated: %i at setup, %i after setup' % (
+            self.setup_allocations if self.setup_allocations is not None else self.allocations, self.trial_allocations())
@@ -0,0 +1,195 @@
+# Planning Task schedule generator
+# Searches for trial orders that satisfy a set of constraints and writes them as .schedule files
+# (the same depth,start_state,None,9 rows as the hand-made PlanningTask_R*_*.schedule files).
+#
+# usage: python -m PlanningTask.make_schedule [-d 3 4 5] [--duration 541] [--oll 0.5] [--states 1 2 3 4 5 6] [--max-run 3] [-n 100] [-j N] [-s 0] [-o DIR] [--prefix NAME]
+# (run from the StimTool directory)
+#
+# Constraints:
+#   duration    fixed run length: LEAD_IN plus the slot of every trial (timeline.slot_duration,
+#               longer for deeper trials)
+#   depths      trials are split evenly over the depths
+#   oll         share of the trials of each depth whose optimal path takes a large loss
+#               (scoring.get_outcome_info(start_state, depth)['is_oll']), the rest are ONLL
+#   states      start states used, counterbalanced (counts differ by at most one)
+#   no repeats  a trial never has the same (depth, start_state) as the one before it
+#   max_run     most trials of the same depth in a row
+# The trial types (depth, OLL or not) are fixed by the constraints; a randomized local search
+# (swap two trials, or move a trial to another start state of its type) brings the violations
+# down to zero from a random order. Searches run in a process pool, several per task.
+
+import argparse, math, os, random, time
+from concurrent.futures import ProcessPoolExecutor
+from PlanningTask import scoring, timeline
+
+DEPTHS = [3, 4, 5]
+DURATION = 541 # Length of the R1/R2 runs (32 trials of depth 3, 4 and 5)
+OLL_SHARE = 0.5
+MAX_RUN = 3
+MAX_STEPS = 20000 # Local search steps before a search gives up (search_chunk goes on with a new random order)
+CHUNK_SIZE = 10 # Candidates searched per pool task
+HEADER = 'Trial Types: %s, Initial State, Time Out Duration, ExtraArgs (None)'
+
+def depth_counts(depths, n):
+    """
+    Number of trials of each depth when n trials are split evenly (the first depths get the remainder)
+    """
+    return [n // len(depths) + (1 if i < n % len(depths) else 0) for i in range(len(depths))]
+
+def run_length(depths, n):
+    """
+    Seconds of a run of n trials split evenly over depths (timeline.Timeline's end)
+    """
+    return timeline.LEAD_IN + sum(count * timeline.slot_duration(depth) for depth, count in zip(depths, depth_counts(depths, n)))
+
+class Spec:
+    """
+    Constraints of the schedules to generate
+    """
+    def __init__(self, depths = DEPTHS, duration = DURATION, oll = OLL_SHARE, states = None, max_run = MAX_RUN):
+        self.depths = list(depths)
+        self.duration = duration
+        self.oll = oll
+        self.states = sorted(states or scoring.STATES)
+        self.max_run = max_run
+        self.n_trials = 1
+        while run_length(self.depths, self.n_trials) < duration:
+            self.n_trials += 1
+        if run_length(self.depths, self.n_trials) != duration:
+            raise ValueError('no number of trials split over depths %s makes a %i s run (%i s, then %s)' % (self.depths, duration, timeline.LEAD_IN,
+                ', '.join('%i s for depth %i' % (timeline.slot_duration(d), d) for d in self.depths)))
+        self.allowed = {} # (depth, is_oll) -> start states of that type
+        self.types = [] # (depth, is_oll) of every trial
+        for depth, n_depth in zip(self.depths, depth_counts(self.depths, self.n_trials)):
+            n_oll = int(round(n_depth * oll))
+            for is_oll, count in [(True, n_oll), (False, n_depth - n_oll)]:
+                allowed = [s for s in self.states if scoring.get_outcome_info(s, depth)['is_oll'] == is_oll]
+                if count and not allowed:
+                    raise ValueError('no start state in %s has %s trials at depth %i' % (self.states, 'OLL' if is_oll else 'ONLL', depth))
+                self.allowed[(depth, is_oll)] = allowed
+                self.types.extend([(depth, is_oll)] * count)
+        self.min_count = self.n_trials // len(self.states) # Counterbalanced: every state used min_count or min_count + 1 times
+        self.max_count = int(math.ceil(float(self.n_trials) / len(self.states)))
+
+def violations(spec, trials):
+    """
+    Number of broken constraints in trials [(depth, start_state), ...] (0: a valid schedule)
+    """
+    cost = 0
+    run = 1
+    for i in range(1, len(trials)):
+        if trials[i] == trials[i - 1]:
+            cost += 1
+        run = run + 1 if trials[i][0] == trials[i - 1][0] else 1
+        if run > spec.max_run:
+            cost += 1
+    counts = dict((s, 0) for s in spec.states)
+    for depth, start_state in trials:
+        counts[start_state] += 1
+    for count in counts.values():
+        cost += max(0, count - spec.max_count) + max(0, spec.min_count - count)
+    return cost
+
+def search(spec, rng, max_steps = MAX_STEPS):
+    """
+    One schedule [(depth, start_state), ...] meeting spec, or None if max_steps were not enough
+    """
+    types = list(spec.types)
+    rng.shuffle(types)
+    counts = dict((s, 0) for s in spec.states)
+    trials = []
+    for t in types: # Start from the least used states, so the counts are nearly balanced already
+        allowed = spec.allowed[t]
+        fewest = min(counts[s] for s in allowed)
+        start_state = rng.choice([s for s in allowed if counts[s] == fewest])
+        counts[start_state] += 1
+        trials.append((t[0], start_state))
+    cost = violations(spec, trials)
+    for step in range(max_steps):
+        if cost == 0:
+            return trials
+        i = rng.randrange(len(trials))
+        if rng.random() < 0.5:
+            j = rng.randrange(len(trials))
+            trials[i], trials[j], types[i], types[j] = trials[j], trials[i], types[j], types[i]
+            new_cost = violations(spec, trials)
+            if new_cost <= cost or rng.random() < 0.01:
+                cost = new_cost
+            else:
+                trials[i], trials[j], types[i], types[j] = trials[j], trials[i], types[j], types[i]
+        else:
+            old = trials[i]
+            trials[i] = (old[0], rng.choice(spec.allowed[types[i]]))
+            new_cost = violations(spec, trials)
+            if new_cost <= cost or rng.random() < 0.01:
+                cost = new_cost
+            else:
+                trials[i] = old
+    return None
+
+def search_chunk(args):
+    """
+    n schedules meeting spec (fewer if some searches ran out of steps), from one seed
+    """
+    spec, n, seed = args
+    rng = random.Random(seed)
+    found = []
+    for _ in range(n):
+        trials = search(spec, rng)
+        if trials is not None:
+            found.append(trials)
+    return found
+
+def generate(spec, n, workers = None, seed = 0):
+    """
+    Up to n distinct schedules meeting spec
+    Returns ([schedule, ...], seconds it took)
+    """
+    jobs = [(spec, min(CHUNK_SIZE, n - first), seed + i) for i, first in enumerate(range(0, n, CHUNK_SIZE))]
+    start = time.time()
+    if workers == 1:
+        results = list(map(search_chunk, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            results = list(pool.map(search_chunk, jobs))
+    schedules = []
+    seen = set()
+    for found in results:
+        for trials in found:
+            if tuple(trials) not in seen:
+                seen.add(tuple(trials))
+                schedules.append(trials)
+    return schedules, time.time() - start
+
+def write_schedule(filename, trials, depths):
+    with open(filename, 'w') as fout:
+        fout.write(HEADER % '; '.join('%i = "%i Depth"' % (d, d) for d in depths) + '\n')
+        for depth, start_state in trials:
+            fout.write('%i,%i,None,%i\n' % (depth, start_state, timeline.PLANNING_DURATION))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Generate Planning Task schedules that satisfy trial balance and ordering constraints.')
+    parser.add_argument('-d', '--depths', type = int, nargs = '+', default = DEPTHS, help = 'depths of the trials, in equal numbers')
+    parser.add_argument('--duration', type = int, default = DURATION, help = 'run length in seconds (%i + %s)' % (timeline.LEAD_IN, ', '.join('%i per depth %i trial' % (timeline.slot_duration(d), d) for d in DEPTHS)))
+    parser.add_argument('--oll', type = float, default = OLL_SHARE, help = 'share of OLL trials at each depth')
+    parser.add_argument('--states', type = int, nargs = '+', default = None, help = 'start states to use, counterbalanced (default: all)')
+    parser.add_argument('--max-run', type = int, default = MAX_RUN, help = 'most trials of the same depth in a row')
+    parser.add_argument('-n', '--candidates', type = int, default = 100, help = 'schedules to generate')
+    parser.add_argument('-j', '--workers', type = int, default = None, help = 'worker processes (default: one per core, 1 = no pool)')
+    parser.add_argument('-s', '--seed', type = int, default = 0, help = 'random seed')
+    parser.add_argument('-o', '--out_dir', default = 'generated_schedules', help = 'where the .schedule files go')
+    parser.add_argument('--prefix', default = 'PlanningTask_GEN', help = 'file names are PREFIX_NNN.schedule')
+    args = parser.parse_args(argv)
+    try:
+        spec = Spec(args.depths, args.duration, args.oll, args.states, args.max_run)
+    except ValueError as e:
+        parser.error(str(e))
+    schedules, elapsed = generate(spec, args.candidates, args.workers, args.seed)
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    for i, trials in enumerate(schedules):
+        write_schedule(os.path.join(args.out_dir, '%s_%03i.schedule' % (args.prefix, i + 1)), trials, spec.depths)
+    print('%i trials per schedule (%i s), %i schedules in %.2f s -> %s' % (spec.n_trials, spec.duration, len(schedules), elapsed, args.out_dir))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Planning Task path engine
+# Array-backed enumeration of every move sequence on the decision graph.
+# The graph becomes an (n_states x 2) next-state array and an (n_states x 2) reward array
+# (column 0 is 'left', column 1 is 'right'), and a block of paths is scored at once by
+# gathering from those arrays over a bit-matrix of choices (bit 0 = left, 1 = right).
+# Deep trees are scored chunk by chunk so memory stays bounded by chunk_size.
+
+import numpy
+from PlanningTask import scoring
+
+ACTIONS = ['left', 'right'] #column order of the next-state/reward arrays
+DEFAULT_CHUNK_SIZE = 2 ** 16 #paths scored per chunk--about 1.5MB of choice bits at depth 20
+
+class PathEngine:
+    """
+    Transition/reward arrays for a state graph shaped like scoring.STATES
+    """
+    def __init__(self, states = scoring.STATES, large_loss = scoring.LARGE_LOSS):
+        self.state_ids = sorted(states) #row i of the arrays is state self.state_ids[i]
+        self.index = dict((s, i) for i, s in enumerate(self.state_ids))
+        self.large_loss = large_loss
+        n = len(self.state_ids)
+        self.next_state = numpy.zeros((n, 2), dtype = numpy.int64)
+        self.reward = numpy.zeros((n, 2), dtype = numpy.int64)
+        for s in self.state_ids:
+            for a, action in enumerate(ACTIONS):
+                self.next_state[self.index[s], a] = self.index[states[s][action]['state']]
+                self.reward[self.index[s], a] = states[s][action]['value']
+
+    def choice_bits(self, depth, first = 0, last = None):
+        """
+        Choice matrix for paths first..last-1 (all 2^depth paths by default)
+        Row p holds the moves of path p, most significant bit first, so rows are in the
+        same order as scoring.get_possible_transitions(depth)
+        """
+        if last is None: last = 2 ** depth
+        paths = numpy.arange(first, last, dtype = numpy.int64)
+        shifts = numpy.arange(depth - 1, -1, -1, dtype = numpy.int64)
+        return ((paths[:, None] >> shifts[None, :]) & 1).astype(numpy.int8)
+
+    def score_bits(self, start_state, bits):
+        """
+        Score a choice matrix from start_state
+        Returns (totals, has_large_loss, final_states) with one entry per row of bits
+        """
+        n_paths, depth = bits.shape
+        current = numpy.full(n_paths, self.index[start_state], dtype = numpy.int64)
+        totals = numpy.zeros(n_paths, dtype = numpy.int64)
+        has_large_loss = numpy.zeros(n_paths, dtype = bool)
+        for step in range(depth):
+            choice = bits[:, step]
+            step_reward = self.reward[current, choice]
+            totals += step_reward
+            has_large_loss |= step_reward == self.large_loss
+            current = self.next_state[current, choice]
+        return totals, has_large_loss, current
+
+    def score_paths(self, start_state, depth, first = 0, last = None):
+        """
+        Score paths first..last-1 of the depth tree from start_state in one batch
+        """
+        return self.score_bits(start_state, self.choice_bits(depth, first, last))
+
+    def iter_chunks(self, start_state, depth, chunk_size = DEFAULT_CHUNK_SIZE):
+        """
+        Yield (first_path, totals, has_large_loss) chunk by chunk so that at most
+        chunk_size paths are materialized at once
+        """
+        n_paths = 2 ** depth
+        for first in range(0, n_paths, chunk_size):
+            last = min(first + chunk_size, n_paths)
+            totals, has_large_loss, _ = self.score_paths(start_state, depth, first, last)
+            yield first, totals, has_large_loss
+
+    def summarize(self, start_state, depth, chunk_size = DEFAULT_CHUNK_SIZE):
+        """
+        Same summary as scoring.compute_outcome_info, built from chunked batches
+        """
+        distribution = {}
+        oll_totals = set()
+        no_ll_points = None
+        for _, totals, has_large_loss in self.iter_chunks(start_state, depth, chunk_size):
+            values, counts = numpy.unique(totals, return_counts = True)
+            for v, c in zip(values.tolist(), counts.tolist()):
+                distribution[v] = distribution.get(v, 0) + c
+            oll_totals.update(numpy.unique(totals[has_large_loss]).tolist())
+            if not has_large_loss.all():
+                chunk_no_ll = int(totals[~has_large_loss].max())
+                if no_ll_points is None or chunk_no_ll > no_ll_points: no_ll_points = chunk_no_ll
+        unique_points = sorted(distribution, reverse = True)
+        max_points = unique_points[0]
+        return {
+            'max_points': max_points,
+            'is_oll': max_points in oll_totals,
+            'ap_points': unique_points[1] if len(unique_points) > 1 else None,
+            'no_ll_points': no_ll_points,
+            'distribution': distribution
+        }
+
+    def best_paths(self, start_state, depth, chunk_size = DEFAULT_CHUNK_SIZE):
+        """
+        Every path worth the maximum total, as lists of 'left'/'right' moves
+        """
+        best = None
+        best_rows = []
+        for first, totals, _ in self.iter_chunks(start_state, depth, chunk_size):
+            chunk_max = int(totals.max())
+            if best is None or chunk_max > best:
+                best = chunk_max
+                best_rows = []
+            if chunk_max == best:
+                best_rows.extend((first + numpy.flatnonzero(totals == best)).tolist())
+        return [[ACTIONS[b] for b in self.choice_bits(depth, p, p + 1)[0]] for p in best_rows]
+
+ENGINE = PathEngine()
@@ -0,0 +1,110 @@
+# Planning Task planner
+# Backward induction over the decision graph. Instead of enumerating all 2^depth paths,
+# the tables for depth d are built from the tables for depth d-1, so filling every
+# (state, depth) pair costs O(states x depth x k).
+#
+# For every (state, depth) the planner keeps:
+#   value           the most points possible
+#   actions         the moves ('left'/'right') that start an optimal path
+#   oll             True if at least one optimal path includes a large loss
+#   no_ll_value     the most points possible without any large loss (None if impossible)
+#   k_best          the k best distinct path totals, best first
+#   distribution    {total points: number of paths with that total}
+
+ACTIONS = ['left', 'right']
+
+class Planner:
+    """
+    Dynamic-programming planner for a state graph shaped like scoring.STATES
+    """
+    def __init__(self, states, large_loss, max_depth = 1, k = 3):
+        self.states = states
+        self.large_loss = large_loss
+        self.k = max(k, 2) #the aversive pruning value needs at least the 2 best totals
+        #depth 0: no moves left, 0 points and a single (empty) path
+        self.tables = [dict((s, {
+            'value': 0,
+            'actions': [],
+            'oll': False,
+            'no_ll_value': 0,
+            'k_best': [0],
+            'distribution': {0: 1}
+        }) for s in states)]
+        self.extend(max_depth)
+
+    def max_depth(self):
+        return len(self.tables) - 1
+
+    def extend(self, depth):
+        """
+        Fill the tables up to (and including) depth
+        """
+        while self.max_depth() < depth:
+            previous = self.tables[-1]
+            table = {}
+            for s in self.states:
+                options = [] #(action, reward, next state entry)
+                for action in ACTIONS:
+                    move = self.states[s][action]
+                    options.append((action, move['value'], previous[move['state']]))
+                value = max(r + nxt['value'] for _, r, nxt in options)
+                best = [o for o in options if o[1] + o[2]['value'] == value]
+                no_ll = [r + nxt['no_ll_value'] for _, r, nxt in options if r != self.large_loss and nxt['no_ll_value'] is not None]
+                totals = set()
+                distribution = {}
+                for _, r, nxt in options:
+                    totals.update(r + v for v in nxt['k_best'])
+                    for v, count in nxt['distribution'].items():
+                        distribution[r + v] = distribution.get(r + v, 0) + count
+                table[s] = {
+                    'value': value,
+                    'actions': [a for a, _, _ in best],
+                    'oll': any(r == self.large_loss or nxt['oll'] for _, r, nxt in best),
+                    'no_ll_value': max(no_ll) if no_ll else None,
+                    'k_best': sorted(totals, reverse = True)[:self.k],
+                    'distribution': distribution
+                }
+            self.tables.append(table)
+
+    def entry(self, state, depth):
+        self.extend(depth)
+        return self.tables[depth][state]
+
+    def value(self, state, depth):
+        return self.entry(state, depth)['value']
+
+    def optimal_actions(self, state, depth):
+        return self.entry(state, depth)['actions']
+
+    def no_large_loss_value(self, state, depth):
+        return self.entry(state, depth)['no_ll_value']
+
+    def k_best(self, state, depth):
+        return self.entry(state, depth)['k_best']
+
+    def is_oll(self, state, depth):
+        return self.entry(state, depth)['oll']
+
+    def optimal_paths(self, state, depth):
+        """
+        Every optimal move sequence, following the optimal action sets down the tree
+        """
+        if depth == 0: return [[]]
+        paths = []
+        for action in self.optimal_actions(state, depth):
+            for rest in self.optimal_paths(self.states[state][action]['state'], depth - 1):
+                paths.append([action] + rest)
+        return paths
+
+    def outcome_info(self, state, depth):
+        """
+        The summary used to classify trial outcomes (see scoring.get_outcome_info)
+        """
+        entry = self.entry(state, depth)
+        return {
+            'max_points': entry['value'],
+            'is_oll': entry['oll'],
+            'ap_points': entry['k_best'][1] if len(entry['k_best']) > 1 else None,
+            'no_ll_points': entry['no_ll_value'],
+            'distribution': entry['distribution']
+        }
@@ -0,0 +1,158 @@
+# Planning Task pruning model
+# Likelihood of a subject's choices under a Pavlovian pruning model, for a whole batch of
+# parameter vectors at once.
+#
+# usage: python -m PlanningTask.pruning_model OUTPUT_CSV [OUTPUT_CSV ...]
+# (fits one subject from its run files; run from the StimTool directory)
+#
+# Every path of every (start_state, depth) is enumerated once (path_engine order: move t of
+# path p is bit t of p, most significant first, 0 = left). A path's value discounts each
+# reward by the product of the continuation probabilities of the moves before it: gamma_s after
+# a large loss (specific pruning) and gamma_g after any other move (general discounting):
+#
+#   V(path) = sum_t r_t * prod_{k<t} (gamma_s if r_k is a large loss else gamma_g)
+#
+# The subject enters the whole path, chosen by softmax over all paths of the trial (inverse
+# temperature beta), mixed with a lapse (uniform over paths) of weight epsilon.
+# Parameters are rows [beta, gamma_g, gamma_s, epsilon]; log_likelihood scores an (M x 4)
+# batch against all of a subject's trials with dense (M x paths x depth) array operations,
+# grouped by (start_state, depth) so the trials of a group cost one gather.
+
+import numpy, time, sys
+from PlanningTask import scoring, path_engine, rescore
+
+MODEL_VERSION = 1 # Bump when the model or its parameters change (fitted results are cached by version)
+PARAMS = ['beta', 'gamma_g', 'gamma_s', 'epsilon']
+GRID = { # Values tried by fit_grid for each parameter
+    'beta': numpy.geomspace(0.001, 1, 16),
+    'gamma_g': numpy.linspace(0.5, 1, 11),
+    'gamma_s': numpy.linspace(0, 1, 11),
+    'epsilon': numpy.array([0.0, 0.02, 0.05, 0.1, 0.2]),
+}
+BOUNDS = {'beta': (1e-6, 10), 'gamma_g': (0, 1), 'gamma_s': (0, 1), 'epsilon': (0, 0.999)}
+REFINE_STEPS = 4 # Zoomed-in grids fit searches after the first one
+REFINE_POINTS = 7 # Values per parameter in each zoomed-in grid
+
+class PathTensors:
+    """
+    Per-step rewards and large-loss flags of every path of every (start_state, depth)
+    """
+    def __init__(self, engine = path_engine.ENGINE, max_depth = scoring.MAX_DEPTH):
+        self.engine = engine
+        self.rewards = {} # (start_state, depth) -> (paths x depth) rewards
+        self.large_loss = {} # (start_state, depth) -> (paths x depth) bool
+        for start_state in engine.state_ids:
+            for depth in range(1, max_depth + 1):
+                self.add(start_state, depth)
+
+    def add(self, start_state, depth):
+        bits = self.engine.choice_bits(depth).astype(numpy.int64)
+        current = numpy.full(len(bits), self.engine.index[start_state], dtype = numpy.int64)
+        rewards = numpy.zeros(bits.shape)
+        for step in range(depth):
+            rewards[:, step] = self.engine.reward[current, bits[:, step]]
+            current = self.engine.next_state[current, bits[:, step]]
+        self.rewards[(start_state, depth)] = rewards
+        self.large_loss[(start_state, depth)] = rewards == self.engine.large_loss
+
+    def get(self, start_state, depth):
+        if (start_state, depth) not in self.rewards:
+            self.add(start_state, depth)
+        return self.rewards[(start_state, depth)], self.large_loss[(start_state, depth)]
+
+TENSORS = PathTensors()
+
+def path_index(moves):
+    """
+    Row of the path made of moves ('left'/'right') in the path tensors
+    """
+    index = 0
+    for move in moves:
+        index = index * 2 + path_engine.ACTIONS.index(move)
+    return index
+
+def group_trials(trials):
+    """
+    {(start_state, depth): array of chosen path indices} from [(start_state, depth, moves), ...]--misses are left out
+    """
+    groups = {}
+    for start_state, depth, moves in trials:
+        if len(moves) != depth: continue
+        groups.setdefault((start_state, depth), []).append(path_index(moves))
+    return dict((key, numpy.array(idx, dtype = numpy.int64)) for key, idx in groups.items())
+
+def path_values(params, rewards, large_loss):
+    """
+    (M x paths) values of every path for every parameter row
+    """
+    gamma = numpy.where(large_loss[None, :, :], params[:, None, None, 2], params[:, None, None, 1]) # Continuation after each move
+    carry = numpy.cumprod(gamma, axis = 2)
+    carry = numpy.concatenate([numpy.ones(carry.shape[:2] + (1,)), carry[:, :, :-1]], axis = 2) # Product over the moves before each one
+    return (rewards[None, :, :] * carry).sum(axis = 2)
+
+def log_likelihood(params, groups, tensors = TENSORS):
+    """
+    Log-likelihood of the grouped trials for each row of params (M x 4, or a single vector)
+    """
+    params = numpy.atleast_2d(numpy.asarray(params, dtype = float))
+    total = numpy.zeros(len(params))
+    beta = params[:, 0:1]
+    epsilon = params[:, 3]
+    for (start_state, depth), chosen in groups.items():
+        rewards, large_loss = tensors.get(start_state, depth)
+        logits = beta * path_values(params, rewards, large_loss)
+        logits -= logits.max(axis = 1, keepdims = True)
+        log_softmax = logits - numpy.log(numpy.exp(logits).sum(axis = 1, keepdims = True))
+        p = (1 - epsilon)[:, None] * numpy.exp(log_softmax[:, chosen]) + (epsilon / rewards.shape[0])[:, None]
+        total += numpy.log(numpy.maximum(p, 1e-300)).sum(axis = 1)
+    return total
+
+def make_grid(values):
+    """
+    Every combination of values[name] for the names in PARAMS, as an (M x 4) array
+    """
+    mesh = numpy.meshgrid(*[values[name] for name in PARAMS], indexing = 'ij')
+    return numpy.stack([m.ravel() for m in mesh], axis = 1)
+
+def fit_grid(groups, grid = None, refine_steps = REFINE_STEPS, tensors = TENSORS):
+    """
+    Maximum-likelihood parameters: the best point of GRID, then of successively finer grids around it
+    Returns ({parameter: value}, log-likelihood)
+    """
+    values = dict(GRID) if grid is None else grid
+    best, best_ll = None, -numpy.inf
+    for step in range(refine_steps + 1):
+        points = make_grid(values)
+        ll = log_likelihood(points, groups, tensors)
+        i = int(numpy.argmax(ll))
+        if ll[i] > best_ll:
+            best, best_ll = points[i], ll[i]
+        values = {}
+        for j, name in enumerate(PARAMS): # Around the best value, half the spacing of the last grid on each side
+            tried = numpy.unique(points[:, j])
+            spacing = (tried.max() - tried.min()) / max(1, len(tried) - 1) if len(tried) > 1 else 0
+            low, high = BOUNDS[name]
+            values[name] = numpy.unique(numpy.clip(numpy.linspace(best[j] - spacing, best[j] + spacing, REFINE_POINTS), low, high))
+    return dict(zip(PARAMS, best.tolist())), float(best_ll)
+
+def subject_trials(filenames):
+    """
+    [(start_state, depth, moves), ...] of the scanned task trials in a subject's output files
+    """
+    trials = []
+    for filename in filenames:
+        for row in rescore.rescore_file(filename):
+            phase, start_state, depth, moves = row[4], row[6], row[7], row[8]
+            if phase != 'task' or start_state is None: continue
+            trials.append((start_state, depth, moves.split('-') if moves else []))
+    return trials
+
+def main(argv = None):
+    filenames = sys.argv[1:] if argv is None else argv
+    start = time.time()
+    trials = subject_trials(filenames)
+    params, ll = fit_grid(group_trials(trials))
+    print('%i trials: ' % len(trials) + ', '.join('%s=%.4g' % (name, params[name]) for name in PARAMS) + ', log-likelihood %.2f (%.2f s)' % (ll, time.time() - start))
+
+if __name__ == '__main__':
+    main()
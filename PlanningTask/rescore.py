@@ -0,0 +1,166 @@
+# Planning Task offline re-scoring
+# Re-derives the outcome of every trial from the RESPONSE rows of the output CSVs,
+# using the current rules in scoring.py, and writes one consolidated per-trial table.
+#
+# usage: python -m PlanningTask.rescore OUTPUT_DIR [-o rescored.csv] [-p '*PT-R*.csv'] [--phase task] [-j N]
+# (run from the StimTool directory)
+#
+# Each file is streamed once. A trial starts at its TRIAL_ONSET row; its RESPONSE rows carry
+# '{start_state}_{depth}_{key index}' as trial_type and -1/1 (left/right) as response, and
+# the OUTCOME row holds the label that was computed live, kept here for comparison (trials with
+# no OUTCOME row, e.g. skipped ones, are not flagged as changed). Trials before TASK_ONSET
+# (the example trials) are in phase 'pre_task', the scored ones in phase 'task'.
+# Files are spread over a process pool; each worker uses the outcome table built at import.
+
+import argparse, csv, fnmatch, os, time
+from concurrent.futures import ProcessPoolExecutor
+from PlanningTask import scoring
+
+TRIAL_ONSET = 3 #event codes, see PlanningTask.event_types
+TASK_ONSET = 2
+RESPONSE = 8
+OUTCOME = 10
+MISS_POINTS = -200 #points given when not all moves were entered
+
+MOVES = {'-1': 'left', '1': 'right'}
+PHASES = ['task', 'pre_task']
+SIDECAR_SUFFIXES = ('_frames.csv', '_slides.csv', '_timeline.csv', '_waits.csv') # Written next to each run's CSV, not behavioral data
+
+COLUMNS = ['file', 'subject', 'session', 'run_id', 'phase', 'trial', 'start_state', 'depth', 'moves', 'points', 'outcome', 'logged_outcome', 'changed']
+
+def find_files(output_dir, pattern):
+    """
+    Every file under output_dir whose name matches pattern, sorted (sidecar files left out)
+    """
+    found = []
+    for root, dirs, files in os.walk(output_dir):
+        for f in files:
+            if fnmatch.fnmatch(f, pattern) and not f.endswith(SIDECAR_SUFFIXES):
+                found.append(os.path.join(root, f))
+    return sorted(found)
+
+def read_schedule(schedule_file):
+    """
+    [(depth, start_state), ...] for each trial of a .schedule file
+    """
+    trials = []
+    with open(schedule_file, 'r') as fin:
+        for idx, line in enumerate(fin):
+            if idx == 0: continue
+            row = line.strip().split(',')
+            if len(row) > 1:
+                trials.append((int(row[0]), int(row[1])))
+    return trials
+
+def find_schedule(header, schedule_dir):
+    """
+    The schedule named in the 'Parameter File:' field of the output file header, if it exists in schedule_dir
+    """
+    fields = header.split(',')
+    if 'Parameter File:' not in fields: return None
+    name = fields[fields.index('Parameter File:') + 1].replace('\\', '/').split('/')[-1]
+    path = os.path.join(schedule_dir, name)
+    if os.path.isfile(path): return read_schedule(path)
+    return None
+
+def score_trial(trial):
+    """
+    Re-run outcome classification for one reconstructed trial
+    """
+    moves = [m for _, m in sorted(trial['moves'])]
+    depth = trial['depth']
+    start_state = trial['start_state']
+    if len(moves) < depth:
+        outcome = 'Miss'
+        points = MISS_POINTS
+    else:
+        outcome = scoring.classify_outcome(start_state, depth, moves)
+        points = sum(scoring.get_path_points(start_state, moves))
+    changed = trial['logged_outcome'] != '' and outcome != trial['logged_outcome']
+    return [trial['phase'], trial['trial'], start_state, depth, '-'.join(moves), points, outcome, trial['logged_outcome'], changed]
+
+def rescore_file(filename, schedule_dir = os.path.dirname(os.path.abspath(__file__))):
+    """
+    Stream one output CSV and return a row of COLUMNS for every trial whose depth is known
+    """
+    name = os.path.basename(filename)[:-4].split('-', 2) #output files are named SID-session_id-run_id(.csv), see StimToolLib.generate_prefix
+    subject, session, run_id = (name + ['', ''])[:3]
+    rows = []
+    trials = []
+    schedule = None
+    phase = 'pre_task'
+    task_trial = 0
+    with open(filename, 'r') as fin:
+        reader = csv.reader(fin)
+        for idx, line in enumerate(reader):
+            if idx == 0:
+                if not line or line[0] != 'Administrator:': return rows #not a behavioral file (e.g. the _frames.csv frame timing summary)
+                schedule = find_schedule(','.join(line), schedule_dir)
+                continue
+            if len(line) < 7 or not line[2].isdigit(): continue #column header or a truncated last line
+            code = int(line[2])
+            if code == TASK_ONSET:
+                phase = 'task'
+            elif code == TRIAL_ONSET:
+                trial = {'phase': phase, 'trial': line[0], 'depth': None, 'start_state': None, 'moves': [], 'logged_outcome': ''}
+                try:
+                    trial['depth'] = int(line[1])
+                except ValueError:
+                    pass
+                if phase == 'task' and schedule and task_trial < len(schedule):
+                    trial['depth'], trial['start_state'] = schedule[task_trial]
+                if phase == 'task': task_trial += 1
+                trials.append(trial)
+            elif code == RESPONSE and trials and line[5] in MOVES:
+                parts = line[1].split('_')
+                if len(parts) != 3 or not all(p.isdigit() for p in parts): continue #free training/path test responses
+                trial = trials[-1]
+                trial['start_state'] = int(parts[0])
+                trial['depth'] = int(parts[1])
+                trial['moves'].append((int(parts[2]), MOVES[line[5]]))
+            elif code == OUTCOME and trials:
+                trials[-1]['logged_outcome'] = line[6]
+    for trial in trials:
+        if trial['depth'] is None: continue
+        rows.append([filename, subject, session, run_id] + score_trial(trial))
+    return rows
+
+def rescore(output_dir, out_file, pattern = '*PT-R*.csv', workers = None, phase = 'task'):
+    """
+    Re-score every matching file in output_dir and write the per-trial table to out_file
+    Only trials of phase are written (None: all of them)
+    Returns (number of files, number of trials)
+    """
+    files = find_files(output_dir, pattern)
+    n_trials = 0
+    with open(out_file, 'w', newline = '') as fout:
+        writer = csv.writer(fout)
+        writer.writerow(COLUMNS)
+        if workers == 1:
+            results = map(rescore_file, files)
+        else:
+            pool = ProcessPoolExecutor(max_workers = workers)
+            results = pool.map(rescore_file, files, chunksize = max(1, len(files) // 64))
+        for rows in results:
+            if phase is not None:
+                rows = [row for row in rows if row[4] == phase]
+            writer.writerows(rows)
+            n_trials += len(rows)
+        if workers != 1:
+            pool.shutdown()
+    return len(files), n_trials
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Re-score Planning Task output files with the current outcome rules.')
+    parser.add_argument('output_dir', help = 'directory searched (recursively) for output CSVs')
+    parser.add_argument('-o', '--out', default = 'rescored_trials.csv', help = 'consolidated per-trial table to write')
+    parser.add_argument('-p', '--pattern', default = '*PT-R*.csv', help = 'file name pattern of the runs to re-score')
+    parser.add_argument('--phase', choices = PHASES + ['all'], default = 'task', help = "trials to write: the scored ones (task), the examples before the task onset (pre_task) or all")
+    parser.add_argument('-j', '--workers', type = int, default = None, help = 'worker processes (default: one per core, 1 = no pool)')
+    args = parser.parse_args(argv)
+    start = time.time()
+    n_files, n_trials = rescore(args.output_dir, args.out, args.pattern, args.workers, None if args.phase == 'all' else args.phase)
+    print('re-scored %i trials from %i files in %.2f s -> %s' % (n_trials, n_files, time.time() - start, args.out))
+
+if __name__ == '__main__':
+    main()
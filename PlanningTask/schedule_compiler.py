@@ -0,0 +1,154 @@
+# Planning Task schedule compiler
+# Validates a .schedule (the text format stays the authoring source) against the state graph and
+# the run timeline (every trial must fit in its slot, see timeline.slot_duration) and compiles it
+# into a packed array of trials with their metadata, saved next to it as .schedulec.
+# run_try loads the compiled file with one read into typed arrays instead of parsing strings.
+#
+# usage: python -m PlanningTask.schedule_compiler [SCHEDULE ...]
+# (run from the StimTool directory; compiles every .schedule in PlanningTask/ by default)
+#
+# .schedulec layout: HEADER (magic, FORMAT_VERSION, sha1 of the .schedule text, number of trials)
+# followed by one TRIAL_DTYPE record per trial, little-endian, no padding. The compiled files are
+# committed next to their schedules. load_schedule only uses one when its sha1 matches the current
+# text (line endings aside, see source_digest); otherwise it compiles in memory. Files that fail
+# validation are reported and skipped by main (PlanningTask_RP_LEFT.schedule holds IAT rows).
+#
+# Fields:
+#   depth, start_state      columns 1 and 2 of the schedule
+#   goal_state              column 3 (training runs' correct last state), -1 for None
+#   timeout                 column 4, nan for None
+#   max_points, is_oll      scoring.get_outcome_info(start_state, depth)
+#   onset                   planned trial start in seconds after the task onset (timeline.Timeline)
+
+import hashlib, os, struct, sys
+import numpy
+from PlanningTask import scoring, timeline
+
+FORMAT_VERSION = 2 # Bump when TRIAL_DTYPE or the metadata change (older .schedulec files are then ignored)
+MAGIC = b'PTSC'
+HEADER = struct.Struct('<4sH20sI')
+TRIAL_DTYPE = numpy.dtype([ # Field order matters: trial[0], trial[1], trial[2] are depth, start_state, goal_state as in the text rows
+    ('depth', '<u1'),
+    ('start_state', '<u1'),
+    ('goal_state', '<i1'),
+    ('timeout', '<f4'),
+    ('max_points', '<i2'),
+    ('is_oll', '?'),
+    ('onset', '<f4'),
+])
+
+class ScheduleError(Exception):
+    pass
+
+def compiled_name(schedule_file):
+    return schedule_file + 'c'
+
+def source_digest(text):
+    """
+    sha1 of the bytes of a .schedule, with Windows line endings counted as Unix ones (git may convert them on checkout)
+    """
+    return hashlib.sha1(text.replace(b'\r\n', b'\n')).digest()
+
+def reachable_states(start_state, depth):
+    """
+    States the path can end in after exactly depth moves from start_state
+    """
+    states = set([start_state])
+    for _ in range(depth):
+        states = set(scoring.STATES[s][move]['state'] for s in states for move in ('left', 'right'))
+    return states
+
+def parse_schedule(text, schedule_file = 'schedule'):
+    """
+    Validated [(depth, start_state, goal_state or None, timeout or None), ...] from the text of a .schedule
+    """
+    rows = []
+    for idx, line in enumerate(text.splitlines()):
+        if idx == 0 or not line.strip(): continue # Header
+        where = '%s line %i' % (schedule_file, idx + 1)
+        row = line.strip().split(',')
+        if len(row) < 2:
+            raise ScheduleError('%s: expected depth,start_state,... got %r' % (where, line))
+        try:
+            depth, start_state = int(row[0]), int(row[1])
+            goal_state = None if len(row) < 3 or row[2] == 'None' else int(row[2])
+            timeout = None if len(row) < 4 or row[3] == 'None' else float(row[3])
+        except ValueError:
+            raise ScheduleError('%s: not a Planning Task trial: %r' % (where, line))
+        if start_state not in scoring.STATES:
+            raise ScheduleError('%s: start state %i is not in the state graph' % (where, start_state))
+        if depth < 1:
+            raise ScheduleError('%s: depth %i' % (where, depth))
+        if goal_state is not None and goal_state not in reachable_states(start_state, depth):
+            raise ScheduleError('%s: state %i cannot be reached from %i in %i moves' % (where, goal_state, start_state, depth))
+        try:
+            timeline.slot_duration(depth)
+        except timeline.TimelineError as e:
+            raise ScheduleError('%s: %s' % (where, e))
+        rows.append((depth, start_state, goal_state, timeout))
+    return rows
+
+def compile_rows(rows):
+    """
+    TRIAL_DTYPE array of parsed rows, with the metadata filled in
+    """
+    plan = timeline.Timeline([(depth, start_state) for depth, start_state, goal_state, timeout in rows])
+    trials = numpy.zeros(len(rows), dtype = TRIAL_DTYPE)
+    for i, (depth, start_state, goal_state, timeout) in enumerate(rows):
+        info = scoring.get_outcome_info(start_state, depth)
+        trials[i] = (depth, start_state, -1 if goal_state is None else goal_state, numpy.nan if timeout is None else timeout,
+            info['max_points'], info['is_oll'], plan.trials[i].start)
+    return trials
+
+def compile_schedule(schedule_file):
+    """
+    Compile schedule_file into its .schedulec--returns the trials
+    """
+    with open(schedule_file, 'rb') as fin:
+        text = fin.read()
+    trials = compile_rows(parse_schedule(text.decode('utf-8'), schedule_file))
+    with open(compiled_name(schedule_file), 'wb') as fout:
+        fout.write(HEADER.pack(MAGIC, FORMAT_VERSION, source_digest(text), len(trials)))
+        fout.write(trials.tobytes())
+    return trials
+
+def read_compiled(compiled_file, source_sha1 = None):
+    """
+    Trials of a .schedulec, or None if it is missing, of another FORMAT_VERSION or (given source_sha1) compiled from other text
+    """
+    if not os.path.isfile(compiled_file): return None
+    with open(compiled_file, 'rb') as fin:
+        data = fin.read()
+    if len(data) < HEADER.size: return None
+    magic, version, sha1, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or (source_sha1 is not None and sha1 != source_sha1): return None
+    if len(data) != HEADER.size + count * TRIAL_DTYPE.itemsize: return None
+    return numpy.frombuffer(data, dtype = TRIAL_DTYPE, count = count, offset = HEADER.size)
+
+def load_schedule(schedule_file):
+    """
+    Trials of schedule_file (TRIAL_DTYPE array): from its .schedulec when that is up to date, else compiled in memory
+    """
+    with open(schedule_file, 'rb') as fin:
+        text = fin.read()
+    trials = read_compiled(compiled_name(schedule_file), source_digest(text))
+    if trials is None:
+        print('%s is not compiled (or changed since), compiling it now' % os.path.basename(schedule_file))
+        trials = compile_rows(parse_schedule(text.decode('utf-8'), schedule_file))
+    return trials
+
+def main(argv = None):
+    schedules = sys.argv[1:] if argv is None else argv
+    if not schedules:
+        here = os.path.dirname(os.path.abspath(__file__))
+        schedules = [os.path.join(here, f) for f in sorted(os.listdir(here)) if f.endswith('.schedule')]
+    for schedule_file in schedules:
+        try:
+            trials = compile_schedule(schedule_file)
+        except ScheduleError as e:
+            print('skipped: %s' % e)
+            continue
+        print('%s: %i trials, %i OLL -> %s' % (os.path.basename(schedule_file), len(trials), trials['is_oll'].sum(), os.path.basename(compiled_name(schedule_file))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Planning Task scoring
+# Outcome properties of every (start_state, depth) pair of the 6-state decision graph.
+# The table is built once at import (by backward induction, see planner.py), so classifying
+# a trial is a dictionary lookup instead of re-enumerating every path after each trial.
+
+import itertools, copy
+from PlanningTask import planner
+
+LARGE_LOSS = -70 #transitions worth this much count as a 'large loss'
+MAX_DEPTH = 8 #depths 1..MAX_DEPTH are precomputed, deeper ones are filled in by PLANNER on first use
+
+# Key - Value pair,
+# Key is the current state,
+# Value is dictionary corresonding to next state by choosing 'left' or right
+# PlanningTask.GlobalVars copies this and attaches the stimuli for each state/transition
+STATES = {
+    1 : {
+        'left': {'state': 2, 'value': 140},
+        'right': {'state': 4, 'value': 20}
+    },
+    2 : {
+        'left': {'state': 3, 'value': -20},
+        'right': {'state': 5, 'value': -70}
+    },
+    3 : {
+        'left': {'state': 6, 'value': -70},
+        'right': {'state': 4, 'value': -20}
+    },
+    4 : {
+        'left': {'state': 2, 'value': 20},
+        'right': {'state': 5, 'value': -20}
+    },
+    5 : {
+        'left': {'state': 1, 'value': -70},
+        'right': {'state': 6, 'value': -20}
+    },
+    6 : {
+        'left': {'state': 3, 'value': 20},
+        'right': {'state': 1, 'value': -20}
+    }
+}
+
+def copy_states():
+    """
+    Return a deep copy of the state graph, safe to attach stimuli to
+    """
+    return copy.deepcopy(STATES)
+
+def get_possible_transitions(depth):
+    """
+    Every sequence of 'left'/'right' moves of length depth (2^depth of them)
+    """
+    return [list(p) for p in itertools.product(['left', 'right'], repeat = depth)]
+
+def get_path_points(start_state, transitions, states = STATES):
+    """
+    Returns the points of each transition in the path
+    """
+    points = []
+    current_state = start_state
+    for transition in transitions:
+        points.append(states[current_state][transition]['value'])
+        current_state = states[current_state][transition]['state']
+    return points
+
+PLANNER = planner.Planner(STATES, LARGE_LOSS, MAX_DEPTH)
+
+def compute_outcome_info(start_state, depth, states = STATES):
+    """
+    Summarize every path of the given depth from start_state:
+        max_points      the most points possible
+        is_oll          True if a path worth max_points includes a large loss
+        ap_points       second best (unique) total--the aversive pruning value
+        no_ll_points    the most points possible without a large loss
+        distribution    {total points: number of paths with that total}
+    """
+    if states is STATES:
+        return PLANNER.outcome_info(start_state, depth)
+    return planner.Planner(states, LARGE_LOSS, depth).outcome_info(start_state, depth)
+
+def build_outcome_table(states = STATES, max_depth = MAX_DEPTH):
+    """
+    Outcome info keyed by (start_state, depth) for every state and depths 1..max_depth
+    """
+    table = {}
+    for start_state in states:
+        for depth in range(1, max_depth + 1):
+            table[(start_state, depth)] = compute_outcome_info(start_state, depth, states)
+    return table
+
+OUTCOME_TABLE = build_outcome_table()
+
+def get_outcome_info(start_state, depth):
+    """
+    Table lookup--depths beyond MAX_DEPTH are computed once and then cached
+    """
+    key = (start_state, depth)
+    if key not in OUTCOME_TABLE:
+        OUTCOME_TABLE[key] = compute_outcome_info(start_state, depth)
+    return OUTCOME_TABLE[key]
+
+def classify_outcome(start_state, depth, transitions):
+    """
+    Return the outcome label for the moves entered in one trial
+    1) ONLL Correct         | Optimal sequence where this does not include large loss
+    2) OLL Correct          | Optimal sequence where this includes a large loss
+    3) Aversive Pruning     | The best sequence that avoids large loss.
+    4) ONLL Error           | suboptimal sequence when the optimum has no large loss
+    5) OLL Error            | suboptimal sequence that is not aversive pruning
+    6) Miss: Did not enter enough moves
+    """
+    if len(transitions) < depth: return 'Miss'
+    points_earned = sum(get_path_points(start_state, transitions))
+    info = get_outcome_info(start_state, depth)
+    if info['is_oll']:
+        if points_earned == info['max_points']: return 'OLL Correct'
+        if points_earned == info['ap_points']: return 'Aversive Pruning'
+        return 'OLL Error'
+    if points_earned == info['max_points']: return 'ONLL Correct'
+    return 'ONLL Error'
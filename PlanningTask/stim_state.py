@@ -0,0 +1,61 @@
+# Planning Task stimulus state
+# Setting an attribute on a PsychoPy stimulus (text, colors, size, pos...) makes it rebuild its
+# vertices or re-layout its text, even when the value did not change. StimState remembers the
+# last value applied to each attribute of each stimulus and only touches the stimulus when the
+# requested value differs. Any attribute set through StimState must always be set through it,
+# otherwise the remembered value goes stale.
+
+class StimState:
+    def __init__(self):
+        self.applied = {} #id(stim) -> (stim, {attribute: last value applied}), holding stim keeps its id from being reused
+        self.frame_applied = 0 #updates applied/skipped since the last end_frame()
+        self.frame_skipped = 0
+        self.frames = 0
+        self.total_applied = 0
+        self.total_skipped = 0
+        self.max_applied = 0 #most updates applied in a single frame
+
+    def set(self, stim, **attrs):
+        """
+        Apply attrs to stim, skipping the ones that already have the requested value
+        """
+        last = self.applied.setdefault(id(stim), (stim, {}))[1]
+        for name, value in attrs.items():
+            key = freeze(value)
+            if name in last and last[name] == key:
+                self.frame_skipped += 1
+                continue
+            setattr(stim, name, value)
+            last[name] = key
+            self.frame_applied += 1
+
+    def forget(self, stim):
+        """
+        Drop what is remembered about stim, e.g. after it was changed directly
+        """
+        self.applied.pop(id(stim), None)
+
+    def end_frame(self):
+        """
+        Close the counts for this frame--call once per window flip
+        """
+        self.frames += 1
+        self.total_applied += self.frame_applied
+        self.total_skipped += self.frame_skipped
+        self.max_applied = max(self.max_applied, self.frame_applied)
+        self.frame_applied = 0
+        self.frame_skipped = 0
+
+    def summary(self):
+        total = self.total_applied + self.total_skipped
+        return 'stimulus updates: %i frames, %i applied, %i skipped (%.1f%% skipped), %.2f applied per frame (max %i)' % (
+            self.frames, self.total_applied, self.total_skipped, 100.0 * self.total_skipped / total if total else 0,
+            float(self.total_applied) / self.frames if self.frames else 0, self.max_applied)
+
+def freeze(value):
+    """
+    Comparable copy of value--lists/tuples (e.g. size and pos) become tuples
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
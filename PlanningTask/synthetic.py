@@ -0,0 +1,151 @@
+# Planning Task synthetic participants
+# Runs many simulated participants through the decision part of doTaskTrial (no graphics,
+# no clock) to see how different planners would score on a schedule before piloting it.
+#
+# usage: python -m PlanningTask.synthetic SCHEDULE [SCHEDULE ...] [-n 1000] [-p optimal pruning random] [-j N] [-o summary.csv]
+# (run from the StimTool directory)
+#
+# A participant is a planner plus two nuisance parameters drawn per participant:
+#   lapse       chance that a move is pressed at random instead of following the plan
+#   move_rt     seconds per key press--moves that do not fit in the response window make the trial a Miss
+# Planners:
+#   optimal     one of the best paths (planner.Planner.optimal_paths)
+#   pruning     stops expanding a branch at a large loss (-70): the best path without one, the best
+#               path overall when every path has one
+#   random      a random move at every step
+# Outcomes are labelled with scoring.classify_outcome, as in the task. Participants are spread
+# over a process pool in chunks; each worker builds the candidate paths of every (start_state,
+# depth) once.
+
+import argparse, csv, random, time
+from concurrent.futures import ProcessPoolExecutor
+from PlanningTask import scoring, path_engine, timeline, rescore
+
+OUTCOMES = ['ONLL Correct', 'OLL Correct', 'Aversive Pruning', 'ONLL Error', 'OLL Error', 'Miss']
+PLANNERS = ['optimal', 'pruning', 'random']
+OUTCOME_LABELS = ['ONLL_OK', 'OLL_OK', 'AP', 'ONLL_ERR', 'OLL_ERR', 'MISS'] # Column headers of the printed table, in OUTCOMES order
+MAX_LAPSE = 0.1 # Participants' lapse rates are drawn uniformly from 0..MAX_LAPSE
+MOVE_RT = (0.25, 0.6) # Range the participants' seconds per key press are drawn from
+CHUNK_SIZE = 250 # Participants simulated per pool task
+
+COLUMNS = ['schedule', 'planner', 'participants', 'trials'] + OUTCOMES + ['mean_points', 'sd_points', 'trials_per_second']
+
+path_cache = {} # (planner, start_state, depth) -> candidate paths, per process
+
+def candidate_paths(planner, start_state, depth):
+    """
+    The paths a planner picks from (uniformly) for one trial--empty for the random planner
+    """
+    key = (planner, start_state, depth)
+    if key not in path_cache:
+        if planner == 'optimal':
+            paths = scoring.PLANNER.optimal_paths(start_state, depth)
+        elif planner == 'pruning':
+            paths = pruned_paths(start_state, depth)
+        else:
+            paths = []
+        path_cache[key] = paths
+    return path_cache[key]
+
+def pruned_paths(start_state, depth):
+    """
+    Best paths that never take a large loss (the optimal ones if there are none)
+    """
+    totals, has_large_loss, _ = path_engine.ENGINE.score_paths(start_state, depth)
+    safe = ~has_large_loss
+    if not safe.any():
+        return scoring.PLANNER.optimal_paths(start_state, depth)
+    best = totals[safe].max()
+    rows = [p for p in range(len(totals)) if safe[p] and totals[p] == best]
+    return [[path_engine.ACTIONS[b] for b in path_engine.ENGINE.choice_bits(depth, p, p + 1)[0]] for p in rows]
+
+def simulate_trial(rng, planner, lapse, move_rt, start_state, depth):
+    """
+    Moves entered for one trial, as doTaskTrial would record them (fewer than depth for a miss)
+    """
+    paths = candidate_paths(planner, start_state, depth)
+    plan = rng.choice(paths) if paths else [rng.choice(path_engine.ACTIONS) for _ in range(depth)]
+    moves = []
+    elapsed = 0
+    for move in plan:
+        elapsed += max(0.05, rng.gauss(move_rt, move_rt / 4))
+        if elapsed > timeline.RESPONSE_DURATION: break
+        moves.append(rng.choice(path_engine.ACTIONS) if rng.random() < lapse else move)
+    return moves
+
+def simulate_chunk(args):
+    """
+    Simulate n participants of one planner on trials [(depth, start_state), ...]
+    Returns ({outcome: count}, [total points of each participant])
+    """
+    trials, planner, n, seed = args
+    rng = random.Random(seed)
+    counts = dict((o, 0) for o in OUTCOMES)
+    totals = []
+    for _ in range(n):
+        lapse = rng.uniform(0, MAX_LAPSE)
+        move_rt = rng.uniform(MOVE_RT[0], MOVE_RT[1])
+        points = 0
+        for depth, start_state in trials:
+            moves = simulate_trial(rng, planner, lapse, move_rt, start_state, depth)
+            counts[scoring.classify_outcome(start_state, depth, moves)] += 1
+            points += sum(scoring.get_path_points(start_state, moves)) if len(moves) == depth else rescore.MISS_POINTS
+        totals.append(points)
+    return counts, totals
+
+def simulate(schedules, n, planners = PLANNERS, workers = None, seed = 0):
+    """
+    Simulate n participants per planner on every schedule file
+    Returns (one row of COLUMNS per (schedule, planner), number of trials simulated, seconds it took)
+    """
+    jobs = [] # (schedule, planner, chunk args)
+    for schedule in schedules:
+        trials = rescore.read_schedule(schedule)
+        for planner in planners:
+            for first in range(0, n, CHUNK_SIZE):
+                jobs.append((schedule, planner, (trials, planner, min(CHUNK_SIZE, n - first), seed + len(jobs))))
+    start = time.time()
+    if workers == 1:
+        results = list(map(simulate_chunk, [job[2] for job in jobs]))
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            results = list(pool.map(simulate_chunk, [job[2] for job in jobs]))
+    elapsed = time.time() - start
+    merged = {}
+    for (schedule, planner, args), (counts, totals) in zip(jobs, results):
+        entry = merged.setdefault((schedule, planner), [dict((o, 0) for o in OUTCOMES), [], len(args[0])])
+        for o in OUTCOMES:
+            entry[0][o] += counts[o]
+        entry[1].extend(totals)
+    n_trials = sum(len(totals) * n_per for counts, totals, n_per in merged.values())
+    rows = []
+    for (schedule, planner), (counts, totals, n_per) in merged.items():
+        trials = len(totals) * n_per
+        mean = float(sum(totals)) / len(totals)
+        sd = (sum((t - mean) ** 2 for t in totals) / max(1, len(totals) - 1)) ** 0.5
+        rows.append([schedule, planner, len(totals), trials] + [round(float(counts[o]) / max(1, trials), 4) for o in OUTCOMES] +
+            [round(mean, 1), round(sd, 1), int(n_trials / elapsed) if elapsed else 0])
+    return rows, n_trials, elapsed
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Simulate planners on Planning Task schedules and report their outcome distributions.')
+    parser.add_argument('schedules', nargs = '+', help = '.schedule files to simulate')
+    parser.add_argument('-n', '--participants', type = int, default = 1000, help = 'participants per planner and schedule')
+    parser.add_argument('-p', '--planners', nargs = '+', default = PLANNERS, choices = PLANNERS, help = 'planners to simulate')
+    parser.add_argument('-j', '--workers', type = int, default = None, help = 'worker processes (default: one per core, 1 = no pool)')
+    parser.add_argument('-s', '--seed', type = int, default = 0, help = 'random seed')
+    parser.add_argument('-o', '--out', default = None, help = 'also write the summary table to this CSV')
+    args = parser.parse_args(argv)
+    rows, n_trials, elapsed = simulate(args.schedules, args.participants, args.planners, args.workers, args.seed)
+    if args.out:
+        with open(args.out, 'w', newline = '') as fout:
+            writer = csv.writer(fout)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+    print('%-40s %-8s ' % ('schedule', 'planner') + ' '.join('%9s' % o for o in OUTCOME_LABELS) + ' %8s %7s' % ('points', 'sd'))
+    for row in rows:
+        print('%-40s %-8s ' % (row[0][-40:], row[1]) + ' '.join('%9.3f' % v for v in row[4:4 + len(OUTCOMES)]) + ' %8.1f %7.1f' % (row[-3], row[-2]))
+    print('simulated %i trials in %.2f s (%i trials/s)' % (n_trials, elapsed, n_trials / elapsed if elapsed else 0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Planning Task run timeline
+# Compiles the trials of a .schedule into planned onsets for every phase of every trial, in
+# seconds after the task onset, before the scanner starts. Trials sit on a fixed grid
+# (LEAD_IN, then one slot per trial), so onsets never drift: each trial waits for its
+# planned start and its fixation ends at the next planned start. A slot is TRIAL_DURATION,
+# or longer for deep trials (slot_duration): whole seconds, enough for every phase at its
+# ceiling and MIN_FIXATION, up to MAX_TRIAL_DURATION--deeper trials cannot be scheduled.
+# A trial that runs past its slot (a late start, slow frames) keeps a MIN_FIXATION fixation
+# and the next trial starts late; the fixations after it are shorter until the run is back
+# on the grid, so the lag is absorbed instead of making the run longer. Phase onsets inside a trial are the latest each phase can start (planning
+# and response end early when the moves are entered); the actual onsets are recorded as the
+# run goes and exported next to the planned ones. Lags are only computed for LAG_PHASES:
+# the trial start, whose onset is fixed, and the feedback, which is only late once it starts
+# after its latest planned onset--an early response says nothing about the timing.
+
+import math
+
+TRIAL_DURATION = 15 # Shortest slot, one trial every 15 seconds
+MAX_TRIAL_DURATION = 18 # Longest slot (depth 6, the deepest trials in the schedules)
+LEAD_IN = 8 # Fixation between the task onset and the first trial
+PLANNING_DELAY = 0.1 # Blank screen at the beginning of a trial
+PLANNING_DURATION = 9
+RESPONSE_DURATION = 2.5
+MOVE_DURATION = 0.75 # Animation of one move
+FEEDBACK_DURATION = 1
+MIN_FIXATION = 0.5 # Shortest fixation a trial gets when it runs past its slot
+
+PHASES = ['PLANNING', 'RESPONSE', 'ANIMATION', 'FEEDBACK', 'FIXATION'] # Same names as PlanningTask.set_phase
+LAG_PHASES = ['PLANNING', 'FEEDBACK'] # Phases whose onsets are fixed by the schedule (FEEDBACK: its latest onset)
+
+class TimelineError(ValueError):
+    pass
+
+def trial_length(depth):
+    """
+    Seconds from the trial start to the end of MIN_FIXATION when planning and response take their full time
+    """
+    return PLANNING_DELAY + PLANNING_DURATION + RESPONSE_DURATION + depth * MOVE_DURATION + FEEDBACK_DURATION + MIN_FIXATION
+
+def slot_duration(depth):
+    """
+    Seconds planned for a trial of depth: TRIAL_DURATION, or the whole seconds trial_length needs
+    Raises TimelineError if that is more than MAX_TRIAL_DURATION
+    """
+    slot = max(TRIAL_DURATION, int(math.ceil(round(trial_length(depth), 6))))
+    if slot > MAX_TRIAL_DURATION:
+        raise TimelineError('a depth %i trial needs %.2f s, more than the %i s a trial can last' % (depth, trial_length(depth), MAX_TRIAL_DURATION))
+    return slot
+
+class TrialPlan:
+    def __init__(self, trial, depth, start_state, start):
+        self.trial = trial
+        self.depth = depth
+        self.start_state = start_state
+        self.start = start
+        self.end = start + slot_duration(depth) # Planned start of the next trial
+        self.onsets = {}
+        t = start + PLANNING_DELAY
+        for phase, duration in zip(PHASES, [PLANNING_DURATION, RESPONSE_DURATION, depth * MOVE_DURATION, FEEDBACK_DURATION, 0]):
+            self.onsets[phase] = t
+            t += duration
+        if self.onsets['FIXATION'] + MIN_FIXATION > self.end + 1e-9:
+            raise TimelineError('trial %i (depth %i) does not fit in its %g s slot' % (trial + 1, depth, self.end - start))
+
+class Timeline:
+    def __init__(self, trials):
+        """
+        :param trials [(depth, start_state), ...] in schedule order
+        Raises TimelineError if a trial cannot fit in a slot (see slot_duration)
+        """
+        self.trials = []
+        start = LEAD_IN
+        for i, (depth, start_state) in enumerate(trials):
+            self.trials.append(TrialPlan(i, depth, start_state, start))
+            start = self.trials[-1].end
+        self.end = start
+        self.actual = {} # (trial, phase) -> onset that happened, in seconds after the task onset
+
+    def record(self, trial, phase, onset):
+        if 0 <= trial < len(self.trials):
+            self.actual[(trial, phase)] = onset
+
+    def lag(self, plan, phase):
+        """
+        Seconds the phase started after its planned onset (None if it was not recorded or is not in LAG_PHASES)
+        """
+        actual = self.actual.get((plan.trial, phase))
+        if actual is None or phase not in LAG_PHASES: return None
+        lag = actual - plan.onsets[phase]
+        return max(0, lag) if phase == 'FEEDBACK' else lag
+
+    def summary(self):
+        """
+        Fields of the first line of write: run length, the largest trial start lag and how many feedbacks were late
+        """
+        starts = [self.lag(plan, 'PLANNING') for plan in self.trials]
+        starts = [l for l in starts if l is not None]
+        late = [l for l in [self.lag(plan, 'FEEDBACK') for plan in self.trials] if l]
+        return ['Trials:', len(self.trials), 'Run Length:', round(self.end, 4),
+            'Max Start Lag ms:', round(max(starts) * 1000, 1) if starts else 'NA', 'Late Feedbacks:', len(late)]
+
+    def write(self, filename):
+        """
+        Summary line, then the planned and actual onset (seconds after the task onset) of every phase of every trial
+        """
+        with open(filename, 'w') as fout:
+            fout.write(','.join([str(v) for v in self.summary()]) + '\n')
+            fout.write('trial_number,depth,start_state,phase,planned_onset,actual_onset,lag_ms\n')
+            for plan in self.trials:
+                for phase in PHASES:
+                    planned = plan.onsets[phase]
+                    actual = self.actual.get((plan.trial, phase))
+                    lag = self.lag(plan, phase)
+                    row = [plan.trial, plan.depth, plan.start_state, phase, round(planned, 4),
+                        'NA' if actual is None else round(actual, 4), 'NA' if lag is None else round(lag * 1000, 1)]
+                    fout.write(','.join([str(v) for v in row]) + '\n')
@@ -1,16 +1,69 @@
+import time
+startup_time = time.perf_counter()
 from psychopy import prefs
 #prefs.general['audioLib'] = ['pyo', 'pygame']
 prefs.hardware['audioLib'] = ['pyo','pygame']
 #prefs.general['audioLib'] = [u'pygame']
 prefs.hardware['audioDriver'] = ['ASIO4ALL', 'ASIO', 'Audigy', ]
-from pygame import pypm #need to load this before loading psychopy.sound when using pyo 
-from psychopy import core, visual, gui, data, misc, event, sound, logging #, microphone
-import time, numpy, random, datetime, sys, os, copy, pyo, csv, ast, StimToolLib, threading, pygame.pypm, CloseAudio
+from psychopy import gui #the only import the first dialog needs--the rest is imported by warm_imports while it is open, or on first use
+import sys, os, ast, threading, importlib
+import_times = [('psychopy.gui (before the first dialog)', time.perf_counter() - startup_time)] #(module, seconds), see import_report
 
+#imported on a background thread while the Subject ID dialog is open--nothing here may open a window or touch the audio device
+WARM_IMPORTS = ['numpy', 'PIL.Image', 'psychopy.core', 'psychopy.monitors', 'psychopy.data']
+#imported on the main thread once the dialog is closed--psychopy.visual and psychopy.event import pyglet.gl, which creates
+#pyglet's shadow window and GL context (thread-affine on Windows and macOS), the audio backend is set up when psychopy.sound
+#is imported, and StimToolLib imports all of them
+MAIN_IMPORTS = ['psychopy.visual', 'psychopy.event',
+    'pygame.pypm', #need to load this before loading psychopy.sound when using pyo 
+    'psychopy.sound', 'pyo', 'StimToolLib']
+#task name (as in the .TL files) -> module with its run(session_params, run_params), imported the first time the task runs
+TASK_MODULES = {
+    'Planning Task': 'PlanningTask.PlanningTask',
+}
 
-import PlanningTask.PlanningTask
+def timed_import(name):
+    #import a module, recording how long it took--modules already imported (e.g. by an earlier one) cost nothing and are not listed
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times.append((name, time.perf_counter() - start))
+    return module
 
+def warm_imports():
+    for name in WARM_IMPORTS:
+        try:
+            timed_import(name)
+        except Exception as e: #imported again on the main thread when needed, where the error will show
+            print('Could not import ' + name + ' in the background: ' + str(e))
 
+def task_module(task):
+    return timed_import(TASK_MODULES[task])
+
+def import_report():
+    #what each import cost, in the order they were done (for more detail, run with python -X importtime)
+    lines = ['import times (ms):']
+    for name, seconds in import_times:
+        lines.append('    ' + name + ': ' + str(round(seconds * 1000, 1)))
+    lines.append('    total to setup: ' + str(round((time.perf_counter() - startup_time) * 1000, 1)))
+    return '\n'.join(lines)
+
+def dialog_defaults(filename, names):
+    #values of names in a .params file, read without StimToolLib (not imported yet when the first dialog opens)--'' if missing
+    values = dict([(n, '') for n in names])
+    if not os.path.isfile(filename):
+        return values
+    fin = open(filename, 'r', encoding='utf-8')
+    for line in fin:
+        these_vals = line.split()
+        if len(these_vals) > 1 and these_vals[0] in values:
+            try:
+                values[these_vals[0]] = ast.literal_eval(these_vals[1])
+            except (ValueError, SyntaxError):
+                values[these_vals[0]] = these_vals[1]
+    fin.close()
+    return values
 
 def run_task_until_success(task, session_params):
     
@@ -29,7 +82,7 @@ def run_task_until_success(task, session_params):
     while True: #repeat the task until the run is completed successfully
         if session_params['auto_advance'] and not just_escaped: #auto advance to next task--don't ask which task to go to
             core.wait(.2)
-            status = mod_mapping[task].run(session_params, run_params)
+            status = task_module(task).run(session_params, run_params)
             if status == 0: 
                 return False#task completed successfully, will continue to the next one
             else:
@@ -49,12 +102,12 @@ def run_task_until_success(task, session_params):
                     return 2
                 else:
                     switched = True #otherwise set it to free mode
-                    session_params['auto_advance'] = False
+                    session_params = session_params.override('free mode', auto_advance = False)
                 if thisInfo[0] == task: #the user selected the default: load any parameters that might be in the file
                     these_params = run_params
                 else:
                     these_params = {}
-                status = mod_mapping[thisInfo[0]].run(session_params, these_params)
+                status = task_module(thisInfo[0]).run(session_params, these_params)
                 
                 if status != -1: #-1 is returned when a task fails (e.g. user hits escape to quit)
                     return switched
@@ -74,21 +127,20 @@ if __name__ == '__main__':
     #CD.start_camera()
     #StimToolLib.open_and_close_vmeter() #this hack seems to fix a problem with the vMeter not responding the first time it's used after logging in...
     reset_flags()
+    warmer = threading.Thread(target = warm_imports, daemon = True)
+    warmer.start()
 
-    mod_mapping = {
-        'Planning Task': PlanningTask.PlanningTask,
-    }
-
-    modules = list(mod_mapping)
+    modules = list(TASK_MODULES)
     modules.append('SKIP')
     modules.append('SKIP TO')
     modules.sort() #sorted alphabetically so tasks are easier to find
 
 
     #Enter ID and select tasks dialog
+    last = dialog_defaults('Default.params', ['last_subject', 'last_admin'])
     myDlg = gui.Dlg(title="StimTool")
-    myDlg.addField('Subject ID:', StimToolLib.get_var_from_file('Default.params', 'last_subject')) #subject ID
-    myDlg.addField('Administrator ID:', StimToolLib.get_var_from_file('Default.params', 'last_admin')) #name of the person administering the session
+    myDlg.addField('Subject ID:', last['last_subject']) #subject ID
+    myDlg.addField('Administrator ID:', last['last_admin']) #name of the person administering the session
 
     task_lists = [f for f in os.listdir('.') if f.endswith('.TL')] #get a list of all ".TL" files (tasklists), which have a list of all tasks to be run in a session
     task_lists.insert(0, 'free')
@@ -98,37 +150,52 @@ if __name__ == '__main__':
         thisInfo = myDlg.data
     else:
         print('QUIT!')
-        core.quit()#the user hit cancel so exit 
+        sys.exit()#the user hit cancel so exit 
+    warmer.join()
+    for name in MAIN_IMPORTS:
+        timed_import(name)
+    from psychopy import core
+    import StimToolLib
     sid = thisInfo[0].replace('\'', '.')
     raID = thisInfo[1].replace('\'', '.') #prevent problems with storing/reading strings that have single quotes in them
     
     try:
         StimToolLib.write_var_to_file('Default.params', 'last_subject', sid)
         StimToolLib.write_var_to_file('Default.params', 'last_admin', raID)
+        StimToolLib.commit_params('Default.params')
     except:
         print("Could not store last subject and administrator--most likely because the user doesn't have write permission to the StimTool directory.")
-    session_params = StimToolLib.get_var_dict_from_file('Default.params', {'SID':sid, 'raID':raID }) #initialize default session parameters--SID and raID always come from the dialogue box
+    config_layers = [('dialog', {'SID':sid, 'raID':raID }), 'Default.params'] #initialize default session parameters--SID and raID always come from the dialogue box
     task_list_idx = 2
     #session_params['vMeter'] = StimToolLib.try_to_open_vMeter()
-    session_params['admin_id'] = raID
+    session_info = {'admin_id': raID}
     
     
     if thisInfo[task_list_idx] == 'free':
         free = True
+        config_layers.append(('session', session_info))
     else:
         #read the input file to get the experiment order
-        #this file should contain one line /per task, and each line must match an entry in the mod_mapping dictionary    
+        #this file should contain one line /per task, and each line must match an entry in the TASK_MODULES dictionary    
         with open(thisInfo[task_list_idx]) as f:
             order = f.read().splitlines()
-            session_params['task_list']=thisInfo[task_list_idx]
+            session_info['task_list']=thisInfo[task_list_idx]
         free = False
         param_file = thisInfo[task_list_idx][0:-3] + '.params' #every .TL file can have a .params file associated with it to specify running parameters
-        session_params = StimToolLib.get_var_dict_from_file(param_file, session_params) #overwrite any parameters defined in the session specific file (e.g. BehavioralSession.params)
+        config_layers.append(('session', session_info))
+        config_layers.append(param_file) #overwrite any parameters defined in the session specific file (e.g. BehavioralSession.params)
+    session_params = StimToolLib.load_config(config_layers) #read-only from here on--see StimToolLib.SessionConfig
+    problems = session_params.check()
+    if problems:
+        StimToolLib.error_popup('Invalid session parameters:\n' + '\n'.join(problems))
     #redirect stdout and stderr to a file
     if session_params['redirect_output']:
         StimToolLib.redirect_output(session_params)
+    print(session_params.describe()) #every session parameter and the file it came from
+    print(import_report())
+    StimToolLib.select_parallel_port(session_params.get('parallel_port', 'inpout32')) #'fake' keeps the triggers in memory (no hardware needed)
     if session_params['signal_parallel']: #if using the parallel port, make sure it's working
-        StimToolLib.verify_parallel(session_params)
+        session_params = session_params.override('verify_parallel', parallel_port_address = StimToolLib.verify_parallel(session_params))
     
     if session_params['scan']:
         StimToolLib.get_exam_number(session_params) #if it's a scanning session, save the exam number (e.g. S2352)
@@ -148,6 +215,7 @@ if __name__ == '__main__':
             
             if switched_task == 1: #user switched tasks--go to free mode
                 free = True
+                session_params = session_params.override('free mode', auto_advance = False)
                 break
             elif switched_task == 2: #user picked SKIP TO: so prompt to choose which task to skip to
                 myDlg = gui.Dlg(title="StimTool: What task would you like to skip to?")
@@ -175,10 +243,11 @@ if __name__ == '__main__':
             myDlg.show()  # show dialog and wait for OK or Cancel
             if myDlg.OK:  # then the user pressed OK
                 thisInfo = myDlg.data
-                status = mod_mapping[thisInfo[0]].run(session_params, {})
+                status = task_module(thisInfo[0]).run(session_params, {})
             else:
                 print('QUIT!')
                 break #core.quit()
+    StimToolLib.close_shared_window() #the window was kept open between runs
     #CD.stop_capture() # dont' use for psychopy3
     #CloseAudio.run() #seems to close the audio server so the user doesn't have to hit the stop button...?
     #pygame.pypm.Terminate()
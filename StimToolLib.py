@@ -1,15 +1,26 @@
 
 
 from psychopy import event, core, visual, gui, sound, monitors, data#, microphone
-import csv, os, ctypes, ast, numpy, pyo, sys, logging #VMeter,
+import csv, os, ctypes, ast, numpy, pyo, sys, logging, threading, collections, collections.abc, atexit, time, hashlib, json, mmap #VMeter,
 from shutil import move
+from PIL import Image
 #import CameraDriver.CameraDriver as CD
 from psychopy.hardware import joystick
 from psychopy.visual.windowwarp import Warper
 
 
 PARALLEL_DELAY = 0.005 #time to wait when sending pulses to the parallel port
+PARALLEL_RESET = 128 #value left on the port after a pulse--the task on bit
+SLIDE_PREFETCH = 3 #instruction slides decoded ahead of the one on screen
+SLIDE_CACHE_SIZE = 8 #instruction slides kept ready to show (so going back is instant)
+SLIDE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'slide_cache') #pre-baked slides, see bake_slide_cache
+WAIT_SPIN_MARGIN = 0.02 #just_wait sleeps until this long before the deadline, then spins--more than a Windows timer tick (15.6 ms), so a late wake up is still caught by the spin; session param wait_spin_margin
+WAIT_POLL = 0.01 #while just_wait sleeps, escape is checked this often
 TRIAL_START_DELAY = 0.005 #test this experimentally--should be the delay between when the run is signalled to BIOPAC and when the clock is reset
+FRAME_BUFFER_SIZE = 2**16 #flips kept by FrameTimer--over 18 minutes of continuous drawing at 60Hz
+EVENT_FLUSH_SIZE = 64 #EventSink writes as soon as this many records are queued...
+EVENT_FLUSH_INTERVAL = 0.5 #...or after this many seconds
+FRAME_IDLE_FRAMES = 3 #a flip requested more than this many refresh periods after the previous one follows a deliberate wait (just_wait, waitKeys...), not a slow frame
 AAC_CODE = 1
 BASELINE_CODE = 2
 CP_CODE = 3
@@ -68,19 +79,164 @@ def error_popup(msg):
     error_msg.addText(msg)
     error_msg.show()
     raise QuitException()
+WINDOW_PARAMS = ['monitor_width_cm', 'monitor_distance_cm', 'monitor_width_pix', 'monitor_height_pix', 'screen_x', 'screen_y'] #session params the window is built from
+shared_window = None #the session's window, kept open from one run to the next--see borrow_window
+shared_window_key = None #values of WINDOW_PARAMS it was created with
+
+def open_window(session_params):
+    thisMon = monitors.Monitor('', width=session_params['monitor_width_cm'], distance=session_params['monitor_distance_cm'])
+    thisMon.setSizePix([session_params['monitor_width_pix'], session_params['monitor_height_pix']])
+    return visual.Window(fullscr=False, screen=1,color=(-1,-1,-1), waitBlanking=True, colorSpace='rgb',winType='pyglet', allowGUI=False, size=(session_params['screen_x'], session_params['screen_y']), monitor=thisMon,useFBO = True) 
+
+def borrow_window(session_params):
+    #(window, True if it was just created) for a run--the window of the previous run is reused (after reset_window) when it was made with
+    #the same monitor/screen params, otherwise it is closed and replaced, as if each run opened its own
+    global shared_window, shared_window_key
+    key = tuple([session_params[p] for p in WINDOW_PARAMS])
+    if shared_window is not None and key == shared_window_key:
+        reset_window(shared_window)
+        return shared_window, False
+    close_shared_window()
+    shared_window = open_window(session_params)
+    shared_window_key = key
+    return shared_window, True
+
+def reset_window(win):
+    #undo what a run may have left on the window
+    win.color = (-1,-1,-1)
+    win.mouseVisible = False
+    win.flip()
+    event.clearEvents()
+
+def release_window(win):
+    #end of a run: the shared window stays open (showing the last screen) for the next run
+    if win is not shared_window:
+        win.close()
+
+def close_shared_window():
+    #end of the session
+    global shared_window, shared_window_key
+    if shared_window is not None:
+        shared_window.close()
+    shared_window = None
+    shared_window_key = None
+
+atexit.register(close_shared_window)
+
 def general_setup(g):
     #initialize the window, main text stim, and clock
-    thisMon = monitors.Monitor('', width=g.session_params['monitor_width_cm'], distance=g.session_params['monitor_distance_cm'])
-    thisMon.setSizePix([g.session_params['monitor_width_pix'], g.session_params['monitor_height_pix']])
-    g.win = visual.Window(fullscr=False, screen=1,color=(-1,-1,-1), waitBlanking=True, colorSpace='rgb',winType='pyglet', allowGUI=False, size=(g.session_params['screen_x'], g.session_params['screen_y']), monitor=thisMon,useFBO = True) 
-    
-
+    global wait_spin_margin
+    wait_spin_margin = g.session_params.get('wait_spin_margin', WAIT_SPIN_MARGIN)
+    del wait_overshoots[:]
+    g.win, created = borrow_window(g.session_params)
     g.msg = visual.TextStim(g.win,text="",units='pix',pos=[0,0],color=[1,1,1],height=30,wrapWidth=int(1600))
     g.mouse = event.Mouse(visible=False) #hide the mouse--prevents loss of focus, also leave the mouse object in g so that it can be shown if the task requires it
-    core.wait(1)
+    if created:
+        core.wait(1) #let a new window settle
     g.clock = core.Clock()
-   
+    g.frame_timer = FrameTimer(g.win, g.session_params.get('refresh_rate', 60)) #record every flip of the window, summarized in task_end
+    g.stim_cache = StimCache(g) #slides and sounds the task shows more than once, evicted in task_end
+
+class FrameTimer:
+    #records the time of every flip of a window, tagged with the run phase (set_run_phase), trial number and phase set by the task (set_phase)
+    #installs itself in place of win.flip, so flips made by the task and by this library are all recorded
+    #timings go to preallocated arrays used as a ring buffer--once it is full the oldest flips are overwritten
+    #the interval statistics only use continuous flips (requested less than FRAME_IDLE_FRAMES refreshes after the previous one)--after a wait the interval says nothing about the frame rate
+    #dropped frames: refreshes skipped between two continuous flips, or for a flip after a wait, refreshes skipped between the request and the flip
+    def __init__(self, win, refresh_rate, size = FRAME_BUFFER_SIZE):
+        self.period = 1.0 / refresh_rate
+        self.idle_gap = FRAME_IDLE_FRAMES * self.period
+        self.refresh_rate = refresh_rate
+        self.size = size
+        self.flip_times = numpy.zeros(size)
+        self.intervals = numpy.zeros(size) #time since the previous flip
+        self.latencies = numpy.zeros(size) #time between the flip request and the flip
+        self.continuous = numpy.zeros(size, dtype = bool)
+        self.trials = numpy.zeros(size, dtype = numpy.int32)
+        self.phases = numpy.zeros(size, dtype = numpy.int16) #index in self.phase_names
+        self.run_phases = numpy.zeros(size, dtype = numpy.int16) #index in self.phase_names too
+        self.phase_names = ['NA']
+        self.n = 0 #flips recorded since the start, the next one goes to self.n % size
+        self.trial = -1
+        self.phase = 0
+        self.run_phase = 0
+        self.last_flip = None
+        self.win = win
+        self.win_flip = win.flip
+        if isinstance(getattr(win.flip, '__self__', None), FrameTimer): #the timer of a run that never reached task_end
+            self.win_flip = win.flip.__self__.win_flip
+        win.flip = self.flip
+    def detach(self):
+        #give the window its own flip back (it outlives the run)
+        self.win.flip = self.win_flip
+    def phase_index(self, name):
+        if name not in self.phase_names:
+            self.phase_names.append(name)
+        return self.phase_names.index(name)
+    def set_run_phase(self, run_phase):
+        #tag the following flips with the part of the run (e.g. examples, task), so trials numbered again in a later part are kept apart
+        self.run_phase = self.phase_index(run_phase)
+    def set_phase(self, trial, phase):
+        #tag the following flips--trial should be a number (anything else is stored as -1)
+        self.trial = trial if isinstance(trial, int) else -1
+        self.phase = self.phase_index(phase)
+    def flip(self, *args, **kwargs):
+        requested = core.getTime()
+        result = self.win_flip(*args, **kwargs)
+        now = core.getTime() #the window waits for the vertical blank, so this is right after the flip
+        i = self.n % self.size
+        self.flip_times[i] = now
+        self.latencies[i] = now - requested
+        if self.last_flip is None:
+            self.intervals[i] = 0
+            self.continuous[i] = False
+        else:
+            self.intervals[i] = now - self.last_flip
+            self.continuous[i] = requested - self.last_flip < self.idle_gap
+        self.trials[i] = self.trial
+        self.phases[i] = self.phase
+        self.run_phases[i] = self.run_phase
+        self.last_flip = now
+        self.n = self.n + 1
+        return result
+    def recorded(self):
+        #indices of the flips still in the buffer, oldest first
+        if self.n <= self.size:
+            return numpy.arange(self.n)
+        return (numpy.arange(self.size) + self.n) % self.size
+    def summarize(self, idx):
+        #[flips, continuous flips, mean ms, p99 ms, max ms, dropped frames] for the flips at idx
+        continuous = idx[self.continuous[idx]]
+        idle = idx[~self.continuous[idx]]
+        missed = numpy.concatenate([numpy.round(self.intervals[continuous] / self.period), numpy.round(self.latencies[idle] / self.period)]).astype(int) - 1
+        dropped = int(missed[missed > 0].sum())
+        if len(continuous) == 0:
+            return [len(idx), 0, 'NA', 'NA', 'NA', dropped]
+        intervals = self.intervals[continuous]
+        return [len(idx), len(continuous), '%.3f' % (intervals.mean() * 1000), '%.3f' % (numpy.percentile(intervals, 99) * 1000), '%.3f' % (intervals.max() * 1000), dropped]
+    def write_summary(self, filename):
+        #one row per (run phase, trial, phase) in the order they happened, then one row for the whole run
+        idx = self.recorded()
+        groups = []
+        members = {}
+        for i in idx:
+            key = (int(self.run_phases[i]), int(self.trials[i]), int(self.phases[i]))
+            if key not in members:
+                members[key] = []
+                groups.append(key)
+            members[key].append(i)
+        fout = open(filename, 'w')
+        fout.write('Refresh Rate:,' + str(self.refresh_rate) + ',Flips Recorded:,' + str(self.n) + ',Flips Overwritten:,' + str(max(0, self.n - self.size)) + '\n')
+        fout.write('run_phase,trial_number,phase,flips,continuous_flips,mean_interval_ms,p99_interval_ms,max_interval_ms,dropped_frames\n')
+        for run_phase, trial, phase in groups:
+            row = [self.phase_names[run_phase], trial if trial >= 0 else 'NA', self.phase_names[phase]] + self.summarize(numpy.array(members[(run_phase, trial, phase)]))
+            fout.write(','.join([str(v) for v in row]) + '\n')
+        row = ['ALL', 'ALL', 'ALL'] + self.summarize(idx)
+        fout.write(','.join([str(v) for v in row]) + '\n')
+        fout.close()
+
 def verify_parallel(session_params):
+    #returns the address that passed the check
     address = session_params['parallel_port_address']
     while True:
         if check_one_parallel_address(address):
@@ -92,30 +248,139 @@ def verify_parallel(session_params):
             myDlg.show()  # show dialog and wait for OK or Cancel
             thisInfo = myDlg.data
             address = ast.literal_eval(thisInfo[0])
-            session_params['parallel_port_address'] = address    
+    return address
     
 def check_one_parallel_address(address):
     for i in range(256):
-        parallel_writer.Out32(address, i)
-        read_val = parallel_writer.Inp32(address)
+        parallel_port.write(address, i)
+        read_val = parallel_port.read(address)
         if not i == read_val:
             return False
-    parallel_writer.Out32(address, 0) #reset to 0
+    parallel_port.write(address, 0) #reset to 0
     print('PARALLEL PORT SUCCESS')
     return True
     
     
+class InpOut32Port:
+    #the parallel port through inpout32.dll (Windows only)--the dll is loaded on first use
+    def __init__(self):
+        self.dll = None
+    def load(self):
+        if self.dll is None:
+            self.dll = ctypes.windll.LoadLibrary('inpout32.dll')
+        return self.dll
+    def write(self, address, value):
+        self.load().Out32(address, value)
+    def read(self, address):
+        return self.load().Inp32(address)
+
+class FakePort:
+    #in-memory parallel port, to run and test the triggers without the hardware (e.g. on Linux)
+    #keeps the current value of every address and a list of (time, address, value) for every write
+    def __init__(self):
+        self.values = {}
+        self.writes = []
+    def write(self, address, value):
+        self.writes.append((core.getTime(), address, value))
+        self.values[address] = value
+    def read(self, address):
+        return self.values.get(address, 0)
+
+PARALLEL_PORTS = {'inpout32': InpOut32Port, 'fake': FakePort} #backends selectable with the parallel_port session parameter
+parallel_port = InpOut32Port()
+trigger_scheduler = None #started by the first pulse, see get_trigger_scheduler
+
+def select_parallel_port(name):
+    #use the backend called name (a key of PARALLEL_PORTS) for every parallel port access
+    global parallel_port, trigger_scheduler
+    parallel_port = PARALLEL_PORTS[name]()
+    if trigger_scheduler:
+        trigger_scheduler.port = parallel_port
+
 def write_parallel(port, value):
-    parallel_writer.Out32(port, value)# 0x3000, value)
+    parallel_port.write(port, value)# 0x3000, value)
     #wait a short time
+
+def sleep_until(end_time):
+    #wait until core.getTime() reaches end_time without spinning: a spinning thread holds the GIL and stalls the render thread,
+    #so a pulse may go out a little late instead--the log keeps the time it actually went out
+    remaining = end_time - core.getTime()
+    while remaining > 0:
+        time.sleep(remaining)
+        remaining = end_time - core.getTime()
+
+class TriggerScheduler:
+    #sends parallel port pulses from a background thread, so that marking an event never blocks the task for PARALLEL_DELAY
+    #a request is (address, value, time, reset): at time (core.getTime()) the thread sets value, holds it for the pulse width,
+    #then sets reset (or leaves value on the port if reset is None)--requests that overlap wait for the previous pulse to end
+    #the time every pulse actually went on and off (taken at the port write, see send) is kept in self.log
+    def __init__(self, port, pulse_width = PARALLEL_DELAY):
+        self.port = port
+        self.pulse_width = pulse_width
+        self.requests = collections.deque()
+        self.wake = threading.Event()
+        self.pending = 0 #pulses queued or being sent
+        self.done = threading.Condition()
+        self.log = [] #(address, value, requested time, on time, off time)
+        self.thread = threading.Thread(target = self.sender_loop, name = 'TriggerScheduler')
+        self.thread.daemon = True
+        self.thread.start()
+    def pulse(self, address, value, at = None, reset = PARALLEL_RESET):
+        with self.done:
+            self.pending = self.pending + 1
+        self.requests.append((address, value, core.getTime() if at is None else at, reset))
+        self.wake.set()
+    def send(self, address, value):
+        #write to the port--returns the time of the write
+        self.port.write(address, value)
+        return core.getTime()
+    def sender_loop(self):
+        while True:
+            try:
+                address, value, at, reset = self.requests.popleft()
+            except IndexError:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            sleep_until(at)
+            on = self.send(address, value)
+            off = None
+            if reset is not None:
+                sleep_until(on + self.pulse_width)
+                off = self.send(address, reset)
+            self.log.append((address, value, at, on, off))
+            with self.done:
+                self.pending = self.pending - 1
+                self.done.notify_all()
+    def flush(self, timeout = 1):
+        #wait (at most timeout seconds) until every queued pulse has been sent
+        with self.done:
+            self.done.wait_for(lambda: self.pending == 0, timeout)
+    def write_log(self, filename, offset = 0):
+        #write the pulses sent so far (times minus offset, e.g. in the task clock) to filename, then forget them
+        log = self.log
+        self.log = []
+        fout = open(filename, 'w')
+        fout.write('address,value,requested_time,on_time,off_time\n')
+        for address, value, at, on, off in log:
+            fout.write(','.join([hex(address), str(value), str(at - offset), str(on - offset), 'NA' if off is None else str(off - offset)]) + '\n')
+        fout.close()
+
+def get_trigger_scheduler():
+    global trigger_scheduler
+    if trigger_scheduler is None:
+        trigger_scheduler = TriggerScheduler(parallel_port)
+    return trigger_scheduler
+
+def send_trigger(address, value, reset = PARALLEL_RESET):
+    #queue a pulse (returns immediately)
+    get_trigger_scheduler().pulse(address, value, reset = reset)
     
 def task_start(value, g): #g should have a clock (to reset) 
     #this function should be called when the task title screen is shown
     g.clock.reset()
     if g.session_params['signal_parallel']:
-        write_parallel(g.session_params['parallel_port_address'], value + 128)
-        core.wait(PARALLEL_DELAY)
-        write_parallel(g.session_params['parallel_port_address'], 128)
+        send_trigger(g.session_params['parallel_port_address'], value + 128)
     if g.session_params['record_video']:
         #print(pyo.pa_get_input_devices()
         #print(pyo.pa_get_default_input()
@@ -124,7 +389,11 @@ def task_start(value, g): #g should have a clock (to reset)
     
 def task_end(g): #status of the task that just ended--do not show the 'break' screen for an exit code of -1
     if g.session_params['signal_parallel']:
-        write_parallel(g.session_params['parallel_port_address'], 0)
+        send_trigger(g.session_params['parallel_port_address'], 0, reset = None) #after the pulses still queued
+        trigger_scheduler.flush()
+        if getattr(g, 'prefix', None):
+            offset = core.getTime() - g.clock.getTime() if g.clock else 0
+            trigger_scheduler.write_log(g.prefix + '_triggers.csv', offset) #actual on/off time of every pulse, in the task clock
     if g.session_params['record_video']:
         #gv.mic.stop() #stop recording audio
         #insert flac command here--or at the very end before copying files?
@@ -132,12 +401,23 @@ def task_end(g): #status of the task that just ended--do not show the 'break' sc
         CD.stop_recording()
     if g.output and not g.output.closed:
         try:
-            mark_event(g.output, 'NA', 'NA', TASK_END, g.clock.getTime(), 'NA', 'NA', 'NA', False, g.session_params['parallel_port_address'])
-        except AttributeError:
-            mark_event(g.output, 'NA', 'NA', TASK_END, core.getTime(), 'NA', 'NA', 'NA', False, g.session_params['parallel_port_address'])
-
-        
-        g.output.close()
+            try:
+                mark_event(g.output, 'NA', 'NA', TASK_END, g.clock.getTime(), 'NA', 'NA', 'NA', False, g.session_params['parallel_port_address'])
+            except AttributeError:
+                mark_event(g.output, 'NA', 'NA', TASK_END, core.getTime(), 'NA', 'NA', 'NA', False, g.session_params['parallel_port_address'])
+        finally:
+            g.output.close() #also if the sink's writes failed
+    commit_params() #variables written during the run (e.g. to the subject's param file)
+    if getattr(g, 'frame_timer', None) and getattr(g, 'prefix', None):
+        g.frame_timer.write_summary(g.prefix + '_frames.csv') #per trial frame timing, next to the behavioral file
+    if getattr(g, 'frame_timer', None):
+        g.frame_timer.detach()
+    if getattr(g, 'prefix', None):
+        write_wait_log(g.prefix + '_waits.csv') #how late each just_wait returned
+    if getattr(g, 'stim_cache', None):
+        if getattr(g, 'prefix', None):
+            g.stim_cache.write_log(g.prefix + '_slides.csv') #load time and uses of every cached slide/sound
+        g.stim_cache.evict()
     #send text message to administrator
     #wait for advance to next task
     if g.win:
@@ -146,15 +426,84 @@ def task_end(g): #status of the task that just ended--do not show the 'break' sc
                 show_instructions(g.win, ['Run complete: please wait for instructions.'])
             except QuitException:
                 g.status = -1
-        g.win.close()
+        release_window(g.win)
         #g.winbg.close()
 
 def mark_event(fout, trial, trial_type, event_id, event_time, response_time, response, result, write_to_parallel, address):
-    fout.write(str(trial) + ',' + str(trial_type) + ',' + str(event_id) + ',' + str(event_time) + ',' + str(response_time) + ',' + str(response) + ',' + str(result) + '\n') #add response time...
+    if isinstance(fout, EventSink):
+        fout.put((trial, trial_type, event_id, event_time, response_time, response, result)) #formatted and written by the sink's thread
+    else:
+        fout.write(format_event((trial, trial_type, event_id, event_time, response_time, response, result))) #add response time...
     if write_to_parallel:
-        write_parallel(address, int(event_id) + 128 + 64) #mark the event (128 is task on, 64 is event occurring, event_id is the type of event (stored in the least significant 6 bits)
-        core.wait(PARALLEL_DELAY) 
-        write_parallel(address, 128) #now just set the task on bit, but set all others to 0
+        send_trigger(address, int(event_id) + 128 + 64) #mark the event (128 is task on, 64 is event occurring, event_id is the type of event (stored in the least significant 6 bits)--the trigger thread then sets just the task on bit
+
+def format_event(record):
+    #one line of the output file: trial,trial_type,event_code,absolute_time,response_time,response,result
+    return ','.join([str(v) for v in record]) + '\n'
+
+class EventSink:
+    #wraps a task's output file so that marking an event never waits on the disk
+    #mark_event and write() only append to a deque (append/popleft are atomic, no lock is taken), a background thread formats the
+    #queued records and writes them once EVENT_FLUSH_SIZE records are waiting or every EVENT_FLUSH_INTERVAL seconds
+    #the file gets exactly the text a plain file would have, in the same order--close() (called by task_end) writes whatever is left
+    #if a write fails the thread stops, and the next put raises (as a plain file's write would) instead of queuing records nothing writes
+    def __init__(self, fout, flush_size = EVENT_FLUSH_SIZE, flush_interval = EVENT_FLUSH_INTERVAL):
+        self.fout = fout
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = collections.deque() #event records (tuples, see format_event) or text to write as is
+        self.wake = threading.Event()
+        self.stopping = False
+        self.closed = False
+        self.error = None #exception raised in the writer thread, raised again by the next put
+        self.thread = threading.Thread(target = self.writer_loop, name = 'EventSink')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close) #don't lose the queued events if the task dies before task_end
+    def put(self, record):
+        if self.error:
+            raise IOError('writing ' + self.fout.name + ' failed: ' + str(self.error))
+        self.queue.append(record)
+        if len(self.queue) >= self.flush_size:
+            self.wake.set()
+    def write(self, text):
+        self.put(text)
+    def writer_loop(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            stopping = self.stopping #read before draining so everything queued before close() gets written
+            try:
+                self.drain()
+            except Exception as e:
+                self.error = e
+                return
+            if stopping:
+                return
+    def drain(self):
+        lines = []
+        while True:
+            try:
+                record = self.queue.popleft()
+            except IndexError:
+                break
+            lines.append(record if isinstance(record, str) else format_event(record))
+        if lines:
+            self.fout.write(''.join(lines))
+            self.fout.flush()
+    def close(self):
+        if self.closed:
+            return
+        atexit.unregister(self.close) #the sink, its thread and file can go once the run is over
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.closed = True
+        if not self.error:
+            self.drain()
+        self.fout.close()
+        if self.error:
+            print('EventSink: writing ' + self.fout.name + ' failed: ' + str(self.error))
 
 def show_slides(slides, win):
     #slides should be a list of images to draw--draw them one after another and wait for keys before continuing
@@ -193,14 +542,37 @@ def show_instructions(win, instructions):
         if k[0] == 'escape':
             raise QuitException()
             
+wait_spin_margin = WAIT_SPIN_MARGIN #set from the session params in general_setup
+wait_overshoots = [] #(end_time, how late just_wait returned) for every wait of the run, written in task_end
+
 def just_wait(c, end_time):
     #wait until end_time, as measured by the clock c
     #raise an exception if the user hits escape--this should be caught in the main program loop
+    #sleeps in WAIT_POLL slices (keys only arrive when the window's events are pumped, which getKeys does) until wait_spin_margin
+    #before end_time, then spins without checking keys, so the core is only kept busy for the last few ms
+    waited = False
     while c.getTime() < end_time:
+        waited = True
         if event.getKeys(["escape"]):
             raise QuitException()
             #return -1
-        short_wait()
+        remaining = end_time - wait_spin_margin - c.getTime()
+        if remaining > 0:
+            time.sleep(min(remaining, WAIT_POLL))
+        else:
+            while c.getTime() < end_time:
+                pass
+    if waited:
+        wait_overshoots.append((end_time, c.getTime() - end_time))
+
+def write_wait_log(filename):
+    #every wait of the run and how late it ended, then forget them
+    fout = open(filename, 'w')
+    fout.write('end_time,overshoot_ms\n')
+    for end_time, overshoot in wait_overshoots:
+        fout.write(str(end_time) + ',' + str(round(overshoot * 1000, 3)) + '\n')
+    fout.close()
+    del wait_overshoots[:]
         
 def check_for_esc():
     if event.getKeys(["escape"]):
@@ -388,24 +760,234 @@ def run_instructions_keyselect(instruct_schedule_file, g):
     slides = []
     for i in lines:
         slides.append(i.split(','))
-    i = 0
-    while i < len(slides):
-        i = max(i + do_one_slide_keyselect(slides[i], directory, g), 0) #do_one_slide may increment or decrement i, depending on whether session_params['right'] or session_params['left'] is pressed--don't let them go back on the first slide
-
-
-def do_one_slide_keyselect(slide, directory, g):
-    image = visual.ImageStim(g.win, image=os.path.join(directory, slide[0]), units = 'pix')
+    prefetcher = SlidePrefetcher(slides, directory, g)
     try:
-        image.size = [g.session_params['screen_x'], g.session_params['screen_y']]
-    except:
-        pass
+        i = 0
+        while i < len(slides):
+            prefetcher.prefetch(i)
+            i = max(i + do_one_slide_keyselect(slides[i], directory, g, prefetcher.get(i)), 0) #do_one_slide may increment or decrement i, depending on whether session_params['right'] or session_params['left'] is pressed--don't let them go back on the first slide
+    finally:
+        prefetcher.close()
+
+def decode_slide(slide, directory, g):
+    #the slow part of loading an instruction slide, safe to run on a worker thread: (decoded image, (sound file, volume) or None)
+    #the Sound itself is made by make_slide_stim on the main thread--the sound backends are not safe to create objects from other threads
+    image = cached_slide_image(os.path.join(directory, slide[0]), g)
+    if image is None: #not baked (or changed since)--decode the file
+        image = Image.open(os.path.join(directory, slide[0]))
+        image = image.convert('RGB')
     if slide[1] == 'None':
         s = None
     else:
         if len(slide) == 4 and slide[3] != 'None': #optional volume parameter
-            s = sound.Sound(value = os.path.join(directory, slide[1]), volume=float(slide[3]))
+            s = (os.path.join(directory, slide[1]), float(slide[3]))
         else:
-            s = sound.Sound(value = os.path.join(directory, slide[1]), volume=g.session_params['instruction_volume'])
+            s = (os.path.join(directory, slide[1]), g.session_params['instruction_volume'])
+    return image, s
+
+def make_slide_stim(decoded, g):
+    #(ImageStim, Sound) from decode_slide--creating the ImageStim uploads the texture and the Sound goes to the audio backend, so this must run on the main thread
+    image = visual.ImageStim(g.win, image=decoded[0], units = 'pix')
+    try:
+        image.size = [g.session_params['screen_x'], g.session_params['screen_y']]
+    except:
+        pass
+    s = None if decoded[1] is None else sound.Sound(value = decoded[1][0], volume = decoded[1][1])
+    return image, s
+
+def slide_cache_name(width, height):
+    return os.path.join(SLIDE_CACHE_DIR, 'slides_' + str(width) + 'x' + str(height))
+
+def slide_cache_key(path):
+    #how a slide is named in the cache: its path relative to the StimTool directory, with / separators (instruction files use \\)
+    path = os.path.abspath(path.replace('\\', '/'))
+    return os.path.relpath(path, os.path.dirname(os.path.abspath(__file__))).replace('\\', '/')
+
+def bake_slide_cache(image_paths, width, height):
+    #build step: convert every image to raw RGBA at width x height (the stretch ImageStim.size used to do on every showing)
+    #writes slides_WxH.rgba (the images back to back) and slides_WxH.json (where each image is, by hash of the source file,
+    #and which source files--path, size and modification time--it was made from)
+    #returns the number of distinct images baked
+    if not os.path.exists(SLIDE_CACHE_DIR):
+        os.makedirs(SLIDE_CACHE_DIR)
+    name = slide_cache_name(width, height)
+    index = {'width': width, 'height': height, 'images': {}, 'paths': {}}
+    fout = open(name + '.rgba.tmp', 'wb')
+    offset = 0
+    for path in image_paths:
+        source = path.replace('\\', '/')
+        fin = open(source, 'rb')
+        digest = hashlib.sha1(fin.read()).hexdigest()
+        fin.close()
+        if digest not in index['images']:
+            image = Image.open(source).convert('RGBA').resize((width, height), Image.LANCZOS)
+            fout.write(image.tobytes())
+            index['images'][digest] = offset
+            offset = offset + width * height * 4
+        st = os.stat(source)
+        index['paths'][slide_cache_key(path)] = [digest, st.st_size, st.st_mtime]
+    fout.close()
+    os.replace(name + '.rgba.tmp', name + '.rgba')
+    fout = open(name + '.json', 'w')
+    json.dump(index, fout, indent = 1, sort_keys = True)
+    fout.close()
+    return len(index['images'])
+
+class SlideCache:
+    #read side of bake_slide_cache: the .rgba file is memory mapped once, and a slide is a PIL image over its part of the map
+    #(no copy, no JPEG decoding, no resize)--slides whose source file changed since the bake are not served
+    def __init__(self, width, height):
+        name = slide_cache_name(width, height)
+        self.width = width
+        self.height = height
+        fin = open(name + '.json', 'r')
+        self.index = json.load(fin)
+        fin.close()
+        self.file = open(name + '.rgba', 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+    def get(self, path):
+        #the baked image for path, or None
+        entry = self.index['paths'].get(slide_cache_key(path))
+        if entry is None:
+            return None
+        digest, size, mtime = entry
+        try:
+            st = os.stat(path.replace('\\', '/'))
+        except OSError:
+            return None
+        if st.st_size != size or st.st_mtime != mtime:
+            return None
+        offset = self.index['images'][digest]
+        n = self.width * self.height * 4
+        return Image.frombuffer('RGBA', (self.width, self.height), self.view[offset:offset + n], 'raw', 'RGBA', 0, 1)
+
+slide_caches = {} #(width, height) -> SlideCache, or None if there is no cache for that resolution
+slide_caches_lock = threading.Lock() #cached_slide_image runs on the SlidePrefetcher thread too--only one of them opens a cache
+
+def cached_slide_image(path, g):
+    #the pre-baked image of path at the session's screen resolution, or None if it was not baked
+    size = (g.session_params['screen_x'], g.session_params['screen_y'])
+    with slide_caches_lock:
+        if size not in slide_caches:
+            try:
+                slide_caches[size] = SlideCache(size[0], size[1])
+            except (IOError, OSError, ValueError):
+                slide_caches[size] = None
+        cache = slide_caches[size]
+    if cache is None:
+        return None
+    return cache.get(path)
+
+class SlidePrefetcher:
+    #decodes the next SLIDE_PREFETCH instruction slide images on a worker thread while the current one is shown
+    #the main thread only turns a decoded slide into an ImageStim (the texture upload) and its Sound when it is shown
+    #shown slides stay in a bounded LRU of SLIDE_CACHE_SIZE, so going back to them is instant
+    def __init__(self, slides, directory, g, ahead = SLIDE_PREFETCH, cache_size = SLIDE_CACHE_SIZE):
+        self.slides = slides
+        self.directory = directory
+        self.g = g
+        self.ahead = ahead
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict() #slide index -> (ImageStim, Sound), least recently shown first
+        self.decoded = {} #slide index -> decode_slide result (or the exception it raised), filled by the worker
+        self.queued = set() #slide indexes requested and not yet decoded
+        self.requests = collections.deque()
+        self.wake = threading.Event()
+        self.ready = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target = self.worker_loop, name = 'SlidePrefetcher')
+        self.thread.daemon = True
+        self.thread.start()
+    def prefetch(self, i):
+        #queue slides i..i+ahead that are not ready yet
+        for j in range(i, min(i + self.ahead + 1, len(self.slides))):
+            with self.ready:
+                if j in self.cache or j in self.decoded or j in self.queued:
+                    continue
+                self.queued.add(j)
+            self.requests.append(j)
+        self.wake.set()
+    def worker_loop(self):
+        while not self.stopping:
+            try:
+                j = self.requests.popleft()
+            except IndexError:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            try:
+                result = decode_slide(self.slides[j], self.directory, self.g)
+            except Exception as e:
+                result = e #raised again on the main thread when the slide is needed
+            with self.ready:
+                self.decoded[j] = result
+                self.queued.discard(j)
+                self.ready.notify_all()
+    def get(self, i):
+        #(ImageStim, Sound) for slide i, waiting for the worker if it is decoding it
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+        with self.ready:
+            if i not in self.decoded and i not in self.queued:
+                decoded = None
+            else:
+                self.ready.wait_for(lambda: i in self.decoded)
+                decoded = self.decoded.pop(i)
+        if decoded is None:
+            decoded = decode_slide(self.slides[i], self.directory, self.g)
+        if isinstance(decoded, Exception):
+            raise decoded
+        self.cache[i] = make_slide_stim(decoded, self.g)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+        return self.cache[i]
+    def close(self):
+        #stop the worker and wait for it, so no decode is still running once the instructions are over
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+
+class StimCache:
+    #run-scoped ImageStims and Sounds keyed by path, for screens the task shows again and again (retry prompts...)
+    #created in general_setup, evicted in task_end, where the load time of each path is written out
+    def __init__(self, g):
+        self.g = g
+        self.images = {} #path -> ImageStim
+        self.sounds = {} #path -> Sound
+        self.loads = collections.OrderedDict() #(kind, path) -> [seconds to load, times used]
+    def get_image(self, path):
+        if path not in self.images:
+            start = time.perf_counter()
+            self.images[path] = visual.ImageStim(self.g.win, image = path) #native size--the slide cache is baked at screen size, only for the full screen instruction slides
+            self.loads[('image', path)] = [time.perf_counter() - start, 0]
+        self.loads[('image', path)][1] += 1
+        return self.images[path]
+    def get_sound(self, path):
+        if path not in self.sounds:
+            start = time.perf_counter()
+            self.sounds[path] = sound.Sound(value = path)
+            self.loads[('sound', path)] = [time.perf_counter() - start, 0]
+        self.loads[('sound', path)][1] += 1
+        return self.sounds[path]
+    def write_log(self, filename):
+        fout = open(filename, 'w')
+        fout.write('kind,path,load_ms,uses\n')
+        for (kind, path), (seconds, uses) in self.loads.items():
+            fout.write(kind + ',' + path + ',' + str(round(seconds * 1000, 3)) + ',' + str(uses) + '\n')
+        fout.close()
+    def evict(self):
+        for s in self.sounds.values():
+            s.stop()
+        self.images.clear()
+        self.sounds.clear()
+
+def do_one_slide_keyselect(slide, directory, g, prepared = None):
+    #prepared: (ImageStim, Sound) for the slide, e.g. from SlidePrefetcher.get--loaded here if not given
+    if prepared is None:
+        prepared = make_slide_stim(decode_slide(slide, directory, g), g)
+    image, s = prepared
     if len(slide) == 5 and slide[4].strip() != 'None': #must have volume parameter to have keyselect--not the cleanest way to do this. The volume parameter can be None though, meaning use the session_param
         advance_key = slide[4].strip() #remove newline
     else:
@@ -662,23 +1244,196 @@ def get_text_response(question, win, clk):
     now = clk.getTime()
     return captured_string, now, now - start_time
     
+def parse_param_value(text):
+    #convert numbers and bools (possibly also dictionaries and lists), leave others as strings
+    try:
+        return ast.literal_eval(text)
+    except ValueError:
+        return text
+
+class ParamStore:
+    #one .params file, parsed once: each line of the file holds two space separated strings--the variable name and its value
+    #reads are served from memory, set() only changes memory, commit() rewrites the file (through a temp file in the same
+    #directory, then os.replace, so a crash never leaves it half written) if anything changed
+    #lines of variables that were not set are written back unchanged, new variables are appended at the end
+    def __init__(self, filename):
+        self.filename = filename
+        self.version = 0 #counts loads and sets, so a SessionConfig built from older values is not reused (see layer_key)
+        self.load()
+    def load(self):
+        self.version = self.version + 1
+        self.lines = [] #[name, text of the line], in file order
+        self.values = {} #name -> parsed value (the last line wins if a name appears twice)
+        self.changed = {} #name -> text of the value, set but not committed yet
+        self.mtime = None
+        if not os.path.isfile(self.filename):
+            return
+        self.mtime = os.path.getmtime(self.filename)
+        fin = open(self.filename, 'r', encoding='utf-8')
+        for line in fin:
+            these_vals = line.split()
+            if not these_vals:
+                self.lines.append([None, line])
+                continue
+            self.lines.append([these_vals[0], line])
+            self.values[these_vals[0]] = parse_param_value(these_vals[1])
+        fin.close()
+    def reload_if_modified(self):
+        #pick up changes made to the file by something else, unless there are uncommitted changes here
+        if self.changed:
+            return
+        mtime = os.path.getmtime(self.filename) if os.path.isfile(self.filename) else None
+        if mtime != self.mtime:
+            self.load()
+    def exists(self):
+        return self.mtime is not None or bool(self.changed)
+    def get(self, var, default = None):
+        return self.values.get(var, default)
+    def update_dict(self, d):
+        d.update(self.values)
+        return d
+    def set(self, var, value):
+        if isinstance(value, str):
+            value = '\'' + value + '\'' #add single quotes so when it gets written to a file and then read, it will still be a string
+        self.changed[var] = str(value)
+        self.values[var] = parse_param_value(str(value))
+        self.version = self.version + 1
+    def commit(self):
+        if not self.changed:
+            return
+        out = []
+        written = set()
+        for name, line in self.lines:
+            if name in self.changed:
+                line = name + ' ' + self.changed[name] + '\n'
+                written.add(name)
+            elif not line.endswith('\n'):
+                line = line + '\n'
+            out.append(line)
+        for name in self.changed:
+            if name not in written:
+                out.append(name + ' ' + self.changed[name] + '\n')
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fout_name = os.path.join(directory, '.' + os.path.basename(self.filename) + '.tmp')
+        fout = open(fout_name, 'w', encoding='utf-8')
+        fout.write(''.join(out))
+        fout.close()
+        os.replace(fout_name, self.filename)
+        self.load()
+
+param_stores = {} #absolute path -> ParamStore, see get_param_store
+
+def get_param_store(filename):
+    #the ParamStore for filename, parsed on first use (and again only if the file changed on disk)
+    key = os.path.abspath(filename)
+    store = param_stores.get(key)
+    if store is None:
+        store = param_stores[key] = ParamStore(filename)
+    else:
+        store.reload_if_modified()
+    return store
+
+def commit_params(filename = None):
+    #write the variables set with write_var_to_file to their files--only filename if given, otherwise every file
+    #called by task_end (once per run) and at exit
+    stores = [get_param_store(filename)] if filename else list(param_stores.values())
+    for store in stores:
+        if filename:
+            store.commit() #on demand--let the caller handle errors
+            continue
+        try:
+            store.commit()
+        except (IOError, OSError) as e:
+            print('COULD NOT WRITE ' + store.filename + ': ' + str(e))
+atexit.register(commit_params)
+
+SESSION_PARAM_TYPES = { #types checked by SessionConfig.check for the session parameters every task relies on
+    'scan': bool,
+    'record_video': bool,
+    'signal_parallel': bool,
+    'auto_advance': bool,
+    'redirect_output': bool,
+    'parallel_port_address': int,
+    'screen_x': int,
+    'screen_y': int,
+    'monitor_width_pix': int,
+    'monitor_height_pix': int,
+    'monitor_width_cm': (int, float),
+    'monitor_distance_cm': (int, float),
+    'refresh_rate': (int, float),
+    'wait_spin_margin': (int, float),
+    'instruction_volume': (int, float),
+    'output_dir': str,
+    }
+
+class SessionConfig(collections.abc.Mapping):
+    #read-only merge of parameter layers--each layer is a .params file name or a (name, dict) pair, later layers win
+    #remembers which layer every key came from (source), build one with load_config
+    #to change a value, make a new config with an extra layer: override(name, key = value) or with_file(filename)
+    def __init__(self, layers):
+        self.layers = layers
+        self.values = {}
+        self.sources = {}
+        for name, values in [layer_values(layer) for layer in layers]:
+            for key in values:
+                self.values[key] = values[key]
+                self.sources[key] = name
+    def __getitem__(self, key):
+        return self.values[key]
+    def __iter__(self):
+        return iter(self.values)
+    def __len__(self):
+        return len(self.values)
+    def __repr__(self):
+        return 'SessionConfig(' + repr(self.values) + ')'
+    def source(self, key):
+        #the layer (file name or layer name) key was taken from
+        return self.sources[key]
+    def override(self, name, **values):
+        return load_config(self.layers + [(name, values)])
+    def with_file(self, filename):
+        return load_config(self.layers + [filename])
+    def check(self, types = SESSION_PARAM_TYPES):
+        #list of problems with the types of the keys in types (empty if everything is fine)
+        problems = []
+        for key in types:
+            if key in self.values and not isinstance(self.values[key], types[key]):
+                problems.append(key + ' is ' + repr(self.values[key]) + ' (from ' + self.sources[key] + ')--expected ' + ' or '.join([t.__name__ for t in (types[key] if isinstance(types[key], tuple) else (types[key],))]))
+        return problems
+    def describe(self):
+        #one 'key value (source)' line per key, to print in the session log
+        return '\n'.join([key + ' ' + repr(self.values[key]) + ' (' + self.sources[key] + ')' for key in sorted(self.values)])
+
+def layer_values(layer):
+    #(name, values) of a config layer
+    if isinstance(layer, str):
+        store = get_param_store(layer)
+        return layer, store.values
+    return layer
+
+def layer_key(layer):
+    #what identifies the content of a layer: a file by the version of its ParamStore (changed by edits on disk and by set), a dict by its items
+    if isinstance(layer, str):
+        return (os.path.abspath(layer), get_param_store(layer).version)
+    name, values = layer
+    return (name, repr(sorted(values.items(), key = lambda item: item[0])))
+
+config_cache = {} #layer keys -> SessionConfig, see load_config
+
+def load_config(layers):
+    #SessionConfig for layers--reused as is while none of the files has changed on disk or in memory (repeated runs in a session don't parse or merge anything)
+    key = tuple([layer_key(layer) for layer in layers])
+    config = config_cache.get(key)
+    if config is None:
+        config = config_cache[key] = SessionConfig(list(layers))
+    return config
+
 def get_var_dict_from_file(filename, default_dict):
     #get a list of variables from a file--each line of the file should contain two space separated strings--the variable name and its value
-    if not os.path.isfile(filename):
+    store = get_param_store(filename)
+    if not store.exists():
         return default_dict #no file, so all params remain unchanged
-    fin = open(filename, 'r')
-    for line in fin:
-        these_vals = line.split()
-        try:
-            default_dict[these_vals[0]] = ast.literal_eval(these_vals[1]) #convert numbers and bools (possibly also dictionaries and lists)
-        except ValueError:
-            print(default_dict)
-            print(these_vals[0])
-            print(these_vals[1])
-            default_dict[these_vals[0]] = these_vals[1] #leave others as strings
-                
-    fin.close()
-    return default_dict #note: this function also changes the dictionary in place
+    return store.update_dict(default_dict) #note: this function also changes the dictionary in place
     
 def get_var_from_files(filenames, var): #return the first non-None value found in filenames (taken in order), or provide a popup if it can't be found in any of them
     for f in filenames:
@@ -702,51 +1457,16 @@ def get_var_from_files(filenames, var): #return the first non-None value found i
         return thisInfo[0]
     
 def get_var_from_file(filename, var):
-    #opens file named filename, then reads line by line until it finds 'var value'
-    #returns value from that file, or None if either the file or var DNE
-    
-    if not os.path.isfile(filename): #filename will be local file--check network storage second, then provide a popup for the user to enter the variable value
-
-        return None
-    fin = open(filename, 'r', encoding='utf-8')
-    for line in fin:
-        these_vals = line.split()
-        if these_vals[0] == var:
-            fin.close()
-            try:
-                return ast.literal_eval(these_vals[1])
-            except ValueError:
-                return these_vals[1]
-            #return these_vals[1]
-    fin.close()
-    return None 
+    #returns the value of var in filename, or None if either the file or var DNE
+    return get_param_store(filename).get(var)
     
 def write_var_to_files(filenames, var, value): #used to write the same value to multiple files--e.g. to a local file and another on storage if possible
     for f in filenames:
         write_var_to_file(f, var, value)
 
 def write_var_to_file(filename, var, value):
-    # set basesstring to str to workn in python3
-    if isinstance(value, str):
-        value = '\'' + value + '\'' #add single quotes so when it gets written to a file and then read, it will still be a string
-    if get_var_from_file(filename, var) == None: #either file DNE, or variable isn't in the file
-        fout = open(filename, 'a')
-        fout.write(var + ' ' + str(value) + '\n')
-        fout.close()
-        return 
-    fin = open(filename, 'r')
-    time = core.getTime()
-    fout_name = 'temp_file.' + str(time) 
-    fout = open(fout_name, 'w')
-    for line in fin:
-        these_vals = line.split()
-        if these_vals[0] == var:
-            fout.write(var + ' ' + str(value) + '\n')
-        else:
-            fout.write(line)
-    fin.close()
-    fout.close()
-    move(fout_name, filename)
+    #the value is visible to get_var_from_file right away, the file itself is written by commit_params (at task_end, or on demand)
+    get_param_store(filename).set(var, value)
     
     
        
@@ -907,7 +1627,7 @@ def check_retry_vMeter(g):
         if myDlg.OK:  # then the user pressed OK--try to connect vMeter
             open_and_close_vmeter()
             
-            g.session_params['vMeter'] = try_to_open_vMeter()
+            g.session_params = g.session_params.override('vMeter retry', vMeter = try_to_open_vMeter())
         else:
             raise QuitException()
         
@@ -0,0 +1,288 @@
+#StimTool simulation backend: runs tasks with no screen, no sound, no hardware and no real waiting
+#install() puts stand-ins for psychopy (and pyo and PIL) in sys.modules, so it must be called before StimToolLib or any task is imported
+#time is virtual: it only moves when the task flips the window (one refresh), waits (just_wait, core.wait) or waits for a key
+#keys come from an Agent (random presses after a random reaction time) or a ScriptedAgent (a fixed list of presses)
+#the task runs its normal code path and writes the same output files as a real session, with times in virtual seconds
+#
+#usage: python StimToolSim.py TASK [-s SID] [-o OUTPUT_DIR] [--seed N] [--scan]  (run from the StimTool directory)
+#TASK is a line of a .TL file (e.g. "Planning Task:run=PlanningTask_R1_RIGHT.schedule") or a .TL file, whose tasks are run in order
+
+import sys, os, types, random, time, argparse, importlib
+
+NEVER_PRESSED = ['escape', 's'] #keys an Agent does not press unless told to (see Agent)--'s' is the Planning Task's skip-the-trial debug key
+SIM_SESSION_PARAMS = { #session params every simulated session gets, on top of Default.params and the .TL params
+    'auto_advance': True,
+    'signal_parallel': False,
+    'record_video': False,
+    'redirect_output': False,
+    'parallel_port': 'fake',
+    'session_id': 'SIM',
+}
+
+class SimulationError(Exception):
+    pass
+
+class VirtualClock:
+    #the time (core.getTime) of the simulation
+    def __init__(self):
+        self.now = 0.0
+    def advance(self, seconds):
+        if seconds > 0:
+            self.now = self.now + seconds
+    def advance_to(self, t):
+        self.advance(t - self.now)
+
+class Agent:
+    #the simulated participant/RA: picks a key among the ones the task accepts, after a reaction time drawn from rt (uniform, seconds)
+    #keys in avoid are never pressed--unless they are the only way on (e.g. 'z' when waiting for the scanner)
+    def __init__(self, seed = None, rt = (0.2, 0.6), avoid = NEVER_PRESSED):
+        self.random = random.Random(seed)
+        self.rt = rt
+        self.avoid = avoid
+        self.pending = None #(time, key) of the press polled for with getKeys
+    def choose(self, keys):
+        return self.random.choice(keys)
+    def reaction_time(self):
+        return self.random.uniform(self.rt[0], self.rt[1])
+    def next_press(self, keys, must_press):
+        #(reaction time, key) for a task waiting for one of keys (None: any key), or None to not press anything
+        if keys is None:
+            keys = ['space']
+        candidates = [k for k in keys if k not in self.avoid]
+        if not candidates and must_press:
+            candidates = [k for k in keys if k not in NEVER_PRESSED]
+        if not candidates:
+            if must_press:
+                raise SimulationError('the task waits for ' + str(keys) + ' and the agent may not press any of them')
+            return None
+        return self.reaction_time(), self.choose(candidates)
+    def poll(self, keys, now):
+        #the key pressed by now, if any, for a task checking for keys without waiting (getKeys)
+        if self.pending and keys is not None and self.pending[1] not in keys:
+            self.pending = None #the task moved on to other keys
+        if self.pending is None:
+            press = self.next_press(keys, False)
+            if press is None:
+                return None
+            self.pending = (now + press[0], press[1])
+        if now >= self.pending[0]:
+            key = self.pending[1]
+            self.pending = None
+            return key
+        return None
+
+class ScriptedAgent(Agent):
+    #presses exactly the keys in script, a list of (reaction time, key), in order--a press the task does not accept is an error
+    def __init__(self, script):
+        Agent.__init__(self)
+        self.script = list(script)
+    def next_press(self, keys, must_press):
+        if not self.script:
+            raise SimulationError('script exhausted while the task waits for ' + str(keys))
+        if keys is not None and self.script[0][1] not in keys:
+            if not must_press:
+                return None #the scripted key is for a later question
+            raise SimulationError('scripted key ' + repr(self.script[0][1]) + ' is not one of ' + str(keys))
+        return self.script.pop(0)
+
+class NullStim:
+    #accepts any constructor arguments and attributes, draws nothing; setX(value) sets x
+    def __init__(self, *args, **kwargs):
+        self.__dict__.update(kwargs)
+    def draw(self, *args, **kwargs):
+        pass
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name.startswith('set') and len(name) > 3:
+            attr = name[3].lower() + name[4:]
+            def setter(value, *args, **kwargs):
+                setattr(self, attr, value)
+            return setter
+        return lambda *args, **kwargs: None
+
+class NullWindow(NullStim):
+    #every flip takes one refresh of virtual time
+    def __init__(self, *args, **kwargs):
+        self.color = (0, 0, 0)
+        self.units = 'norm'
+        self.size = (800, 600)
+        self.mouseVisible = True
+        NullStim.__init__(self, *args, **kwargs)
+        self.flips = 0
+    def flip(self, *args, **kwargs):
+        sim.clock.advance(1.0 / sim.refresh_rate)
+        self.flips += 1
+        return sim.clock.now
+
+class NullSound(NullStim):
+    def getDuration(self):
+        return 0
+
+class Dlg(NullStim):
+    #a dialog the RA accepts without changing anything
+    def __init__(self, *args, **kwargs):
+        NullStim.__init__(self, *args, **kwargs)
+        self.data = []
+        self.OK = True
+    def addField(self, label, initial = '', choices = None, **kwargs):
+        self.data.append(choices[0] if choices and initial not in choices else initial)
+    def show(self):
+        return self.data
+
+class Clock:
+    def __init__(self):
+        self.start = sim.clock.now
+    def getTime(self):
+        return sim.clock.now - self.start
+    def reset(self, newT = 0.0):
+        self.start = sim.clock.now - newT
+    def add(self, t):
+        self.start = self.start + t
+
+def get_time():
+    return sim.clock.now
+
+def wait(secs, hogCPUperiod = 0.2):
+    sim.clock.advance(secs)
+
+def quit():
+    raise SystemExit(0)
+
+def get_keys(keyList = None, modifiers = False, timeStamped = False):
+    key = sim.agent.poll(keyList, sim.clock.now)
+    if key is None:
+        return []
+    sim.presses.append((sim.clock.now, key))
+    return [(key, sim.clock.now)] if timeStamped else [key]
+
+def wait_keys(maxWait = float('inf'), keyList = None, modifiers = False, timeStamped = False, clearEvents = True):
+    press = sim.agent.next_press(keyList, maxWait == float('inf'))
+    if press is None or press[0] > maxWait:
+        sim.clock.advance(maxWait)
+        return None
+    sim.clock.advance(press[0])
+    sim.presses.append((sim.clock.now, press[1]))
+    return [(press[1], sim.clock.now)] if timeStamped else [press[1]]
+
+def clear_events(eventType = None):
+    pass
+
+def get_date_str(format = '%Y_%b_%d_%H%M'):
+    return time.strftime(format)
+
+def just_wait(c, end_time):
+    #StimToolLib.just_wait without the waiting: virtual time jumps to end_time
+    import StimToolLib
+    remaining = end_time - c.getTime()
+    if remaining > 0:
+        sim.clock.advance(remaining)
+        StimToolLib.wait_overshoots.append((end_time, 0.0))
+
+def decode_slide(slide, directory, g):
+    #StimToolLib.decode_slide without reading the image (nothing is drawn)--make_slide_stim makes a NullSound from the sound file
+    return os.path.join(directory, slide[0]), (None if slide[1] == 'None' else (os.path.join(directory, slide[1]), 1.0))
+
+def module(name, **attrs):
+    m = types.ModuleType(name)
+    m.__dict__.update(attrs)
+    return m
+
+def null_module(name, **attrs):
+    #module where every name not given in attrs is NullStim (e.g. visual.ShapeStim, pyo.Server)
+    m = module(name, **attrs)
+    m.__getattr__ = lambda attr: NullStim
+    return m
+
+sim = types.SimpleNamespace(clock = None, agent = None, refresh_rate = 60, presses = [], installed = False)
+
+def install(agent = None, refresh_rate = 60):
+    #replace psychopy, pyo and PIL for this process--call before StimToolLib, StimTool or any task is imported
+    sim.clock = VirtualClock()
+    sim.agent = agent or Agent()
+    sim.refresh_rate = refresh_rate
+    sim.presses = []
+    if sim.installed:
+        return
+    visual = null_module('psychopy.visual', Window = NullWindow)
+    visual.windowwarp = null_module('psychopy.visual.windowwarp')
+    hardware = module('psychopy.hardware')
+    hardware.joystick = null_module('psychopy.hardware.joystick', getNumJoysticks = lambda: 0)
+    modules = {
+        'psychopy.visual': visual,
+        'psychopy.visual.windowwarp': visual.windowwarp,
+        'psychopy.hardware': hardware,
+        'psychopy.hardware.joystick': hardware.joystick,
+        'psychopy.core': module('psychopy.core', getTime = get_time, Clock = Clock, MonotonicClock = Clock, wait = wait, rush = lambda *args, **kwargs: None, quit = quit),
+        'psychopy.event': module('psychopy.event', getKeys = get_keys, waitKeys = wait_keys, clearEvents = clear_events, Mouse = NullStim),
+        'psychopy.gui': module('psychopy.gui', Dlg = Dlg),
+        'psychopy.sound': module('psychopy.sound', Sound = NullSound),
+        'psychopy.monitors': null_module('psychopy.monitors'),
+        'psychopy.data': module('psychopy.data', getDateStr = get_date_str),
+        'psychopy.logging': null_module('psychopy.logging'),
+        'pyo': null_module('pyo'),
+    }
+    pil = module('PIL')
+    pil.__path__ = []
+    pil.Image = null_module('PIL.Image') #nothing is decoded (see decode_slide) or baked in a simulation
+    modules['PIL'] = pil
+    modules['PIL.Image'] = pil.Image
+    psychopy = module('psychopy', prefs = types.SimpleNamespace(hardware = {}, general = {}))
+    psychopy.__path__ = []
+    modules['psychopy'] = psychopy
+    for name, m in modules.items():
+        if name.startswith('psychopy.') and name.count('.') == 1:
+            setattr(psychopy, name.split('.')[1], m)
+    for name in list(sys.modules):
+        if name in ('psychopy', 'PIL') or name.startswith('psychopy.') or name.startswith('PIL.'):
+            del sys.modules[name]
+    sys.modules.update(modules)
+    import StimToolLib
+    StimToolLib.just_wait = just_wait
+    StimToolLib.decode_slide = decode_slide
+    sim.installed = True
+
+def session_params(sid, output_dir, task_list = None, scan = False, extra = {}):
+    #the session params StimTool would build for this session (see StimTool.py), with SIM_SESSION_PARAMS on top
+    import StimToolLib
+    layers = [('dialog', {'SID': sid, 'raID': 'SIM'}), 'Default.params', ('session', {'admin_id': 'SIM'})]
+    if task_list:
+        layers.append(task_list[0:-3] + '.params')
+    values = dict(SIM_SESSION_PARAMS)
+    values.update({'output_dir': output_dir, 'scan': scan})
+    values.update(extra)
+    layers.append(('simulation', values))
+    return StimToolLib.load_config(layers)
+
+def run_task(task, params):
+    #run one .TL line ("Task Name:arg=value ...")--returns the task's status (0: completed)
+    import StimToolLib, StimTool
+    StimToolLib.select_parallel_port(params.get('parallel_port', 'fake'))
+    task_and_args = task.split(':')
+    run_params = StimToolLib.convert_run_args_to_dict(task_and_args[1]) if len(task_and_args) > 1 else {}
+    return StimTool.task_module(task_and_args[0]).run(params, run_params)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run StimTool tasks headless, in virtual time, with a simulated participant.')
+    parser.add_argument('task', help = 'a .TL line (e.g. "Planning Task:run=PlanningTask_R1_RIGHT.schedule") or a .TL file')
+    parser.add_argument('-s', '--sid', default = 'SIM001', help = 'subject ID written in the output')
+    parser.add_argument('-o', '--output_dir', default = 'sim_output', help = 'where the output files go')
+    parser.add_argument('--seed', type = int, default = None, help = 'seed of the simulated participant')
+    parser.add_argument('--scan', action = 'store_true', help = 'run as a scan session (wait for the scanner)')
+    args = parser.parse_args(argv)
+    install(Agent(args.seed))
+    if args.task.endswith('.TL'):
+        with open(args.task) as f:
+            tasks = [t for t in f.read().splitlines() if t.strip()]
+        params = session_params(args.sid, args.output_dir, args.task, args.scan)
+    else:
+        tasks = [args.task]
+        params = session_params(args.sid, args.output_dir, scan = args.scan)
+    for task in tasks:
+        start = time.perf_counter()
+        task_start = sim.clock.now
+        status = run_task(task, params)
+        print('%s: status %i, %.1f s of task time in %.2f s' % (task, status, sim.clock.now - task_start, time.perf_counter() - start))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#compare StimToolLib.just_wait with the wait loop it replaced (check escape, then core.wait(0.001), until the deadline)
+#for each: CPU time used per second of waiting, and how late the waits end
+#usage: python wait_benchmark.py [-n WAITS] [-d SECONDS] [-m SPIN_MARGIN]  (run from the StimTool directory)
+
+import argparse, time, numpy
+from psychopy import core, event
+import StimToolLib
+
+def legacy_just_wait(c, end_time):
+    while c.getTime() < end_time:
+        if event.getKeys(["escape"]):
+            raise StimToolLib.QuitException()
+        StimToolLib.short_wait()
+
+def measure(wait, n, duration):
+    #(CPU seconds per second waited, overshoots in seconds)
+    c = core.Clock()
+    overshoots = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for i in range(n):
+        end_time = c.getTime() + duration
+        wait(c, end_time)
+        overshoots.append(c.getTime() - end_time)
+    return (time.process_time() - cpu_start) / (time.perf_counter() - wall_start), numpy.array(overshoots)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark StimToolLib.just_wait against the previous busy wait.')
+    parser.add_argument('-n', '--waits', type = int, default = 20, help = 'waits per implementation')
+    parser.add_argument('-d', '--duration', type = float, default = 0.5, help = 'length of each wait in seconds')
+    parser.add_argument('-m', '--margin', type = float, default = StimToolLib.WAIT_SPIN_MARGIN, help = 'spin margin for just_wait in seconds')
+    args = parser.parse_args(argv)
+    StimToolLib.wait_spin_margin = args.margin
+    print('implementation,cpu_percent,mean_overshoot_ms,p99_overshoot_ms,max_overshoot_ms')
+    for name, wait in [('legacy', legacy_just_wait), ('just_wait', StimToolLib.just_wait)]:
+        cpu, overshoots = measure(wait, args.waits, args.duration)
+        ms = overshoots * 1000
+        print('%s,%.1f,%.3f,%.3f,%.3f' % (name, cpu * 100, ms.mean(), numpy.percentile(ms, 99), ms.max()))
+
+if __name__ == '__main__':
+    main()